@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+
+class AnnotationJournal:
+    """Append-only log of the annotations made since a country's model artifact was last written. It is replayed
+    when the model is loaded and cleared once the labels have been compacted into the artifact."""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, JOURNAL)
+        self._lock = threading.Lock()
+        self._num_entries = None
+
+    def append(self, language: str, tender_id: str, label: int, version: int) -> int:
+        """Durably record an annotation
+
+        Returns:
+            int: Size of the journal in bytes after the annotation
+        """
+        entry = {
+            "language": language,
+            "tender_id": tender_id,
+            "label": label,
+            "version": version,
+        }
+        with self._lock:
+            num_entries = len(self)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a+b") as f:
+                AnnotationJournal.truncate_torn_line(f)
+                f.write((json.dumps(entry) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            self._num_entries = num_entries + 1
+        return size
+
+    @staticmethod
+    def truncate_torn_line(f):
+        """Cut a partially written last line (from a crash) off the journal, so the next entry starts on its own
+        line instead of being appended to the torn one"""
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        f.truncate(f.read().rfind(b"\n") + 1)
+
+    def entries(self) -> List[Dict]:
+        """All recorded annotations, oldest first. A partially written last line (from a crash) is ignored."""
+        return self.read()[0]
+
+    def read(self, offset: int = 0) -> Tuple[List[Dict], int]:
+        """Annotations recorded after a byte offset, and the offset up to which they were read (the end of the
+        last complete line)"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        entries = []
+        end = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            end += len(line)
+        return entries, offset + end
+
+    def size(self) -> int:
+        """Size of the journal in bytes, cheap enough to check on every read"""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._num_entries = 0
+
+    def __len__(self) -> int:
+        if self._num_entries is None:
+            self._num_entries = len(self.entries())
+        return self._num_entries
+
+
+JOURNAL = "annotations.jsonl"
@@ -0,0 +1,353 @@
+"""Benchmark the training pipeline on synthetic tenders, without the production database. For every country and
+corpus size a deterministic corpus is generated, served by an in-process stand-in for the postgres calls, and each
+phase of training a country model is timed. Run from src/, e.g.
+
+    python benchmark.py --save-baseline     # record the baseline on this machine
+    python benchmark.py                     # compare against it, exits with status 1 on regressions
+
+The production functions are timed, so their regressions show up here: fetch, preprocess (Trainer.preprocess_rows
+in a single process with a cold lemma cache, i.e. cleaning, tokenizing and lemmatizing), the phases Trainer.fit
+records with metrics.phase (count, vectorize, fit, predict, token_store), save and write-back
+(PostgresCountryModel.update_predictions, with a cursor that renders its statements like psycopg2 and discards them,
+so the database round trips are only part of it when --round-trip-ms simulates their latency)."""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Tuple
+from psycopg2.extensions import adapt
+import trainer
+import metrics
+from model import PostgresCountryModel, country2language
+from model_data import CountryModelData
+from lemma_cache import LemmaCache, get_lemma_cache
+from config import (
+    BENCHMARK_BASELINE_PATH,
+    BENCHMARK_REGRESSION_TOLERANCE,
+    BENCHMARK_MIN_SECONDS,
+)
+
+COUNTRIES = ["DE", "FR", "IT", "PL"]
+SIZES = [1000, 5000, 20000]
+PHASES = [
+    "fetch",
+    "preprocess",
+    "count",
+    "vectorize",
+    "fit",
+    "predict",
+    "token_store",
+    "save",
+    "write_back",
+]
+# phases timed inside Trainer.fit
+FIT_PHASES = ["count", "vectorize", "fit", "predict", "token_store"]
+
+# inflected procurement vocabulary per language, split into words typical of innovative and of other tenders
+WORDS = {
+    "de": (
+        "innovative digitale Plattform Software Entwicklung entwickelten Forschung Prototypen Sensoren "
+        "intelligente Datenanalyse Pilotprojekt Cloudlösungen künstlichen Intelligenz vernetzten Systeme",
+        "Lieferung Reinigung Bauarbeiten Straßen Wartung Büromöbel Fahrzeuge Verpflegung Dienstleistungen "
+        "Gebäude Instandhaltung Beschaffung Lieferungen Leistungen Arbeiten Schulen",
+    ),
+    "fr": (
+        "innovante numérique plateforme logiciels développement recherche prototypes capteurs intelligents "
+        "analyse données projet pilote solutions infonuagiques intelligence artificielle systèmes connectés",
+        "fourniture nettoyage travaux routes entretien mobilier véhicules restauration services bâtiments "
+        "maintenance achats fournitures prestations marchés écoles",
+    ),
+    "it": (
+        "innovativa digitale piattaforma software sviluppo ricerca prototipi sensori intelligenti analisi "
+        "dati progetto pilota soluzioni cloud intelligenza artificiale sistemi connessi",
+        "fornitura pulizia lavori strade manutenzione arredi veicoli ristorazione servizi edifici acquisti "
+        "forniture prestazioni appalti scuole",
+    ),
+    "pl": (
+        "innowacyjna cyfrowa platforma oprogramowanie rozwój badania prototypy czujniki inteligentne analiza "
+        "danych projekt pilotażowy rozwiązania chmurowe sztuczna inteligencja systemy połączone",
+        "dostawa sprzątanie roboty drogi utrzymanie meble pojazdy żywienie usługi budynki remonty zakupy "
+        "dostawy świadczenie zamówienia szkoły",
+    ),
+}
+# syllables of the synthetic long tail of rare words (names, places, product codes)
+SYLLABLES = "ka lo mi ne ra to vi su pe da ri no ba se lu mo ti ve ga zo".split()
+TAIL_SIZE = 20000
+
+
+def country_seed(country: str, seed: int) -> int:
+    return zlib.crc32(country.encode("utf-8")) + seed
+
+
+def synthetic_rows(
+    country: str, num_rows: int, seed: int = 0, labeled_ratio: float = 0.3
+) -> List[Tuple]:
+    """Deterministic synthetic tenders of a country, in the row layout Trainer.check_example and
+    Trainer.return_input expect (text in trainer.TEXT_COLUMNS, label at 5, tender ID at 7). About a fifth of the
+    tenders are innovative; labeled_ratio of them are labeled, the rest have no label."""
+    language = country2language[country]
+    rng = random.Random(country_seed(country, seed))
+    innovative_words, other_words = (words.split() for words in WORDS[language])
+    tail = [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        for _ in range(TAIL_SIZE)
+    ]
+    # Zipf distributed tail
+    tail_weights = list(itertools.accumulate(1 / rank for rank in range(1, TAIL_SIZE + 1)))
+
+    def text(topic_words: List[str], num_words: int) -> str:
+        return " ".join(
+            rng.choice(topic_words) if rng.random() < 0.4 else tail_word
+            for tail_word in rng.choices(tail, cum_weights=tail_weights, k=num_words)
+        )
+
+    rows = []
+    for row in range(num_rows):
+        innovative = rng.random() < 0.2
+        topic_words = innovative_words if innovative else other_words
+        if rng.random() < 0.1:
+            # a few innovative words in other tenders and vice versa
+            topic_words = topic_words + (other_words if innovative else innovative_words)
+        texts = [
+            text(topic_words, rng.randint(4, 12)).capitalize(),
+            text(topic_words, rng.randint(40, 300)) + ".",
+            text(topic_words, rng.randint(0, 40)),
+        ]
+        columns = [row, country, None, None, None, None, None, 100000 + row]
+        for index, column_text in zip(trainer.TEXT_COLUMNS, texts):
+            columns[index] = column_text
+        if rng.random() < labeled_ratio:
+            columns[5] = int(innovative)
+        rows.append(tuple(columns))
+    return rows
+
+
+def text_hash(row: Tuple) -> str:
+    """Hash of the text columns, as PostgresCountryModel.text_hash_sql computes it"""
+    return hashlib.md5(
+        "|".join(row[index] or "" for index in trainer.TEXT_COLUMNS).encode("utf-8")
+    ).hexdigest()
+
+
+class DiscardingCursor:
+    """Stand-in for a psycopg2 cursor: statements are rendered on the client like psycopg2 renders them (adapting
+    and quoting every parameter) and then discarded, after waiting round_trip_seconds for each of them. Counts the
+    statements and their bytes."""
+
+    connection = SimpleNamespace(encoding="UTF8")
+
+    def __init__(self, round_trip_seconds: float = 0.0):
+        self.round_trip_seconds = round_trip_seconds
+        self.statements = 0
+        self.bytes = 0
+
+    def mogrify(self, query, vars=None) -> bytes:
+        if isinstance(query, str):
+            query = query.encode("utf-8")
+        if not vars:
+            return query
+        return query % tuple(adapt(value).getquoted() for value in vars)
+
+    def execute(self, query, vars=None):
+        query = self.mogrify(query, vars)
+        self.statements += 1
+        self.bytes += len(query)
+        if self.round_trip_seconds:
+            time.sleep(self.round_trip_seconds)
+
+
+class DiscardingPool:
+    """Stand-in for database.ConnectionPool handing out DiscardingCursors, the commit at the end of a cursor block
+    takes one more round trip"""
+
+    def __init__(self, round_trip_seconds: float = 0.0):
+        self.round_trip_seconds = round_trip_seconds
+        self.cursors = []
+
+    @contextmanager
+    def cursor(self):
+        cursor = DiscardingCursor(self.round_trip_seconds)
+        self.cursors.append(cursor)
+        yield cursor
+        if self.round_trip_seconds:
+            time.sleep(self.round_trip_seconds)
+
+
+class InMemoryCountryModel(PostgresCountryModel):
+    """PostgresCountryModel whose postgres reads are served from synthetic rows held in memory. Writes go to a
+    DiscardingPool."""
+
+    def __init__(self, rows: Dict[str, List[Tuple]], round_trip_seconds: float = 0.0):
+        self.rows = rows
+        self.pool = DiscardingPool(round_trip_seconds)
+
+    def fetch_text_hashes(self, country: str) -> List:
+        return [(row[7], text_hash(row), row[5]) for row in self.rows[country]]
+
+    def fetch_dataset(self, country: str, tender_ids: List = None) -> Iterator[Tuple]:
+        rows = self.rows[country]
+        if tender_ids is not None:
+            tender_ids = set(tender_ids)
+            rows = [row for row in rows if row[7] in tender_ids]
+        for row in rows:
+            yield row + (text_hash(row),)
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    def __call__(self, phase: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.seconds[phase] = time.perf_counter() - start
+        return result
+
+
+def benchmark_country(
+    model: InMemoryCountryModel, country: str, save_start_path: str
+) -> Dict[str, float]:
+    """Time the phases of training a country model from scratch
+
+    Returns:
+        Dict[str, float]: Seconds per phase
+    """
+    language = country2language[country]
+    timer = PhaseTimer()
+    rows = timer("fetch", lambda: list(model.fetch_dataset(country)))
+
+    # the first lemmatization loads the language's dictionary, which is not part of the timings
+    LemmaCache(language).lemmatize(language)
+    get_lemma_cache(language).cache.clear()
+    preprocessed = timer(
+        "preprocess",
+        lambda: list(trainer.Trainer.preprocess_rows(rows, language, num_workers=1)),
+    )
+    examples, inference_examples = trainer.Trainer.split_examples(preprocessed)
+
+    phase_seconds = metrics.phase_seconds()
+    language_model_data = trainer.Trainer.fit(examples, inference_examples)
+    for phase, seconds in metrics.phase_seconds().items():
+        if phase in FIT_PHASES:
+            timer.seconds[phase] = seconds - phase_seconds.get(phase, 0.0)
+
+    country_model_data = CountryModelData(
+        country, {language: language_model_data}, save_start_path
+    )
+    timer("save", country_model_data.save)
+    timer(
+        "write_back",
+        model.update_predictions,
+        language_model_data.tender_data,
+        country,
+    )
+    return timer.seconds
+
+
+def run(
+    countries: List[str], sizes: List[int], repeat: int = 1, round_trip_seconds: float = 0.0
+) -> Dict:
+    """Benchmark every country at every size, keeping the fastest of repeat runs per phase. round_trip_seconds
+    simulates the latency of every database statement and commit of the write-back.
+
+    Returns:
+        Dict: {country: {size: {phase: seconds}}}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as save_start_path:
+        for country in countries:
+            results[country] = {}
+            for size in sizes:
+                model = InMemoryCountryModel(
+                    {country: synthetic_rows(country, size)}, round_trip_seconds
+                )
+                runs = [
+                    benchmark_country(model, country, save_start_path)
+                    for _ in range(repeat)
+                ]
+                results[country][str(size)] = {
+                    phase: min(seconds[phase] for seconds in runs) for phase in PHASES
+                }
+                print(
+                    f"{country} {size:>7}: "
+                    + " ".join(
+                        f"{phase} {seconds:.3f}s"
+                        for phase, seconds in results[country][str(size)].items()
+                    )
+                )
+    return results
+
+
+def regressions(results: Dict, baseline: Dict) -> List[str]:
+    """Phases that got slower than the baseline by more than BENCHMARK_REGRESSION_TOLERANCE (and by more than
+    BENCHMARK_MIN_SECONDS, so that noise in very short phases is not reported)"""
+    found = []
+    for country, sizes in results.items():
+        for size, phases in sizes.items():
+            baseline_phases = baseline.get(country, {}).get(size, {})
+            for phase, seconds in phases.items():
+                baseline_seconds = baseline_phases.get(phase)
+                if baseline_seconds is None:
+                    continue
+                if (
+                    seconds > baseline_seconds * (1 + BENCHMARK_REGRESSION_TOLERANCE)
+                    and seconds - baseline_seconds > BENCHMARK_MIN_SECONDS
+                ):
+                    found.append(
+                        f"{country} {size} {phase}: {seconds:.3f}s (baseline {baseline_seconds:.3f}s)"
+                    )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--countries", nargs="+", default=COUNTRIES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--round-trip-ms",
+        type=float,
+        default=0.0,
+        help="simulated latency of every database statement and commit of the write-back",
+    )
+    parser.add_argument("--baseline", default=BENCHMARK_BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline instead of comparing against it",
+    )
+    args = parser.parse_args()
+
+    results = run(args.countries, args.sizes, args.repeat, args.round_trip_ms / 1000)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline + ".tmp", "w") as f:
+            json.dump(results, f, indent=2)
+        os.replace(args.baseline + ".tmp", args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    found = regressions(results, baseline)
+    for regression in found:
+        print(f"Regression: {regression}")
+    if found:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
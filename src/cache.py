@@ -0,0 +1,96 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+def default_sizeof(key: Hashable, value: Any) -> int:
+    """Shallow size estimate of a cache entry"""
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class LRUCache:
+    """Thread-safe least recently used cache bounded by the estimated size of its entries in bytes."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[Hashable, Any], int] = default_sizeof,
+        min_entries: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # number of most recently used entries that are kept even when they exceed max_bytes
+        self.min_entries = min_entries
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key (marking it as recently used), or default on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        """Insert or replace a value, evicting the least recently used entries to stay within max_bytes.
+        Values larger than max_bytes on their own are not cached, unless min_entries is set."""
+        size = self.sizeof(key, value)
+        with self._lock:
+            if key in self._entries:
+                self.num_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes and self.min_entries == 0:
+                return
+            self._entries[key] = (value, size)
+            self.num_bytes += size
+            while (
+                self.num_bytes > self.max_bytes
+                and len(self._entries) > self.min_entries
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key from the cache and return its value"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.num_bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    def items(self):
+        """Snapshot of the cached (key, value) pairs, from least to most recently used"""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Size and hit/miss statistics of the cache"""
+        return {
+            "Entries": len(self._entries),
+            "Bytes": self.num_bytes,
+            "MaxBytes": self.max_bytes,
+            "Hits": self.hits,
+            "Misses": self.misses,
+            "Evictions": self.evictions,
+        }
@@ -1 +1,98 @@
 NUM_WORDS = 5
+
+# number of processes used to train countries without a saved model at startup (1 trains them sequentially)
+BOOTSTRAP_WORKERS = 4
+# memory budget shared by the bootstrap processes, countries are only scheduled while their estimate fits
+BOOTSTRAP_MEMORY_BUDGET_MB = 16000
+# rough peak memory needed to train on a single database row, used to estimate each country's footprint
+BOOTSTRAP_MEMORY_PER_ROW_KB = 64
+
+# number of processes and rows per chunk used to clean and lemmatize the dataset during training
+PREPROCESS_WORKERS = 4
+PREPROCESS_CHUNK_SIZE = 1000
+
+# memory bound of the token to lemma cache of each language
+LEMMA_CACHE_MAX_MB = 256
+
+# rows per multi-row UPDATE statement when writing predictions back to the database
+PREDICTION_UPDATE_PAGE_SIZE = 10000
+
+# database connection pool: maximum number of connections, seconds to wait for a free one,
+# seconds after which idle connections are closed or health checked before being reused
+DB_POOL_MAX_CONNECTIONS = 8
+DB_POOL_TIMEOUT_SECONDS = 30
+DB_POOL_MAX_IDLE_SECONDS = 300
+DB_POOL_HEALTH_CHECK_SECONDS = 30
+
+# rows per round-trip when streaming a country's dataset from the database
+FETCH_BATCH_SIZE = 2000
+
+# number of countries that can be retrained concurrently in the background, and finished jobs to remember
+RETRAIN_WORKERS = 2
+RETRAIN_JOB_HISTORY = 100
+
+# memory budget of the country models that are kept loaded (least recently used ones are unloaded)
+MODEL_CACHE_MAX_MB = 4096
+
+# number of journaled annotations after which a country's labels are written back into its model artifact
+ANNOTATION_COMPACT_THRESHOLD = 100
+
+# memory budget of the per-country global importance data (column-major features of the models)
+GLOBAL_IMPORTANCE_CACHE_MAX_MB = 1024
+
+# threads rendering explanation plots, and the memory budget of the rendered plots that are kept
+PLOT_WORKERS = 2
+PLOT_CACHE_MAX_MB = 256
+
+# maximum number of tenders per /tender_details_batch request
+TENDER_BATCH_MAX_SIZE = 500
+
+# /score requests arriving within this many milliseconds are scored together, in batches of at most this size
+SCORE_BATCH_WAIT_MS = 5
+SCORE_BATCH_MAX_SIZE = 64
+# seconds a /score request waits for its batch before it fails
+SCORE_BATCH_TIMEOUT_SECONDS = 30
+
+# production server (run.py --production): worker processes, threads per worker, listen backlog and the time
+# a replaced worker gets to finish its requests
+SERVER_WORKERS = 4
+SERVER_THREADS = 8
+SERVER_BACKLOG = 1024
+SERVER_GRACEFUL_TIMEOUT_SECONDS = 30
+
+# memory budget of the serialized (and compressed) responses of the country and global explanation endpoints
+RESPONSE_CACHE_MAX_MB = 256
+
+# retraining modes: "full" preprocesses the country's tenders from the database again (picking up new tenders and
+# label changes made in the database), "fast" retrains from the term counts stored with the model (for deleting and
+# reenabling words) and has to be requested explicitly
+RETRAIN_MODES = ("fast", "full")
+RETRAIN_MODE = "full"
+
+# classifier solver used until solver_benchmark.py has picked one (it writes its choice to SOLVER_PATH), and the
+# largest fraction of predictions and largest probability difference a solver or a warm-started fit may show
+# compared to a cold start with lbfgs
+CLASSIFIER_SOLVER = "lbfgs"
+SOLVER_PATH = "./data/solver.json"
+SOLVER_PREDICTION_TOLERANCE = 0.001
+SOLVER_PROBABILITY_TOLERANCE = 0.01
+
+# seconds between two rounds of scoring the tenders added to the database since the models were trained
+DELTA_SCORING_INTERVAL_SECONDS = 300
+
+# scored new tenders are kept in pending files next to a model and appended to it (which rewrites its files) once
+# they reach this fraction of its tenders, or once the oldest of them was scored this many seconds ago
+DELTA_FOLD_FRACTION = 0.05
+DELTA_FOLD_MAX_AGE_SECONDS = 24 * 3600
+
+# benchmark.py: where the baseline timings are stored, the relative slowdown of a phase reported as a regression,
+# and the absolute slowdown below which differences are treated as noise
+BENCHMARK_BASELINE_PATH = "./data/benchmark_baseline.json"
+BENCHMARK_REGRESSION_TOLERANCE = 0.25
+BENCHMARK_MIN_SECONDS = 0.05
+
+# metrics (/dgcnect/metrics): prometheus_client multiprocess directory (unless PROMETHEUS_MULTIPROC_DIR is set), and
+# the histogram buckets (in seconds) of request and query latencies and of training phases and model loads
+METRICS_DIRECTORY = "./data/metrics"
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
@@ -0,0 +1,97 @@
+import threading
+import weakref
+from typing import Dict
+import numpy as np
+from model_data import TenderData
+
+# confusion matrix partitions shown on the country details page, in response order
+CATEGORIES = [
+    "TruePositive",
+    "TrueNegative",
+    "FalsePositive",
+    "FalseNegative",
+    "UnlabeledPositive",
+    "UnlabeledNegative",
+]
+
+POSITIVE_CATEGORIES = ("TruePositive", "FalsePositive", "UnlabeledPositive")
+
+
+def categorize(labels: np.ndarray, predictions: np.ndarray) -> np.ndarray:
+    """Index into CATEGORIES for every tender"""
+    labels = np.asarray(labels)
+    predictions = np.asarray(predictions)
+    categories = np.where(
+        labels == 1,
+        np.where(predictions == 1, 0, 3),
+        np.where(
+            labels == 0,
+            np.where(predictions == 0, 1, 2),
+            np.where(predictions == 0, 5, 4),
+        ),
+    )
+    return categories.astype(np.int8)
+
+
+class ConfusionIndex:
+    """Partition of a country's tenders into the confusion matrix categories, for one model version. The tender ID
+    lists are built on first request and cached; annotations only rebuild the categories they move a tender between.
+    Only the categories are stored: the tender data is referenced weakly, so an index does not keep a model that
+    was evicted from the model cache in memory."""
+
+    def __init__(self, tender_data: TenderData, version: int):
+        self._tender_data = weakref.ref(tender_data)
+        self.version = version
+        self.categories = categorize(tender_data.labels, tender_data.predictions)
+        self.metadata = tender_data.summary()
+        self._tender_ids = {}
+        self._lock = threading.Lock()
+
+    def is_for(self, tender_data: TenderData) -> bool:
+        """Whether the index was built from this tender data (and not from a copy loaded before an eviction)"""
+        indexed_tender_data = self._tender_data()
+        return indexed_tender_data is not None and indexed_tender_data is tender_data
+
+    def details(self, tender_ids) -> Dict:
+        """Descriptives and tender IDs per category
+
+        Args:
+            tender_ids: Tender IDs of the tender data the index was built from
+        """
+        with self._lock:
+            for category_index, category in enumerate(CATEGORIES):
+                if category not in self._tender_ids:
+                    self._tender_ids[category] = [
+                        str(tender_id)
+                        for tender_id in np.asarray(tender_ids)[
+                            self.categories == category_index
+                        ]
+                    ]
+            return {
+                "Metadata": dict(self.metadata),
+                "Details": {category: self._tender_ids[category] for category in CATEGORIES},
+            }
+
+    def update_label(
+        self, tender_index: int, previous_label: int, label: int, version: int
+    ):
+        """Move a tender to the category of its new label
+
+        Args:
+            tender_index (int): Row of the annotated tender
+            previous_label (int): Label before the annotation
+            label (int): Label after the annotation
+            version (int): Model version after the annotation
+        """
+        with self._lock:
+            previous_category = self.categories[tender_index]
+            # the categories of positive predictions are TruePositive, FalsePositive and UnlabeledPositive
+            prediction = int(CATEGORIES[previous_category] in POSITIVE_CATEGORIES)
+            category = categorize(label, prediction).item()
+            self.categories[tender_index] = category
+            self._tender_ids.pop(CATEGORIES[previous_category], None)
+            self._tender_ids.pop(CATEGORIES[category], None)
+            innovative_change = int(label == 1) - int(previous_label == 1)
+            self.metadata["NumInnovative"] += innovative_change
+            self.metadata["NumNonInnovative"] -= innovative_change
+            self.version = version
@@ -0,0 +1,112 @@
+import os
+import pickle
+from typing import Iterable, List, Optional, Tuple
+
+# bump when preprocessing changes, so stores built by older code are rebuilt from scratch
+CORPUS_STORE_VERSION = 1
+
+
+class CorpusStore:
+    """Persisted corpus of preprocessed tenders for a single country. Entries are keyed by tender ID and
+    remember the hash of the source text they were built from, so a retrain only has to fetch and
+    preprocess tenders that are new or changed since the last build."""
+
+    @classmethod
+    def load(
+        cls, country: str, language: str, save_start_path: str = "./data"
+    ) -> "CorpusStore":
+        """Load the store of a country. Starts empty if there is none, or if it was built by an older
+        preprocessing version or for another language."""
+        path = CorpusStore.path(country, save_start_path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+            if (
+                saved["version"] == CORPUS_STORE_VERSION
+                and saved["language"] == language
+            ):
+                return cls(country, language, saved["entries"], save_start_path)
+        return cls(country, language, save_start_path=save_start_path)
+
+    @staticmethod
+    def path(country: str, save_start_path: str = "./data") -> str:
+        return os.path.join(save_start_path, f"{country}.corpus.pickle")
+
+    def __init__(self, country, language, entries=None, save_start_path="./data"):
+        self.country = country
+        self.language = language
+        # tender ID -> (text hash, original tokens, lemmatized tokens), tokens are None for empty tenders
+        self.entries = entries if entries is not None else {}
+        self.save_start_path = save_start_path
+
+    def save(self):
+        """Save the store to a file."""
+        path = CorpusStore.path(self.country, self.save_start_path)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(
+                {
+                    "version": CORPUS_STORE_VERSION,
+                    "language": self.language,
+                    "entries": self.entries,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(path + ".tmp", path)
+
+    def stale_tender_ids(self, text_hashes: Iterable[Tuple]) -> List:
+        """Find tenders that are missing from the store or whose text changed
+
+        Args:
+            text_hashes (Iterable[Tuple]): (tender ID, text hash, label) rows of the country
+
+        Returns:
+            List: Tender IDs (as stored in the database) to fetch and preprocess
+        """
+        stale_tender_ids = []
+        for tender_id, text_hash, _ in text_hashes:
+            entry = self.entries.get(str(tender_id))
+            if entry is None or entry[0] != text_hash:
+                stale_tender_ids.append(tender_id)
+        return stale_tender_ids
+
+    def update(
+        self,
+        tender_id: str,
+        text_hash: str,
+        original: Optional[str],
+        input_text: Optional[str],
+    ):
+        self.entries[tender_id] = (text_hash, original, input_text)
+
+    def examples(self, text_hashes: Iterable[Tuple]) -> List[Tuple]:
+        """Assemble the preprocessed corpus in database order with up to date labels, dropping entries of
+        tenders that no longer exist. Tenders without an entry (deleted between fetching the hashes and
+        fetching their rows) are left out.
+
+        Args:
+            text_hashes (Iterable[Tuple]): (tender ID, text hash, label) rows of the country
+
+        Returns:
+            List[Tuple]: (original, input_text, label, tender_id) rows as produced by Trainer.preprocess_rows
+        """
+        preprocessed = []
+        entries = {}
+        for tender_id, _, label in text_hashes:
+            tender_id = str(tender_id)
+            entry = self.entries.get(tender_id)
+            if entry is None:
+                continue
+            entries[tender_id] = entry
+            if entry[1] is None:
+                continue
+            preprocessed.append(
+                (
+                    entry[1],
+                    entry[2],
+                    int(label) if label is not None else None,
+                    tender_id,
+                )
+            )
+        self.entries = entries
+        return preprocessed
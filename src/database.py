@@ -0,0 +1,271 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+import psycopg2
+from psycopg2 import extensions
+import metrics
+from database_login import DBNAME, USER, PASSWORD, HOST, PORT
+from config import (
+    DB_POOL_MAX_CONNECTIONS,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_MAX_IDLE_SECONDS,
+    DB_POOL_HEALTH_CHECK_SECONDS,
+)
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Cursor recording the duration of its statements and the rows they returned or changed. Rows of server-side
+    (named) cursors are counted as they are fetched, iteration fetches and counts them itersize rows at a time."""
+
+    def execute(self, query, vars=None):
+        self.statement = metrics.statement(query)
+        self._iterated_rows = deque()
+        with metrics.DB_QUERY_SECONDS.labels(statement=self.statement).time():
+            result = super().execute(query, vars)
+        if self.name is None and self.rowcount > 0:
+            metrics.DB_QUERY_ROWS.labels(statement=self.statement).inc(self.rowcount)
+        return result
+
+    def _count_fetched(self, num_rows: int):
+        if self.name is not None and num_rows:
+            metrics.DB_QUERY_ROWS.labels(statement=self.statement).inc(num_rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count_fetched(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count_fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count_fetched(len(rows))
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        rows = getattr(self, "_iterated_rows", None)
+        if not rows:
+            rows = self._iterated_rows = deque(self.fetchmany(self.itersize))
+            if not rows:
+                raise StopIteration
+        return rows.popleft()
+
+
+def connect():
+    """Open a new postgres connection"""
+    return psycopg2.connect(
+        dbname=DBNAME,
+        user=USER,
+        password=PASSWORD,
+        host=HOST,
+        port=PORT,
+        cursor_factory=InstrumentedCursor,
+    )
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of postgres connections. Connections are health checked when they have been
+    idle for a while, closed when idle for too long, and never shared between threads or forked processes."""
+
+    def __init__(
+        self,
+        max_connections: int = DB_POOL_MAX_CONNECTIONS,
+        timeout: float = DB_POOL_TIMEOUT_SECONDS,
+        max_idle_seconds: float = DB_POOL_MAX_IDLE_SECONDS,
+        health_check_seconds: float = DB_POOL_HEALTH_CHECK_SECONDS,
+        connect=connect,
+    ):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.connect = connect
+        self._condition = threading.Condition()
+        # (connection, time it was released), most recently used last
+        self._idle = []
+        self._num_open = 0
+        self._pid = os.getpid()
+        # connections inherited through fork, referenced so they are never closed from this process
+        self._inherited = []
+
+        self.num_acquired = 0
+        self.num_waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.num_opened = 0
+        self.num_closed = 0
+        self.num_failed_health_checks = 0
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # closing inherited connections would terminate the parent's sessions
+            self._inherited.extend(connection for connection, _ in self._idle)
+            self._idle = []
+            self._num_open = 0
+            self._pid = os.getpid()
+
+    def _close(self, connection):
+        self._num_open -= 1
+        self.num_closed += 1
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def _close_expired(self, now: float):
+        while self._idle and now - self._idle[0][1] > self.max_idle_seconds:
+            connection, _ = self._idle.pop(0)
+            self._close(connection)
+
+    def _is_healthy(self, connection, idle_seconds: float) -> bool:
+        if connection.closed:
+            return False
+        if idle_seconds < self.health_check_seconds:
+            return True
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            self.num_failed_health_checks += 1
+            return False
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if there is room and waiting otherwise
+
+        Raises:
+            TimeoutError: No connection became available within the pool timeout
+        """
+        start_time = time.monotonic()
+        waited = False
+        with self._condition:
+            self._check_fork()
+            while True:
+                now = time.monotonic()
+                self._close_expired(now)
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                    break
+                if self._num_open < self.max_connections:
+                    connection, released_at = None, now
+                    self._num_open += 1
+                    break
+                remaining = self.timeout - (now - start_time)
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a database connection"
+                    )
+                waited = True
+                self._condition.wait(remaining)
+
+            wait_seconds = time.monotonic() - start_time
+            self.num_acquired += 1
+            if waited:
+                self.num_waits += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+        # checks and connects happen outside the lock, the slot is already reserved
+        if connection is not None and not self._is_healthy(
+            connection, time.monotonic() - released_at
+        ):
+            with self._condition:
+                self._close(connection)
+                self._num_open += 1
+            connection = None
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self._condition:
+                    self._num_open -= 1
+                    self._condition.notify()
+                raise
+            self.num_opened += 1
+        return connection
+
+    def release(self, connection):
+        """Return a connection to the pool, discarding it if it is broken"""
+        with self._condition:
+            if os.getpid() != self._pid:
+                self._inherited.append(connection)
+                return
+            if connection.closed:
+                self._num_open -= 1
+                self.num_closed += 1
+            else:
+                try:
+                    if (
+                        connection.get_transaction_status()
+                        != extensions.TRANSACTION_STATUS_IDLE
+                    ):
+                        connection.rollback()
+                    self._idle.append((connection, time.monotonic()))
+                except psycopg2.Error:
+                    self._close(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    @contextmanager
+    def cursor(self, name: str = None):
+        """Cursor on a pooled connection, committed when the block succeeds and rolled back otherwise
+
+        Args:
+            name (str, optional): Name of a server-side cursor. Defaults to None (client-side cursor).
+        """
+        with self.connection() as connection:
+            cur = connection.cursor(name) if name else connection.cursor()
+            try:
+                yield cur
+                cur.close()
+                connection.commit()
+            except BaseException:
+                try:
+                    if not cur.closed:
+                        cur.close()
+                    if not connection.closed:
+                        connection.rollback()
+                except psycopg2.Error:
+                    pass
+                raise
+
+    def close_all(self):
+        """Close all idle connections, e.g. before forking"""
+        with self._condition:
+            self._check_fork()
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._close(connection)
+
+    def stats(self) -> Dict:
+        """Pool size and wait time statistics"""
+        return {
+            "MaxConnections": self.max_connections,
+            "Open": self._num_open,
+            "Idle": len(self._idle),
+            "InUse": self._num_open - len(self._idle),
+            "Acquired": self.num_acquired,
+            "Waits": self.num_waits,
+            "WaitSecondsTotal": self.wait_seconds_total,
+            "WaitSecondsMax": self.wait_seconds_max,
+            "Opened": self.num_opened,
+            "Closed": self.num_closed,
+            "FailedHealthChecks": self.num_failed_health_checks,
+        }
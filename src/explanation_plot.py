@@ -0,0 +1,212 @@
+import base64
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from cache import LRUCache
+from config import NUM_WORDS, PLOT_WORKERS, PLOT_CACHE_MAX_MB
+
+
+def render_explanation_plot(
+    word_score: Dict[str, float], lemma_original: Dict[str, List[str]], intercept
+) -> str:
+    """Draw the waterfall chart of the summed token importances of a tender. Uses its own Figure and canvas
+    instead of the global pyplot state, so plots can be rendered concurrently.
+
+    Args:
+        word_score (Dict[str, float]): Importance of each lemma
+        lemma_original (Dict[str, List[str]]): Original words of each lemma
+        intercept: Intercept of the classifier
+
+    Returns:
+        str: Base64 encoded PNG image
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    word_score = dict(sorted(word_score.items(), key=lambda k: k[1]))
+    vis_words = []
+    current_sum = 0
+    bias = np.array(intercept)
+    ax.axvline(x=-bias[0], color="red", label="decision boundary")
+    ax.text(
+        -bias[0] + 0.05, 5, "decision boundary", rotation=90, color="r", va="center"
+    )
+    ax.axvline(x=0, color="black", label="zero", linestyle="dashed")
+
+    # plot positive words first
+    current_word_index = 0
+    top_keys = list(word_score.keys())
+    top_keys.reverse()
+    positive_other_sum = 0.0
+    for i, lemma_word in enumerate(top_keys):
+        if i < NUM_WORDS and word_score[lemma_word] > 0:
+            ax.barh(
+                current_word_index,
+                current_sum + word_score[lemma_word],
+                align="center",
+                color="r",
+            )
+            ax.barh(current_word_index, current_sum, align="center", color="white")
+            current_sum += word_score[lemma_word]
+            vis_words.append(lemma_original[lemma_word][0].lower())
+            ax.text(
+                current_sum + 0.1,
+                current_word_index,
+                str(round(word_score[lemma_word], 2)),
+                color="r",
+                va="center",
+            )
+            current_word_index += 1
+        elif word_score[lemma_word] > 0:
+            positive_other_sum += word_score[lemma_word]
+        else:
+            break
+    ax.barh(NUM_WORDS, current_sum + positive_other_sum, align="center", color="r")
+    ax.barh(NUM_WORDS, current_sum, align="center", color="white")
+    current_sum += positive_other_sum
+    vis_words.append("remaining POSITIVE")
+    ax.text(
+        current_sum + 0.1,
+        current_word_index,
+        str(round(positive_other_sum, 2)),
+        color="r",
+        va="center",
+    )
+    current_word_index += 1
+    # plot negative words
+    bot_keys = list(word_score.keys())
+    negative_other_sum = 0.0
+    for i, lemma_word in enumerate(bot_keys):
+        if i < NUM_WORDS and word_score[lemma_word] < 0:
+            if current_sum > 0:
+                zero_to_pos = current_sum + word_score[lemma_word]
+                ax.barh(current_word_index, current_sum, align="center", color="b")
+                if zero_to_pos > 0:
+                    ax.barh(
+                        current_word_index,
+                        zero_to_pos,
+                        align="center",
+                        color="white",
+                    )
+                else:
+                    ax.barh(
+                        current_word_index, current_sum, align="center", color="b"
+                    )
+                    ax.barh(
+                        current_word_index, zero_to_pos, align="center", color="b"
+                    )
+            else:
+                ax.barh(
+                    current_word_index,
+                    current_sum + word_score[lemma_word],
+                    align="center",
+                    color="b",
+                )
+                ax.barh(
+                    current_word_index, current_sum, align="center", color="white"
+                )
+            ax.text(
+                current_sum + 0.1,
+                current_word_index,
+                str(round(word_score[lemma_word], 2)),
+                color="blue",
+                va="center",
+            )
+            current_word_index += 1
+            current_sum += word_score[lemma_word]
+            vis_words.append(lemma_original[lemma_word][0].lower())
+        elif word_score[lemma_word] < 0:
+            negative_other_sum += word_score[lemma_word]
+        else:
+            break
+    # draw remainder of negative
+    if current_sum > 0:
+        zero_to_pos = current_sum + negative_other_sum
+        ax.barh(current_word_index, current_sum, align="center", color="b")
+        if zero_to_pos > 0:
+            ax.barh(current_word_index, zero_to_pos, align="center", color="white")
+        else:
+            ax.barh(current_word_index, current_sum, align="center", color="b")
+            ax.barh(current_word_index, zero_to_pos, align="center", color="b")
+    else:
+        ax.barh(
+            current_word_index,
+            current_sum + negative_other_sum,
+            align="center",
+            color="b",
+        )
+        ax.barh(current_word_index, current_sum, align="center", color="white")
+    ax.text(
+        current_sum + 0.1,
+        current_word_index,
+        str(round(negative_other_sum, 2)),
+        color="blue",
+        va="center",
+    )
+    current_word_index += 1
+    current_sum += negative_other_sum
+    vis_words.append("remaining NEGATIVE")
+
+    ax.set_yticks(
+        np.linspace(0, current_word_index + 1, current_word_index + 1),
+        labels=vis_words + [""],
+    )
+    ax.invert_yaxis()
+    fig.tight_layout()
+    # encode the image to png
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return base64.encodebytes(buf.getvalue()).decode()
+
+
+class PlotCache:
+    """Rendered explanation plots, keyed by (country, tender ID, model generation) and bounded by their size in
+    bytes. Plots only depend on the vectorizer and classifier, so annotations do not invalidate them. Misses are rendered in a dedicated thread pool, and concurrent requests for the same plot share one render."""
+
+    def __init__(
+        self,
+        max_bytes: int = PLOT_CACHE_MAX_MB * 1024 * 1024,
+        max_workers: int = PLOT_WORKERS,
+    ):
+        self.cache = LRUCache(max_bytes)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="plot"
+        )
+        self._rendering = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, render: Callable[..., str], *args) -> str:
+        """Return the cached plot for key, rendering it with render(*args) on a miss"""
+        return self.future(key, render, *args).result()
+
+    def future(self, key: Hashable, render: Callable[..., str], *args) -> Future:
+        """Future of the plot for key, already resolved on a cache hit. Lets callers render several plots at once."""
+        plot = self.cache.get(key)
+        if plot is not None:
+            future = Future()
+            future.set_result(plot)
+            return future
+        with self._lock:
+            future = self._rendering.get(key)
+            submitted = future is None
+            if submitted:
+                future = self.executor.submit(render, *args)
+                self._rendering[key] = future
+        if submitted:
+            # outside the lock, the callback runs right away if the render already finished
+            future.add_done_callback(lambda future: self._rendered(key, future))
+        return future
+
+    def _rendered(self, key: Hashable, future: Future):
+        if future.exception() is None:
+            self.cache.put(key, future.result())
+        with self._lock:
+            self._rendering.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Size and hit/miss statistics of the plot cache"""
+        return {**self.cache.stats(), "Rendering": len(self._rendering)}
@@ -0,0 +1,20 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True):
+    """Exclusive advisory lock on a file, held by one process (and one thread, since every acquisition opens the file
+    anew) at a time. Used to serialize writes to shared files between the serving processes.
+
+    Raises:
+        BlockingIOError: The lock is held elsewhere and blocking is False
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
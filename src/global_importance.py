@@ -0,0 +1,128 @@
+import threading
+import weakref
+from typing import Dict, List, Tuple
+import numpy as np
+from model_data import LanguageModelData
+
+
+class GlobalImportance:
+    """Global token importances of a trained language model: the words with the highest and lowest classifier
+    coefficients and the tenders they appear in. The features are converted to column-major format once, so the
+    tenders of a word are a contiguous slice, and the selected words are cached per requested number of words.
+    Labels do not affect the result, so it stays valid until the model is retrained. Only the arrays it needs are
+    kept (and counted by nbytes), not the model itself, so an evicted model is not kept alive by its importances."""
+
+    def __init__(self, language_model_data: LanguageModelData, version: int):
+        self._language_model_data = weakref.ref(language_model_data)
+        self.version = version
+        tender_data = language_model_data.tender_data
+        self.coef = np.array(language_model_data.classifier.coef_[0])
+        self.feature_names = language_model_data.vectorizer.get_feature_names_out()
+        self.features = tender_data.features.tocsc()
+        self.features.sort_indices()
+        self.tender_ids = np.array(tender_data.tender_ids)
+        self.deleted_words = list(language_model_data.deleted_words)
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def is_for(self, language_model_data: LanguageModelData) -> bool:
+        """Whether the importances were calculated from this model (and not from a copy loaded before an eviction)"""
+        calculated_from = self._language_model_data()
+        return calculated_from is not None and calculated_from is language_model_data
+
+    def select_words(self, n_words: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Vocabulary indices of the n_words highest scoring (non-negative) words, in descending order of their
+        scores, and of the n_words lowest scoring (non-positive) words, in ascending order"""
+        with self._lock:
+            if n_words not in self._words:
+                n_words = min(n_words, self.coef.shape[0])
+                if n_words == 0:
+                    empty = np.array([], dtype=np.int64)
+                    self._words[n_words] = (empty, empty)
+                    return self._words[n_words]
+                top = np.argpartition(-self.coef, n_words - 1)[:n_words]
+                top = top[np.argsort(-self.coef[top], kind="stable")]
+                bottom = np.argpartition(self.coef, n_words - 1)[:n_words]
+                bottom = bottom[np.argsort(self.coef[bottom], kind="stable")]
+                self._words[n_words] = (
+                    top[self.coef[top] >= 0],
+                    bottom[self.coef[bottom] <= 0],
+                )
+            return self._words[n_words]
+
+    def tender_rows(self, word_index: int) -> np.ndarray:
+        """Rows of the tenders a word appears in"""
+        start, end = self.features.indptr[word_index], self.features.indptr[word_index + 1]
+        rows = self.features.indices[start:end]
+        return rows[self.features.data[start:end] != 0]
+
+    def words(
+        self, word_indices: np.ndarray, page: int = None, page_size: int = None
+    ) -> Tuple[List, List[int]]:
+        """(token, score, tender IDs) for every word and the total number of tenders of every word. Only the
+        requested page of tender IDs is returned when page_size is given."""
+        words = []
+        tender_counts = []
+        for word_index in word_indices:
+            rows = self.tender_rows(word_index)
+            tender_counts.append(int(rows.shape[0]))
+            if page_size is not None:
+                rows = rows[(page - 1) * page_size : page * page_size]
+            words.append(
+                (
+                    str(self.feature_names[word_index]),
+                    float(self.coef[word_index]),
+                    [str(tender_id) for tender_id in self.tender_ids[rows].tolist()],
+                )
+            )
+        return words, tender_counts
+
+    def global_data(
+        self, n_words: int = 200, page: int = None, page_size: int = None
+    ) -> Dict:
+        """Top and bottom words with the tenders they appear in
+
+        Args:
+            n_words (int, optional): Number of top and of bottom words. Defaults to 200.
+            page (int, optional): 1-based page of tender IDs per word. Defaults to None (first page if page_size is set).
+            page_size (int, optional): Number of tender IDs per word and page. Defaults to None (all tender IDs).
+
+        Raises:
+            ValueError: Invalid number of words or page
+        """
+        if n_words < 0:
+            raise ValueError(f"Invalid number of words: {n_words}")
+        if page_size is None and page is not None:
+            raise ValueError("page requires page_size")
+        if page_size is not None:
+            page = 1 if page is None else page
+            if page < 1 or page_size < 1:
+                raise ValueError(f"Invalid page {page} of size {page_size}")
+
+        top_indices, bottom_indices = self.select_words(n_words)
+        top_words, top_counts = self.words(top_indices, page, page_size)
+        bottom_words, bottom_counts = self.words(bottom_indices, page, page_size)
+        global_data = {
+            "TopWords": top_words,
+            "BottomWords": bottom_words,
+            "DeletedWords": self.deleted_words,
+        }
+        if page_size is not None:
+            global_data["Page"] = page
+            global_data["PageSize"] = page_size
+            global_data["TenderCounts"] = {
+                "TopWords": top_counts,
+                "BottomWords": bottom_counts,
+            }
+        return global_data
+
+    def nbytes(self) -> int:
+        """Estimated memory used by the column-major features, the vocabulary, the coefficients and the tender IDs"""
+        return (
+            self.features.data.nbytes
+            + self.features.indices.nbytes
+            + self.features.indptr.nbytes
+            + self.feature_names.nbytes
+            + self.coef.nbytes
+            + self.tender_ids.nbytes
+        )
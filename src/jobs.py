@@ -0,0 +1,250 @@
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from config import RETRAIN_WORKERS, RETRAIN_JOB_HISTORY, RETRAIN_MODE
+from file_lock import file_lock
+
+# phases reported by PostgresCountryModel.retrain_country, in order
+RETRAIN_PHASES = ["queued", "preprocessing", "training", "writing_predictions", "saving"]
+
+
+def merge_words(words: List[str], new_words: List[str]) -> List[str]:
+    return words + [word for word in new_words if word not in words]
+
+
+class RetrainJob:
+    """Status of a single background retraining job"""
+
+    def __init__(
+        self,
+        country: str,
+        deleted_words: List[str],
+        reenabled_words: List[str],
+        mode: str = RETRAIN_MODE,
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.country = country
+        self.deleted_words = list(deleted_words)
+        self.reenabled_words = list(reenabled_words)
+        self.mode = mode
+        self.status = "queued"
+        self.phase = "queued"
+        self.progress = 0.0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def same_request(
+        self, deleted_words: List[str], reenabled_words: List[str], mode: str
+    ) -> bool:
+        return (
+            set(self.deleted_words) == set(deleted_words)
+            and set(self.reenabled_words) == set(reenabled_words)
+            and self.mode == mode
+        )
+
+    def merge(self, deleted_words: List[str], reenabled_words: List[str], mode: str):
+        """Fold a later request into this queued job. The later request wins for words it deletes or re-enables
+        again, and the job runs in full mode if any of its requests asked for it."""
+        self.deleted_words = merge_words(
+            [word for word in self.deleted_words if word not in reenabled_words],
+            deleted_words,
+        )
+        self.reenabled_words = merge_words(
+            [word for word in self.reenabled_words if word not in deleted_words],
+            reenabled_words,
+        )
+        if mode == "full":
+            self.mode = mode
+
+    def set_phase(self, phase: str):
+        """Progress callback passed to retrain_country"""
+        self.phase = phase
+        self.progress = RETRAIN_PHASES.index(phase) / len(RETRAIN_PHASES)
+
+    def to_dict(self) -> Dict:
+        return {
+            "JobID": self.job_id,
+            "Country": self.country,
+            "Status": self.status,
+            "Phase": self.phase,
+            "Progress": self.progress,
+            "Error": self.error,
+            "DeletedWords": self.deleted_words,
+            "ReEnabledWords": self.reenabled_words,
+            "Mode": self.mode,
+            "CreatedAt": self.created_at,
+            "StartedAt": self.started_at,
+            "FinishedAt": self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        job = cls(
+            data["Country"],
+            data["DeletedWords"],
+            data["ReEnabledWords"],
+            data.get("Mode", RETRAIN_MODE),
+        )
+        job.job_id = data["JobID"]
+        job.status = data["Status"]
+        job.phase = data["Phase"]
+        job.progress = data["Progress"]
+        job.error = data["Error"]
+        job.created_at = data["CreatedAt"]
+        job.started_at = data["StartedAt"]
+        job.finished_at = data["FinishedAt"]
+        return job
+
+
+class RetrainJobManager:
+    """Runs retraining jobs in background threads. Jobs of the same country run one after another; a request
+    identical to the running job returns that job, and further requests are merged into a single queued job.
+    Job statuses are also written to status_directory, so every serving process can report them, and jobs of
+    the same country in different processes are serialized by a lock file."""
+
+    def __init__(
+        self,
+        retrain: Callable,
+        max_workers: int = RETRAIN_WORKERS,
+        status_directory: str = "./data/jobs",
+    ):
+        # retrain(country, deleted_words=..., reenabled_words=..., progress=..., mode=...)
+        self.retrain = retrain
+        self.status_directory = status_directory
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="retrain"
+        )
+        self.jobs = OrderedDict()
+        self._running = {}
+        self._queued = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        country: str,
+        deleted_words: List[str],
+        reenabled_words: List[str],
+        mode: str = RETRAIN_MODE,
+    ) -> RetrainJob:
+        """Queue a retraining job for a country, coalescing it with pending jobs of that country (see
+        RetrainJob.merge).
+
+        Returns:
+            RetrainJob: The job that will carry out the request
+        """
+        with self._lock:
+            running_job = self._running.get(country)
+            if running_job is not None and running_job.same_request(
+                deleted_words, reenabled_words, mode
+            ):
+                return running_job
+            queued_job = self._queued.get(country)
+            if queued_job is not None:
+                queued_job.merge(deleted_words, reenabled_words, mode)
+                self._save(queued_job)
+                return queued_job
+
+            job = RetrainJob(country, deleted_words, reenabled_words, mode)
+            self.jobs[job.job_id] = job
+            while len(self.jobs) > RETRAIN_JOB_HISTORY:
+                self.jobs.popitem(last=False)
+            self._save(job)
+            self._prune()
+            self._queued[country] = job
+            if country not in self._running:
+                self._start(country)
+            return job
+
+    def get(self, job_id: str) -> Optional[RetrainJob]:
+        """Job by ID, including jobs submitted to other processes"""
+        job = self.jobs.get(job_id)
+        if job is not None or not re.fullmatch("[0-9a-f]{32}", job_id):
+            return job
+        try:
+            with open(self._status_path(job_id)) as f:
+                return RetrainJob.from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def busy(self) -> bool:
+        """Whether jobs are running or queued"""
+        with self._lock:
+            return bool(self._running or self._queued)
+
+    def lock_path(self, country: str) -> str:
+        """Lock file held while a job of the country runs, in any process"""
+        return os.path.join(self.status_directory, country + ".lock")
+
+    def _status_path(self, job_id: str) -> str:
+        return os.path.join(self.status_directory, job_id + ".json")
+
+    def _save(self, job: RetrainJob):
+        os.makedirs(self.status_directory, exist_ok=True)
+        path = self._status_path(job.job_id)
+        with open(path + ".tmp", "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+    def _prune(self):
+        """Remove the oldest status files beyond RETRAIN_JOB_HISTORY"""
+        paths = [
+            os.path.join(self.status_directory, file)
+            for file in os.listdir(self.status_directory)
+            if file.endswith(".json")
+        ]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: max(0, len(paths) - RETRAIN_JOB_HISTORY)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _progress(self, job: RetrainJob, phase: str):
+        job.set_phase(phase)
+        self._save(job)
+
+    def _start(self, country: str):
+        job = self._queued.pop(country)
+        self._running[country] = job
+        self.executor.submit(self._run, job)
+
+    def _run(self, job: RetrainJob):
+        try:
+            # waits for jobs of the same country in other processes
+            with file_lock(self.lock_path(job.country)):
+                job.status = "running"
+                job.started_at = time.time()
+                self._save(job)
+                self.retrain(
+                    job.country,
+                    deleted_words=job.deleted_words,
+                    reenabled_words=job.reenabled_words,
+                    progress=lambda phase: self._progress(job, phase),
+                    mode=job.mode,
+                )
+            job.status = "done"
+            job.phase = "done"
+            job.progress = 1.0
+        except Exception as e:
+            traceback.print_exc()
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            try:
+                self._save(job)
+            except OSError:
+                traceback.print_exc()
+            with self._lock:
+                del self._running[job.country]
+                if job.country in self._queued:
+                    self._start(job.country)
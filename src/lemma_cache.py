@@ -0,0 +1,118 @@
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from typing import Dict
+from simplemma import lemmatize
+from cache import LRUCache
+from config import LEMMA_CACHE_MAX_MB
+
+# approximate per-entry overhead of the ordered dictionary backing the cache
+ENTRY_OVERHEAD_BYTES = 100
+
+
+def lemma_entry_sizeof(token: str, lemma: str) -> int:
+    return sys.getsizeof(token) + sys.getsizeof(lemma) + ENTRY_OVERHEAD_BYTES
+
+
+class LemmaCache:
+    """Memory-bounded token to lemma cache for a single language, snapshotted next to the model files."""
+
+    def __init__(self, language: str, max_bytes: int = LEMMA_CACHE_MAX_MB * 1024 * 1024):
+        self.language = language
+        self.cache = LRUCache(max_bytes, sizeof=lemma_entry_sizeof)
+        # lemmas computed since the current thread started recording (see start_recording)
+        self._recording = threading.local()
+
+    def lemmatize(self, token: str) -> str:
+        lemma = self.cache.get(token)
+        if lemma is None:
+            lemma = lemmatize(token, lang=self.language)
+            self.cache.put(token, lemma)
+            new_entries = getattr(self._recording, "new_entries", None)
+            if new_entries is not None:
+                new_entries[token] = lemma
+        return lemma
+
+    def start_recording(self):
+        """Start collecting the lemmas newly computed by the current thread, so a worker process can hand them back
+        to its parent. Other threads lemmatizing with the same cache (e.g. requests while preprocessing in-process)
+        are not recorded and do not affect the recording."""
+        self._recording.new_entries = {}
+
+    def stop_recording(self) -> Dict[str, str]:
+        new_entries = getattr(self._recording, "new_entries", None)
+        self._recording.new_entries = None
+        return new_entries if new_entries is not None else {}
+
+    def merge(self, entries: Dict[str, str], hits: int = 0, misses: int = 0):
+        """Add lemmas and hit/miss counts collected by a worker process"""
+        for token, lemma in entries.items():
+            self.cache.put(token, lemma)
+        self.cache.hits += hits
+        self.cache.misses += misses
+
+    @staticmethod
+    def path(language: str, save_start_path: str = "./data") -> str:
+        return os.path.join(save_start_path, f"{language}.lemmas.pickle")
+
+    def save(self, save_start_path: str = "./data"):
+        """Snapshot the cache to disk, least recently used entries first. The snapshot is only a warm start, so a
+        failed save is logged instead of failing the training that triggered it. Processes saving the same language
+        concurrently each write their own temporary file, the last replace wins."""
+        path = LemmaCache.path(self.language, save_start_path)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path)
+            )
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self.cache.items(), f)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"Saving the lemma cache of {self.language} failed: {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def load(self, save_start_path: str = "./data"):
+        """Warm the cache from its snapshot, if there is one. An unreadable snapshot leaves the cache empty."""
+        path = LemmaCache.path(self.language, save_start_path)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                entries = pickle.load(f)
+            for token, lemma in entries:
+                self.cache.put(token, lemma)
+        except Exception as e:
+            print(f"Loading the lemma cache of {self.language} failed, starting empty: {e}")
+            self.cache.clear()
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
+
+
+_lemma_caches = {}
+_lemma_caches_lock = threading.Lock()
+
+
+def get_lemma_cache(language: str) -> LemmaCache:
+    """Get the lemma cache for a language, loading its snapshot on first use"""
+    lemma_cache = _lemma_caches.get(language)
+    if lemma_cache is None:
+        with _lemma_caches_lock:
+            lemma_cache = _lemma_caches.get(language)
+            if lemma_cache is None:
+                lemma_cache = LemmaCache(language)
+                lemma_cache.load()
+                _lemma_caches[language] = lemma_cache
+    return lemma_cache
+
+
+def lemma_cache_stats() -> Dict[str, Dict]:
+    """Hit/miss and size statistics of every loaded lemma cache"""
+    return {language: cache.stats() for language, cache in _lemma_caches.items()}
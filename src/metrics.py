@@ -0,0 +1,170 @@
+"""Request, database, training and model cache metrics, exposed in the Prometheus text format on /dgcnect/metrics.
+
+After init, prometheus_client runs in multiprocess mode: every process (the prefork master, its workers, the delta
+scoring and bootstrap processes) records its values in memory-mapped files in PROMETHEUS_MULTIPROC_DIR
+(METRICS_DIRECTORY by default), and a scrape of any worker aggregates the files of all processes. The counters and
+histograms of exited processes are merged into one archive file per type, so they remain in the sums (and monotonic)
+when workers are replaced without leaving a file behind per process. Gauges are reported per live process with a
+pid label. Without init (e.g. in the benchmark) the metrics only cover the current process."""
+import glob
+import os
+from typing import Dict
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    values,
+)
+from prometheus_client.mmap_dict import MmapedDict
+from file_lock import file_lock
+from config import (
+    METRICS_DIRECTORY,
+    METRICS_LATENCY_BUCKETS,
+    METRICS_DURATION_BUCKETS,
+)
+
+# metric types whose values are summed over processes, so the files of exited processes can be merged
+ARCHIVED_TYPES = ("counter", "histogram")
+
+# directory of the metrics files, None until init
+MULTIPROC_DIRECTORY = None
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_SECONDS = Histogram(
+    "dgcnect_request_duration_seconds",
+    "Time to handle an API request",
+    ("endpoint", "method", "status"),
+    buckets=METRICS_LATENCY_BUCKETS,
+)
+DB_QUERY_SECONDS = Histogram(
+    "dgcnect_db_query_duration_seconds",
+    "Time to execute a database statement (for server-side cursors: to open them)",
+    ("statement",),
+    buckets=METRICS_LATENCY_BUCKETS,
+)
+DB_QUERY_ROWS = Counter(
+    "dgcnect_db_query_rows",
+    "Rows returned or changed by database statements",
+    ("statement",),
+)
+TRAINING_PHASE_SECONDS = Histogram(
+    "dgcnect_training_phase_duration_seconds",
+    "Time spent in each phase of training, retraining and delta scoring",
+    ("phase",),
+    buckets=METRICS_DURATION_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "dgcnect_model_load_duration_seconds",
+    "Time to load a country model from disk",
+    ("country",),
+    buckets=METRICS_DURATION_BUCKETS,
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    "dgcnect_model_resident_bytes",
+    "Estimated memory of a loaded country model (0 if it is not loaded)",
+    ("country",),
+    multiprocess_mode="liveall",
+)
+
+
+def statement(query) -> str:
+    """Keyword a database query starts with (SELECT, UPDATE, ...), used as a label with few values"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    words = str(query).split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def phase(name: str):
+    """Time a training phase, e.g. with metrics.phase("fit"): ..."""
+    return TRAINING_PHASE_SECONDS.labels(phase=name).time()
+
+
+def phase_seconds() -> Dict[str, float]:
+    """Seconds this process spent in each training phase so far"""
+    return {
+        sample.labels["phase"]: sample.value
+        for metric in TRAINING_PHASE_SECONDS.collect()
+        for sample in metric.samples
+        if sample.name.endswith("_sum")
+    }
+
+
+def init(directory: str = METRICS_DIRECTORY):
+    """Record the metrics of this process and the processes it forks in PROMETHEUS_MULTIPROC_DIR, set to directory
+    if it is not set yet. Call before anything is recorded."""
+    global MULTIPROC_DIRECTORY
+    MULTIPROC_DIRECTORY = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", directory)
+    os.makedirs(MULTIPROC_DIRECTORY, exist_ok=True)
+    # prometheus_client picks its value class when it is imported, the metrics above only create values once they
+    # are labelled, so they pick up the multiprocess one
+    values.ValueClass = values.get_value_class()
+
+
+def _archive_lock():
+    return file_lock(os.path.join(MULTIPROC_DIRECTORY, "archive.lock"))
+
+
+def reset():
+    """Remove the metrics files of earlier runs of the server (call after init, before anything is recorded)"""
+    for file_name in os.listdir(MULTIPROC_DIRECTORY):
+        if file_name.endswith(".db"):
+            os.remove(os.path.join(MULTIPROC_DIRECTORY, file_name))
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def archive_dead_processes():
+    """Merge the counter and histogram files of processes that are no longer running into the archive files"""
+    with _archive_lock():
+        for metric_type in ARCHIVED_TYPES:
+            archive = None
+            try:
+                for path in glob.glob(os.path.join(MULTIPROC_DIRECTORY, f"{metric_type}_*.db")):
+                    pid = os.path.basename(path)[len(metric_type) + 1 : -len(".db")]
+                    if not pid.isdigit() or _is_running(int(pid)):
+                        continue
+                    if archive is None:
+                        archive = MmapedDict(os.path.join(MULTIPROC_DIRECTORY, f"{metric_type}_archive.db"))
+                    # counter and histogram files hold per-bucket values, so merging is a sum per key
+                    for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(path):
+                        archived_value, _ = archive.read_value(key)
+                        archive.write_value(key, archived_value + value, timestamp)
+                    os.remove(path)
+            finally:
+                if archive is not None:
+                    archive.close()
+
+
+def mark_process_dead(pid: int):
+    """Drop the gauges of an exited process and archive its counters and histograms, along with those of any other
+    exited process (e.g. the bootstrap workers, which the prefork master does not reap itself)"""
+    if MULTIPROC_DIRECTORY is None:
+        return
+    multiprocess.mark_process_dead(pid, MULTIPROC_DIRECTORY)
+    archive_dead_processes()
+
+
+def render() -> bytes:
+    """Metrics of all processes in the Prometheus text format (of this process only without init)"""
+    if MULTIPROC_DIRECTORY is None:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, MULTIPROC_DIRECTORY)
+    # a process's files are archived and removed between the listing and reading them otherwise
+    with _archive_lock():
+        return generate_latest(registry)
@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+from config import SCORE_BATCH_MAX_SIZE, SCORE_BATCH_WAIT_MS, SCORE_BATCH_TIMEOUT_SECONDS
+
+
+class MicroBatcher:
+    """Collects concurrent requests for a few milliseconds and processes them together. Requests are grouped by
+    key (e.g. country) and each group is handled by a single process_batch(key, items) call that returns one
+    result per item, in order."""
+
+    def __init__(
+        self,
+        process_batch: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch_size: int = SCORE_BATCH_MAX_SIZE,
+        max_wait_seconds: float = SCORE_BATCH_WAIT_MS / 1000,
+        timeout_seconds: float = SCORE_BATCH_TIMEOUT_SECONDS,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.timeout_seconds = timeout_seconds
+        self.num_batches = 0
+        self.num_items = 0
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the batching thread on first use, and again in forked processes (threads are not inherited)"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._run,
+                    args=(self._queue,),
+                    name="micro-batcher",
+                    daemon=True,
+                ).start()
+
+    def submit(self, key: Hashable, item: Any) -> Any:
+        """Process an item as part of the next batch of its key and return its result
+
+        Raises:
+            Exception: The exception raised while processing the batch
+            concurrent.futures.TimeoutError: The batch did not finish within timeout_seconds
+        """
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((key, item, future))
+        return future.result(timeout=self.timeout_seconds)
+
+    def _collect(self, requests: queue.Queue) -> List:
+        batch = [requests.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, requests: queue.Queue):
+        while True:
+            # a failing batch only fails its own requests, the thread keeps serving the next batches
+            try:
+                groups = {}
+                for key, item, future in self._collect(requests):
+                    groups.setdefault(key, []).append((item, future))
+                for key, group in groups.items():
+                    self._process(key, group)
+            except Exception:
+                traceback.print_exc()
+
+    def _process(self, key: Hashable, group: List):
+        self.num_batches += 1
+        self.num_items += len(group)
+        try:
+            results = self.process_batch(key, [item for item, _ in group])
+            if len(results) != len(group):
+                raise ValueError(
+                    f"process_batch returned {len(results)} results for {len(group)} items"
+                )
+        except Exception as e:
+            traceback.print_exc()
+            for _, future in group:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
+
+    def stats(self) -> Dict:
+        """Number of batches and items processed so far"""
+        return {
+            "Batches": self.num_batches,
+            "Items": self.num_items,
+            "Queued": self._queue.qsize() if self._queue is not None else 0,
+        }
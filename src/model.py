@@ -1,19 +1,56 @@
-import matplotlib.pyplot as plt
 import pickle
 import sklearn
 import os
 import numpy as np
 import uuid
-import io
-import psycopg2
+from psycopg2.extras import execute_values
 import trainer
 import pickle
-from database_login import DBNAME, USER, PASSWORD, HOST, PORT, TABLE_NAME
-import codecs
-from model_data import CountryModelData, TenderData
-from config import NUM_WORDS
-from tqdm import tqdm
-from typing import List, Tuple, Dict
+from database_login import TABLE_NAME
+from database import ConnectionPool
+import time
+import multiprocessing
+import threading
+from contextlib import ExitStack
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from concurrent.futures.process import BrokenProcessPool
+from model_data import (
+    CountryModelData,
+    CountryModelCache,
+    LanguageModelData,
+    TenderData,
+)
+from corpus_store import CorpusStore
+from jobs import RetrainJobManager
+from confusion_index import ConfusionIndex
+from global_importance import GlobalImportance
+from cache import LRUCache
+from explanation_plot import PlotCache, render_explanation_plot
+from micro_batcher import MicroBatcher
+from file_lock import file_lock
+import metrics
+from lemma_cache import get_lemma_cache, lemma_cache_stats
+from config import (
+    BOOTSTRAP_WORKERS,
+    BOOTSTRAP_MEMORY_BUDGET_MB,
+    BOOTSTRAP_MEMORY_PER_ROW_KB,
+    PREPROCESS_WORKERS,
+    PREDICTION_UPDATE_PAGE_SIZE,
+    FETCH_BATCH_SIZE,
+    ANNOTATION_COMPACT_THRESHOLD,
+    GLOBAL_IMPORTANCE_CACHE_MAX_MB,
+    TENDER_BATCH_MAX_SIZE,
+    RETRAIN_MODE,
+    RETRAIN_MODES,
+    PREPROCESS_CHUNK_SIZE,
+    DELTA_SCORING_INTERVAL_SECONDS,
+)
+from typing import List, Tuple, Dict, Iterator, Callable
 
 
 # 2-alpha code to country name
@@ -94,17 +131,41 @@ country2language = {
 }
 
 
+# model inherited by the forked bootstrap processes
+_bootstrap_model = None
+
+
+def _bootstrap_country(country: str) -> float:
+    """Process pool entry point for training a single country at startup
+
+    Args:
+        country (str): Country to train
+
+    Returns:
+        float: Training time in seconds
+    """
+    start_time = time.time()
+    # the bootstrap processes already run in parallel, so they preprocess in-process
+    _bootstrap_model.train_country(country, num_workers=1)
+    return time.time() - start_time
+
+
 class PostgresCountryModel:
     """Class for handling postgres data fetching"""
 
     def __init__(self) -> None:
         print(f"Connecting to {TABLE_NAME}")
-        self.connect_database()
-        self.cur.execute(f"select distinct country_iso from {TABLE_NAME}")
-        countries = self.cur.fetchall()
-        self.close_database_connection()
+        self.pool = ConnectionPool()
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"select country_iso, count(*) from {TABLE_NAME} group by country_iso"
+            )
+            country_counts = cur.fetchall()
+            cur.execute(f"SELECT * FROM {TABLE_NAME} LIMIT 0")
+            self.column_names = [column[0] for column in cur.description]
 
-        countries = [country[0] for country in countries]
+        num_rows = {country: count for country, count in country_counts}
+        countries = [country[0] for country in country_counts]
         countries = list(filter(lambda country: country in country2language, countries))
 
         print(f"Supported countries: {countries}")
@@ -114,151 +175,734 @@ class PostgresCountryModel:
 
         # check if models have already been trained for each country found in the database
         # if not, train the models
-        for country in countries:
-            saved_path = os.path.join("data", f"{country}.pickle")
-            if not os.path.exists(saved_path):
-                country_dataset = self.fetch_dataset(country)
-                language = country2language[country]
+        untrained_countries = [
+            country
+            for country in countries
+            if not CountryModelData.exists(country)
+        ]
+        if BOOTSTRAP_WORKERS > 1 and len(untrained_countries) > 1:
+            failed_countries = self.bootstrap_countries(untrained_countries, num_rows)
+        else:
+            failed_countries = []
+            for country in untrained_countries:
                 try:
-                    language_model_data = trainer.Trainer.train(
-                        country_dataset, language
-                    )
-                    current_country_model_data = CountryModelData(
-                        country,
-                        {language: language_model_data},
-                    )
-                    current_country_model_data.save()
-                    self.update_predictions(language_model_data.tender_data, country)
+                    self.train_country(country)
                 except Exception as e:
                     print(
                         f"The following error occured during preprocessing for country: {country}, error: {e}"
                     )
-                    del country2language[country]
+                    failed_countries.append(country)
+        for country in failed_countries:
+            del country2language[country]
 
-        # load trained models
-        country_model_data = {}
+        # trained models are loaded on first access
         countries = list(filter(lambda country: country in country2language, countries))
-        for country in countries:
-            model_data = CountryModelData.load(country)
-            country_model_data[country] = model_data
-        self.country_model_data = country_model_data
+        self.country_model_data = CountryModelCache(countries)
 
         print(f"Country model data: {self.country_model_data.keys()}")
 
         self.detailed_country_data = {}
+        self.retrain_jobs = RetrainJobManager(self.retrain_country)
 
-        # calculate global token importance data for each country
-        self.global_data = {}
-        for country in self.country_model_data:
-            self.calculate_global_data(country)
-
-    def connect_database(self):
-        """Connect to a postgres database"""
-        self.conn = psycopg2.connect(
-            dbname=DBNAME,
-            user=USER,
-            password=PASSWORD,
-            host=HOST,
-            port=PORT,
+        # writes journaled annotations back into the model artifacts, off the request path
+        self.compaction_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="compaction"
+        )
+        self.pending_compactions = set()
+        self.num_compacting = 0
+        self.compaction_lock = threading.Lock()
+
+        self.plot_cache = PlotCache()
+        # /score requests are scored in micro-batches per country
+        self.score_batcher = MicroBatcher(self.score_texts)
+
+        # called with the country after a new generation of its model was saved by retraining, compaction or delta
+        # scoring (e.g. to reload the other serving processes). Annotations are picked up from the journal instead.
+        self.on_model_change = []
+        # bumped whenever a model is replaced or reloaded, see models_version
+        self._models_version = 0
+
+        # global token importance data, calculated on first request for each country
+        self.global_data = LRUCache(
+            GLOBAL_IMPORTANCE_CACHE_MAX_MB * 1024 * 1024,
+            sizeof=lambda country, global_importance: global_importance.nbytes(),
+            min_entries=1,
+        )
+
+    def train_country(self, country: str, num_workers: int = PREPROCESS_WORKERS):
+        """Train, save and write back the predictions of a model for a country that has not been trained yet
+
+        Args:
+            country (str): Country to train
+            num_workers (int, optional): Number of preprocessing processes. Defaults to PREPROCESS_WORKERS.
+        """
+        language = country2language[country]
+        with metrics.phase("preprocess"):
+            examples, inference_examples = self.preprocess_country(
+                country, language, num_workers=num_workers
+            )
+        language_model_data = trainer.Trainer.fit(examples, inference_examples)
+        current_country_model_data = CountryModelData(
+            country,
+            {language: language_model_data},
+        )
+        with metrics.phase("save"):
+            current_country_model_data.save()
+        get_lemma_cache(language).save()
+        self.update_predictions(language_model_data.tender_data, country)
+
+    def bootstrap_countries(
+        self, countries: List[str], num_rows: Dict[str, int]
+    ) -> List[str]:
+        """Train several countries across a bounded pool of forked processes. Countries are scheduled
+        largest first, as long as their estimated memory fits into the bootstrap memory budget
+        (a single country is always allowed to run, even if it exceeds the budget on its own).
+
+        Args:
+            countries (List[str]): Countries to train
+            num_rows (Dict[str, int]): Number of database rows per country, used to estimate memory usage
+
+        Returns:
+            List[str]: Countries that failed to train
+        """
+        global _bootstrap_model
+
+        def estimate_memory(country):
+            return num_rows[country] * BOOTSTRAP_MEMORY_PER_ROW_KB * 1024
+
+        memory_budget = BOOTSTRAP_MEMORY_BUDGET_MB * 1024 * 1024
+        num_workers = min(BOOTSTRAP_WORKERS, len(countries))
+        pending = sorted(countries, key=lambda country: num_rows[country], reverse=True)
+        running = {}
+        reserved_memory = 0
+        failed_countries = []
+        num_finished = 0
+        print(f"Training {len(countries)} countries with {num_workers} processes...")
+
+        # the workers are forked, so they inherit this object instead of pickling it
+        # (idle connections are closed first, so the workers open their own)
+        _bootstrap_model = self
+        self.pool.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context("fork")
         )
-        self.cur = self.conn.cursor()
+        try:
+            while pending or running:
+                for country in list(pending):
+                    if len(running) >= num_workers:
+                        break
+                    if (
+                        running
+                        and reserved_memory + estimate_memory(country) > memory_budget
+                    ):
+                        continue
+                    try:
+                        future = executor.submit(_bootstrap_country, country)
+                    except BrokenProcessPool:
+                        # a worker died (e.g. killed for running out of memory), give up on the rest
+                        print(f"Bootstrap process pool broke, skipping: {pending}")
+                        failed_countries.extend(pending)
+                        pending = []
+                        break
+                    running[future] = country
+                    reserved_memory += estimate_memory(country)
+                    pending.remove(country)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    country = running.pop(future)
+                    reserved_memory -= estimate_memory(country)
+                    num_finished += 1
+                    try:
+                        elapsed = future.result()
+                        print(
+                            f"[{num_finished}/{len(countries)}] Trained country: {country} in {elapsed:.1f}s"
+                        )
+                    except Exception as e:
+                        print(
+                            f"[{num_finished}/{len(countries)}] The following error occured during preprocessing for country: {country}, error: {e}"
+                        )
+                        failed_countries.append(country)
+        finally:
+            executor.shutdown(cancel_futures=True)
+            _bootstrap_model = None
 
-    def close_database_connection(self):
-        """Close a database connection"""
-        self.cur.close()
-        self.conn.close()
+        return failed_countries
 
-    def update_predictions(self, tender_data: TenderData, country: str):
-        """Update predictions in the database
+    def update_predictions(
+        self, tender_data: TenderData, country: str, rows: List[int] = None
+    ):
+        """Update predictions in the database. All rows are written with set-based UPDATE ... FROM (VALUES ...)
+        statements of PREDICTION_UPDATE_PAGE_SIZE rows each, inside a single transaction.
 
         Args:
             tender_data (TenderData): tender data to update
             country (str): country 2-alpha code
+            rows (List[int], optional): Only update the tenders of these rows. Defaults to None (all tenders).
         """
-        self.connect_database()
+        self.write_predictions(country, self.prediction_rows(tender_data, rows))
+
+    def write_predictions(self, country: str, rows: List[Tuple]):
+        """Write (tender ID, prediction, probability) rows of prediction_rows to the database, see update_predictions"""
         print("Updating predictions...")
-        for tender_id, prediction, predict_probas in tqdm(
-            zip(
-                tender_data.tender_ids,
-                tender_data.predictions,
-                tender_data.predict_probas,
-            )
-        ):
-            self.cur.execute(
-                f"UPDATE {TABLE_NAME} SET innovation_prediction_wo_docs={predict_probas:.5f} WHERE country_iso='{country}' AND dgcnect_tender_id={tender_id}"
+        with metrics.phase("write_predictions"), self.pool.cursor() as cur:
+            execute_values(
+                cur,
+                f"""UPDATE {TABLE_NAME} AS t
+                SET innovation_prediction=v.innovation_prediction, innovation_prediction_wo_docs=v.innovation_prediction_wo_docs
+                FROM (VALUES %s) AS v(dgcnect_tender_id, innovation_prediction, innovation_prediction_wo_docs)
+                WHERE t.country_iso='{country}' AND t.dgcnect_tender_id=v.dgcnect_tender_id""",
+                rows,
+                template="(%s::bigint, %s::integer, %s::double precision)",
+                page_size=PREDICTION_UPDATE_PAGE_SIZE,
             )
-            prediction = int(prediction)
-            self.cur.execute(
-                f"UPDATE {TABLE_NAME} SET innovation_prediction={prediction} WHERE country_iso='{country}' AND dgcnect_tender_id={tender_id}"
+        print(f"Updated {len(rows)} predictions")
+
+    @staticmethod
+    def prediction_rows(tender_data: TenderData, rows: List[int] = None) -> List[Tuple]:
+        """(tender ID, prediction, probability) values update_predictions writes for the given rows (all rows
+        by default)"""
+        if rows is None:
+            rows = range(len(tender_data.predictions))
+        return [
+            (
+                str(tender_data.tender_ids[row]),
+                int(tender_data.predictions[row]),
+                round(float(tender_data.predict_probas[row]), 5),
             )
-            self.conn.commit()
-        self.close_database_connection()
+            for row in rows
+        ]
 
     def retrain_country(
         self,
         country: str,
         deleted_words: List[str] = [],
         reenabled_words: List[str] = [],
+        progress: Callable[[str], None] = lambda phase: None,
+        mode: str = RETRAIN_MODE,
     ):
         """Retrain the model for a particular country. Optionally disable tokens given by deleted_words,
-        and reenable disabled tokens via reenabled_words (these two parameters are connected to the global token importances)
+        and reenable disabled tokens via reenabled_words (these two parameters are connected to the global token importances).
+        The previous model keeps being served until the new one is trained, its predictions are written back
+        and it is saved, then it is swapped in.
+
+        In "fast" mode the model is retrained from the term counts stored with the previous model, on its tenders
+        (and the tenders delta scoring has not appended to it yet) and current labels, without fetching and
+        preprocessing the tenders. "full" mode (and fast mode for models
+        saved without term counts) preprocesses all tenders of the country from the database, which also picks up
+        new tenders and changed texts.
 
         Args:
             country (str): Country to retrain
             deleted_words (List[str], optional): Words to remove from the vocab. Defaults to [].
             reenabled_words (List[str], optional): Words to reenable in the vocab. Defaults to [].
+            progress (Callable[[str], None], optional): Called with the name of each phase as it starts.
+            mode (str, optional): "fast" or "full". Defaults to RETRAIN_MODE.
         """
+        if mode not in RETRAIN_MODES:
+            raise ValueError(f"Unknown retraining mode: {mode}")
         print(f"Processing country: {country}")
-        country_dataset = self.fetch_dataset(country)
         language = country2language[country]
-        country_model_data = self.country_model_data[country]
-        for reenabled_word in reenabled_words:
+        base_country_model_data = self.country_model_data[country]
+        previous_language_model_data = base_country_model_data.language_to_model_data[
+            language
+        ]
+        stop_words = previous_language_model_data.stop_words
+        deleted_words = [
+            word
+            for word in previous_language_model_data.deleted_words
+            if word not in reenabled_words
+        ] + deleted_words
+        previous_tender_data = previous_language_model_data.tender_data
+        fast = mode == "fast" and previous_tender_data.term_counts is not None
+        folded_files = set()
+        if fast:
+            manifest = CountryModelData.load_manifest(country)
             if (
-                reenabled_word
-                in country_model_data.language_to_model_data[language].deleted_words
+                manifest is not None
+                and manifest["generation"] == base_country_model_data.generation
             ):
-                country_model_data.language_to_model_data[
-                    language
-                ].deleted_words.remove(reenabled_word)
-        language_model_data = trainer.Trainer.train(
-            country_dataset,
-            language,
-            stop_words=country_model_data.language_to_model_data[language].stop_words,
-            deleted_words=country_model_data.language_to_model_data[
-                language
-            ].deleted_words
-            + deleted_words,
-        )
+                # delta scoring does not run while the country is retrained, so the pending tenders stay the same
+                base_country_model_data.restore_delta_state(manifest.get("delta", {}))
+                pending = base_country_model_data.load_pending(language)
+                if pending is not None:
+                    # the pending tenders were scored with the previous model, they are retrained on and scored
+                    # with the new one like the tenders of the model (their features are recomputed from the
+                    # term counts, these only keep the rows aligned)
+                    pending["features"] = previous_language_model_data.vectorizer.transform(
+                        pending["input_texts"]
+                    )
+                    previous_tender_data = previous_tender_data.append(**pending)
+                    folded_files = {
+                        entry["file"] for entry in base_country_model_data.pending
+                    }
+            progress("training")
+            language_model_data = trainer.Trainer.fit_counts(
+                previous_tender_data,
+                stop_words=stop_words,
+                deleted_words=deleted_words,
+                previous=previous_language_model_data,
+            )
+        else:
+            progress("preprocessing")
+            with metrics.phase("preprocess"):
+                examples, inference_examples = self.preprocess_country(country, language)
+            progress("training")
+            language_model_data = trainer.Trainer.fit(
+                examples,
+                inference_examples,
+                stop_words=stop_words,
+                deleted_words=deleted_words,
+                previous=previous_language_model_data,
+            )
+            get_lemma_cache(language).save()
+
+        progress("writing_predictions")
+        self.update_predictions(language_model_data.tender_data, country)
 
+        progress("saving")
         new_country_model_data = CountryModelData(
             country,
             {language: language_model_data},
+            version=self.country_model_data[country].version + 1,
         )
-        new_country_model_data.save()
 
+        previous_country_model_data = self.country_model_data[country]
+        with previous_country_model_data.lock, file_lock(
+            CountryModelData.lock_path(country)
+        ):
+            manifest = CountryModelData.load_manifest(country)
+            if (
+                fast
+                and manifest is not None
+                and manifest["generation"] == base_country_model_data.generation
+            ):
+                # retrained on the same tenders and the pending ones, delta scoring continues where it was (its state
+                # is saved without a new generation, so it is read from the manifest)
+                new_country_model_data.restore_delta_state(manifest.get("delta", {}))
+                new_country_model_data.pending = [
+                    entry
+                    for entry in new_country_model_data.pending
+                    if entry["file"] not in folded_files
+                ]
+            self.swap_model(country, previous_country_model_data, new_country_model_data)
+        self.global_data.pop(country, None)
+        self.model_changed(country)
+        print()
+
+    def swap_model(
+        self,
+        country: str,
+        previous_country_model_data: CountryModelData,
+        new_country_model_data: CountryModelData,
+    ):
+        """Save a new model of a country and serve it instead of the previous one (call with the previous model's
+        lock and the country's lock file held)"""
+        # annotations made in the meantime (by any serving process) are only in the journal
+        new_country_model_data.replay_journal(previous_country_model_data.journal)
+        new_country_model_data.version = max(
+            new_country_model_data.version, previous_country_model_data.version + 1
+        )
+        with metrics.phase("save"):
+            new_country_model_data.save()
+        previous_country_model_data.journal.clear()
         self.country_model_data[country] = new_country_model_data
-        self.calculate_global_data(country)
 
-        tender_data = language_model_data.tender_data
-        self.update_predictions(tender_data, country)
-        print()
+    def submit_retrain(
+        self,
+        country: str,
+        deleted_words: List[str] = [],
+        reenabled_words: List[str] = [],
+        mode: str = RETRAIN_MODE,
+    ) -> Dict:
+        """Queue retraining a country in the background, see retrain_country
 
-    def fetch_dataset(self, country: str) -> List:
-        """Fetch a dataset from the database to train a model.
+        Args:
+            country (str): Country to retrain
+            deleted_words (List[str], optional): Words to remove from the vocab. Defaults to [].
+            reenabled_words (List[str], optional): Words to reenable in the vocab. Defaults to [].
+            mode (str, optional): "fast" or "full". Defaults to RETRAIN_MODE.
+
+        Returns:
+            Dict: Status of the job carrying out the request
+        """
+        if country not in self.country_model_data:
+            raise KeyError(f"Unknown country: {country}")
+        if mode not in RETRAIN_MODES:
+            raise ValueError(f"Unknown retraining mode: {mode}")
+        return self.retrain_jobs.submit(
+            country, deleted_words, reenabled_words, mode
+        ).to_dict()
+
+    def get_retrain_job(self, job_id: str) -> Dict:
+        """Get the status of a retraining job
 
         Args:
-            country (str): Country dataset to fetch.
+            job_id (str): Job ID returned by submit_retrain
+
+        Returns:
+            Dict: Job status, phase and progress
+        """
+        job = self.retrain_jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown retraining job: {job_id}")
+        return job.to_dict()
+
+    def text_hash_sql(self) -> str:
+        """SQL expression hashing the text columns a tender is preprocessed from"""
+        text_columns = [
+            f'coalesce("{self.column_names[index]}"::text, \'\')'
+            for index in trainer.TEXT_COLUMNS
+        ]
+        return "md5(" + " || '|' || ".join(text_columns) + ")"
+
+    def fetch_text_hashes(self, country: str) -> List:
+        """Fetch the ID, text hash and label of every tender of a country, ordered by tender ID so the training
+        order (and the seeded shuffle) does not depend on the physical order of the rows
+
+        Args:
+            country (str): Country to fetch
 
         Returns:
-            List: Rows from the database (examples to use as training data)
+            List: (tender ID, text hash, label) rows
+        """
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"SELECT dgcnect_tender_id, {self.text_hash_sql()}, innovation_label FROM {TABLE_NAME} where country_iso=%s ORDER BY dgcnect_tender_id",
+                (country,),
+            )
+            text_hashes = cur.fetchall()
+
+        return text_hashes
+
+    def dataset_columns_sql(self) -> str:
+        """SQL select list of the columns training reads, followed by the text hash. Unused columns are selected
+        as NULL, so rows keep the positions Trainer.check_example and Trainer.return_input expect."""
+        used_columns = set(trainer.TEXT_COLUMNS) | {5, 7}
+        columns = [
+            f'"{self.column_names[index]}"' if index in used_columns else "NULL"
+            for index in range(max(used_columns) + 1)
+        ]
+        return ", ".join(columns + [self.text_hash_sql()])
+
+    def fetch_dataset(self, country: str, tender_ids: List = None) -> Iterator[Tuple]:
+        """Stream a dataset from the database to train a model, ordered by tender ID, through a server-side cursor
+        that fetches FETCH_BATCH_SIZE rows at a time. The text hash of each row is appended as its last column.
+
+        Args:
+            country (str): Country dataset to fetch.
+            tender_ids (List, optional): Only fetch these tenders. Defaults to None (the whole country).
+
+        Yields:
+            Tuple: Rows from the database (examples to use as training data)
         """
         print("Fetching data...")
-        self.connect_database()
-        self.cur.execute(f"SELECT * FROM {TABLE_NAME} where country_iso='{country}'")
-        dataset = self.cur.fetchall()
-        self.close_database_connection()
+        query = f"SELECT {self.dataset_columns_sql()} FROM {TABLE_NAME} where country_iso=%s"
+        with self.pool.cursor(name=f"fetch_dataset_{uuid.uuid4().hex}") as cur:
+            cur.itersize = FETCH_BATCH_SIZE
+            if tender_ids is None:
+                cur.execute(query + " ORDER BY dgcnect_tender_id", (country,))
+            else:
+                cur.execute(
+                    query + " AND dgcnect_tender_id = ANY(%s) ORDER BY dgcnect_tender_id",
+                    (country, tender_ids),
+                )
+            yield from cur
+
+    def preprocess_country(
+        self, country: str, language: str, num_workers: int = PREPROCESS_WORKERS
+    ) -> Tuple[List, List]:
+        """Preprocess the dataset of a country through its corpus store, so that only tenders that are new or
+        whose text changed since the last build are fetched and cleaned/lemmatized again. Fetched rows are
+        streamed into preprocessing, only their preprocessed tokens are kept.
+
+        Args:
+            country (str): Country to preprocess
+            language (str): Language of the country
+            num_workers (int, optional): Number of preprocessing processes. Defaults to PREPROCESS_WORKERS.
+
+        Returns:
+            Tuple[List, List]: Labeled examples and inference examples
+        """
+        corpus_store = CorpusStore.load(country, language)
+        if corpus_store.entries:
+            text_hashes = self.fetch_text_hashes(country)
+            stale_tender_ids = corpus_store.stale_tender_ids(text_hashes)
+            dataset = (
+                self.fetch_dataset(country, stale_tender_ids) if stale_tender_ids else []
+            )
+            num_rows = len(stale_tender_ids)
+        else:
+            text_hashes = []
+            dataset = self.fetch_dataset(country)
+            num_rows = None
+
+        # remember the hash (and for full fetches the ID and label) of every row while it streams past
+        dataset_hashes = {}
+
+        def record_hashes(dataset):
+            for example in dataset:
+                dataset_hashes[str(example[7])] = example[-1]
+                if num_rows is None:
+                    text_hashes.append((example[7], example[-1], example[5]))
+                yield example
+
+        print("Cleaning new or changed tenders...")
+        preprocessed_tender_ids = set()
+        for original, input_text, _, tender_id in trainer.Trainer.preprocess_rows(
+            record_hashes(dataset), language, num_workers=num_workers, total=num_rows
+        ):
+            corpus_store.update(
+                tender_id, dataset_hashes[tender_id], original, input_text
+            )
+            preprocessed_tender_ids.add(tender_id)
+        # rows that did not pass Trainer.check_example
+        for tender_id, text_hash in dataset_hashes.items():
+            if tender_id not in preprocessed_tender_ids:
+                corpus_store.update(tender_id, text_hash, None, None)
+        print(f"Cleaned {len(dataset_hashes)} new or changed tenders")
+
+        preprocessed = corpus_store.examples(text_hashes)
+        corpus_store.save()
+        return trainer.Trainer.split_examples(preprocessed)
+
+    def new_tenders_sql(self) -> str:
+        """SQL condition selecting the tenders of a country (first parameter) with an ID above the watermark (second
+        parameter) or without a prediction. Tenders without any text are left out, they cannot be scored
+        (see Trainer.check_example) and are picked up once they get one."""
+        has_text = " OR ".join(
+            f'coalesce("{self.column_names[index]}"::text, \'\') <> \'\''
+            for index in trainer.TEXT_COLUMNS
+        )
+        return f"""country_iso=%s
+            AND (dgcnect_tender_id > %s OR innovation_prediction IS NULL)
+            AND ({has_text})"""
 
-        return dataset
+    def has_new_tenders(self, country: str, watermark: int) -> bool:
+        """Whether fetch_new_tenders would return any tenders, without fetching them"""
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {TABLE_NAME} WHERE {self.new_tenders_sql()})",
+                (country, watermark),
+            )
+            return cur.fetchone()[0]
+
+    def fetch_new_tenders(self, country: str, watermark: int) -> Iterator[Tuple]:
+        """Stream the tenders of a country with an ID above the watermark or without a prediction (and with some
+        text), in the row layout of fetch_dataset
+
+        Args:
+            country (str): Country to fetch
+            watermark (int): Highest tender ID delta scoring has seen
+
+        Yields:
+            Tuple: Rows from the database
+        """
+        query = f"""SELECT {self.dataset_columns_sql()} FROM {TABLE_NAME} WHERE {self.new_tenders_sql()}
+            ORDER BY dgcnect_tender_id"""
+        with self.pool.cursor(name=f"fetch_new_tenders_{uuid.uuid4().hex}") as cur:
+            cur.itersize = FETCH_BATCH_SIZE
+            cur.execute(query, (country, watermark))
+            yield from cur
+
+    def score_new_tenders(self, country: str) -> int:
+        """Score the tenders that were added to the database since the model of a country was trained, without
+        retraining it. Tenders above the model's watermark or without a prediction are preprocessed and scored
+        with the current vectorizer and classifier, their predictions are written back and they are saved in a
+        pending file next to the model, so a round costs in proportion to the new tenders. A round first checks
+        the saved delta state and the database, and only loads the model when there are new tenders or pending
+        ones to append. Until the pending tenders are appended to the model (once fold_due says so), they are
+        explained by inference like any other tender that is not part of the model. Tenders already in the model
+        that lost their prediction get the stored one written back. Countries that are being retrained, or whose
+        saved model is newer than the loaded one, are skipped, their new tenders are picked up by the next round.
+
+        Args:
+            country (str): Country to score
+
+        Returns:
+            int: Number of tenders appended to the model (0 if they were only saved as pending)
+        """
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(
+                    file_lock(self.retrain_jobs.lock_path(country), blocking=False)
+                )
+            except BlockingIOError:
+                return 0
+            manifest = CountryModelData.load_manifest(country)
+            if manifest is None:
+                return 0
+            delta = manifest.get("delta", {})
+            if (
+                delta.get("watermark") is not None
+                and not CountryModelData.fold_due(
+                    delta.get("pending", []), manifest["summary"]["NumExamples"]
+                )
+                and not self.has_new_tenders(country, delta["watermark"])
+            ):
+                return 0
+
+            language = country2language[country]
+            country_model_data = self.country_model_data[country]
+            if manifest["generation"] != country_model_data.generation:
+                return 0
+            # the delta state is saved without a new generation, so the loaded model may hold an older one
+            country_model_data.restore_delta_state(delta)
+            language_model_data = country_model_data.language_to_model_data[language]
+            tender_data = language_model_data.tender_data
+            watermark = country_model_data.watermark
+            if watermark is None:
+                watermark = max(
+                    (int(tender_id) for tender_id in np.asarray(tender_data.tender_ids)),
+                    default=-1,
+                )
+
+            with metrics.phase("fetch_new_tenders"):
+                rows = list(self.fetch_new_tenders(country, watermark))
+            tender_index = tender_data.index()
+            known_rows = [
+                tender_index[str(row[7])] for row in rows if str(row[7]) in tender_index
+            ]
+            new_rows = [row for row in rows if str(row[7]) not in tender_index]
+            with metrics.phase("preprocess"):
+                preprocessed = list(
+                    trainer.Trainer.preprocess_rows(
+                        new_rows,
+                        language,
+                        num_workers=1
+                        if len(new_rows) < PREPROCESS_CHUNK_SIZE
+                        else PREPROCESS_WORKERS,
+                    )
+                )
+            watermark = max([watermark] + [row[7] for row in rows])
+
+            prediction_rows = self.prediction_rows(tender_data, known_rows)
+            # pending tenders that lost their prediction are scored again, but only written back
+            pending_tender_ids = country_model_data.pending_tender_ids()
+            preprocessed.sort(key=lambda example: example[3] in pending_tender_ids)
+            num_pending = sum(
+                example[3] not in pending_tender_ids for example in preprocessed
+            )
+            scored = None
+            if preprocessed:
+                originals, input_texts, labels, tender_ids = map(list, zip(*preprocessed))
+                with metrics.phase("predict"):
+                    features = language_model_data.vectorizer.transform(input_texts)
+                    predictions = language_model_data.classifier.predict(features)
+                    predict_probas = language_model_data.classifier.predict_proba(
+                        features
+                    )[:, 1]
+                scored = TenderData(
+                    features[:num_pending],
+                    predictions[:num_pending],
+                    predict_probas[:num_pending],
+                    np.array(
+                        [2 if label is None else label for label in labels[:num_pending]]
+                    ),
+                    tender_ids[:num_pending],
+                )
+                prediction_rows += [
+                    (tender_id, int(prediction), round(float(predict_proba), 5))
+                    for tender_id, prediction, predict_proba in zip(
+                        tender_ids, predictions, predict_probas
+                    )
+                ]
+            if prediction_rows:
+                self.write_predictions(country, prediction_rows)
+
+            num_new_tenders = 0
+            with country_model_data.lock, file_lock(CountryModelData.lock_path(country)):
+                manifest = CountryModelData.load_manifest(country)
+                if (
+                    self.country_model_data[country] is not country_model_data
+                    or manifest is None
+                    or manifest["generation"] != country_model_data.generation
+                ):
+                    # replaced in the meantime, scored again in the next round
+                    return 0
+                country_model_data.watermark = watermark
+                if num_pending > 0:
+                    country_model_data.save_pending(
+                        language,
+                        scored,
+                        originals[:num_pending],
+                        input_texts[:num_pending],
+                    )
+                else:
+                    country_model_data.save_delta_state()
+                if CountryModelData.fold_due(
+                    country_model_data.pending,
+                    country_model_data.summary()["NumExamples"],
+                ):
+                    num_new_tenders = self.fold_pending_tenders(
+                        country, country_model_data
+                    )
+        if num_new_tenders:
+            self.global_data.pop(country, None)
+            self.model_changed(country)
+        print(
+            f"Scored {num_pending} new tenders of {country}, appended {num_new_tenders} to the model"
+        )
+        return num_new_tenders
+
+    def fold_pending_tenders(
+        self, country: str, country_model_data: CountryModelData
+    ) -> int:
+        """Append the pending tenders of delta scoring to a country's model and save it as a new generation (call
+        with the model's lock and the country's lock file held)
+
+        Returns:
+            int: Number of tenders appended
+        """
+        new_country_model_data = CountryModelData(
+            country, {}, version=country_model_data.version + 1
+        )
+        num_new_tenders = 0
+        with metrics.phase("fold_pending"):
+            for language, language_model_data in country_model_data.language_to_model_data.items():
+                tender_data = language_model_data.tender_data
+                pending = country_model_data.load_pending(language)
+                if pending is not None:
+                    tender_data = tender_data.append(**pending)
+                    num_new_tenders += len(pending["tender_ids"])
+                new_country_model_data.language_to_model_data[language] = LanguageModelData(
+                    language_model_data.classifier,
+                    language_model_data.vectorizer,
+                    language_model_data.stop_words,
+                    language_model_data.deleted_words,
+                    tender_data,
+                )
+        new_country_model_data.watermark = country_model_data.watermark
+        self.swap_model(country, country_model_data, new_country_model_data)
+        return num_new_tenders
+
+    def score_new_tenders_all(self) -> bool:
+        """Score the new tenders of every country, see score_new_tenders
+
+        Returns:
+            bool: Whether any model changed
+        """
+        changed = False
+        for country in self.country_model_data:
+            try:
+                changed = self.score_new_tenders(country) > 0 or changed
+            except Exception as e:
+                print(f"Scoring the new tenders of {country} failed: {e}")
+        return changed
+
+    def start_delta_scoring(self, interval: float = DELTA_SCORING_INTERVAL_SECONDS):
+        """Score the new tenders of every country every interval seconds in a background thread"""
+
+        def score_periodically():
+            while True:
+                time.sleep(interval)
+                self.score_new_tenders_all()
+
+        threading.Thread(
+            target=score_periodically, name="delta-scoring", daemon=True
+        ).start()
 
     def fetch_tender(self, country: str, tender_id: str) -> List:
         """Fetch a particular tender from the database.
@@ -270,15 +914,35 @@ class PostgresCountryModel:
         Returns:
             List: Tender that was requested.
         """
-        self.connect_database()
-        self.cur.execute(
-            f"SELECT * FROM {TABLE_NAME} where country_iso='{country}' AND dgcnect_tender_id={tender_id}"
-        )
-        example = self.cur.fetchall()
-        self.close_database_connection()
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"SELECT * FROM {TABLE_NAME} where country_iso=%s AND dgcnect_tender_id=%s",
+                (country, tender_id),
+            )
+            example = cur.fetchall()
 
         return example[0]
 
+    def fetch_tenders(self, country: str, tender_ids: List[int]) -> Dict[str, List]:
+        """Fetch several tenders of a country from the database with one query
+
+        Args:
+            country (str): Country of the tenders
+            tender_ids (List[int]): Tender IDs
+
+        Returns:
+            Dict[str, List]: Fetched tenders by tender ID, tenders that do not exist are left out
+        """
+        if not tender_ids:
+            return {}
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"SELECT * FROM {TABLE_NAME} where country_iso=%s AND dgcnect_tender_id = ANY(%s::bigint[])",
+                (country, tender_ids),
+            )
+            examples = cur.fetchall()
+        return {str(example[7]): example for example in examples}
+
     def infer_model(self, country: str, example: List) -> Tuple:
         """Infer a country model on a fetched tender.
 
@@ -305,6 +969,49 @@ class PostgresCountryModel:
 
         return tokens, lemmatized_tokens, features, pred_index, pred
 
+    def score_texts(self, country: str, texts: List[str]) -> List[Dict]:
+        """Infer a country model on raw tender texts in one vectorized transform and predict call
+
+        Args:
+            country (str): Country model to infer
+            texts (List[str]): Tender texts (title followed by description)
+
+        Returns:
+            List[Dict]: Prediction index and prediction probability per text
+        """
+        language = country2language[country]
+        language_model_data = self.country_model_data[country].language_to_model_data[
+            language
+        ]
+        input_texts = [
+            " ".join(trainer.Trainer.text_input(text, language)[1]) for text in texts
+        ]
+        features = language_model_data.vectorizer.transform(input_texts)
+        pred_probas = language_model_data.classifier.predict_proba(features)
+        pred_indices = pred_probas.argmax(-1)
+        return [
+            {
+                "Prediction": int(pred_index),
+                "PredictionProbability": float(pred_proba[pred_index]),
+            }
+            for pred_index, pred_proba in zip(pred_indices, pred_probas)
+        ]
+
+    def score_text(self, country: str, title: str, description: str) -> Dict:
+        """Score a tender that is not in the database, batched with concurrent requests for the same country
+
+        Args:
+            country (str): Country model to infer
+            title (str): Tender title
+            description (str): Tender description
+
+        Returns:
+            Dict: Prediction index (innovative or not) and prediction probability
+        """
+        if country not in self.country_model_data:
+            raise KeyError(f"No model for country: {country}")
+        return self.score_batcher.submit(country, (title or "") + (description or ""))
+
     def annotate_tender(self, country: str, tender_id: str, annotation: int):
         """Manually annotate a tender and save its label to the database
 
@@ -313,21 +1020,142 @@ class PostgresCountryModel:
             tender_id (_type_): Tender ID
             annotation (_type_): Label (0 or 1) (non-innovative or innovative)
         """
-        self.connect_database()
-        self.cur.execute(
-            f"UPDATE {TABLE_NAME} SET innovation_label={annotation} WHERE country_iso='{country}' AND dgcnect_tender_id={tender_id}"
-        )
-        self.conn.commit()
-        self.close_database_connection()
+        with self.pool.cursor() as cur:
+            cur.execute(
+                f"UPDATE {TABLE_NAME} SET innovation_label=%s WHERE country_iso=%s AND dgcnect_tender_id=%s",
+                (annotation, country, tender_id),
+            )
 
         language = country2language[country]
-        country_model_data = self.country_model_data[country]
-        tender_data = country_model_data.language_to_model_data[language].tender_data
-        tender_index = tender_data.tender_ids.index(tender_id)
-        tender_data.labels[tender_index] = annotation
-        country_model_data.save()
+        while True:
+            country_model_data = self.country_model_data[country]
+            with country_model_data.lock:
+                if self.country_model_data[country] is not country_model_data:
+                    # replaced by a retrain in the meantime
+                    continue
+                tender_index, previous_label = country_model_data.annotate(
+                    language, tender_id, annotation
+                )
+                confusion_index = self.detailed_country_data.get(country)
+                if (
+                    confusion_index is not None
+                    and confusion_index.is_for(
+                        country_model_data.language_to_model_data[language].tender_data
+                    )
+                    and confusion_index.version == country_model_data.version - 1
+                ):
+                    confusion_index.update_label(
+                        tender_index,
+                        previous_label,
+                        annotation,
+                        country_model_data.version,
+                    )
+                break
+        self.country_model_data.invalidate_summary(country)
+        if len(country_model_data.journal) >= ANNOTATION_COMPACT_THRESHOLD:
+            self.schedule_compaction(country)
         print("annotated")
 
+    @property
+    def models_version(self) -> Tuple:
+        """Key of the data that covers all countries: changes when a model is replaced or reloaded, and with the
+        annotation journals, which grow with the annotations of every serving process"""
+        return (self._models_version, self.country_model_data.journal_sizes())
+
+    def model_changed(self, country: str):
+        """Notify that a new generation of a country's model was saved"""
+        self._models_version += 1
+        for callback in self.on_model_change:
+            try:
+                callback(country)
+            except Exception as e:
+                print(f"Model change callback failed for {country}: {e}")
+
+    def preload_models(self):
+        """Load the summaries of all countries, and their models as far as they fit into the model cache budget,
+        e.g. before forking serving processes"""
+        self.country_model_data.preload()
+        for country in self.country_model_data:
+            self.country_model_data.summary(country)
+
+    def reload_models(self):
+        """Reload the loaded models from disk and drop the data derived from them"""
+        self.country_model_data.reload()
+        self._models_version += 1
+        self.detailed_country_data = {}
+        self.global_data.clear()
+        self.plot_cache.cache.clear()
+
+    def busy(self) -> bool:
+        """Whether retraining jobs or annotation compactions are pending"""
+        with self.compaction_lock:
+            if self.pending_compactions or self.num_compacting:
+                return True
+        return self.retrain_jobs.busy()
+
+    def schedule_compaction(self, country: str):
+        """Write the journaled annotations of a country into its model artifact in the background"""
+        with self.compaction_lock:
+            if country in self.pending_compactions:
+                return
+            self.pending_compactions.add(country)
+        self.compaction_executor.submit(self.compact_country, country)
+
+    def compact_country(self, country: str):
+        with self.compaction_lock:
+            self.pending_compactions.discard(country)
+            self.num_compacting += 1
+        try:
+            if self.country_model_data[country].compact():
+                # the other serving processes may not have read all annotations before the journal was cleared
+                self.model_changed(country)
+        except Exception as e:
+            print(f"Compacting the annotations of {country} failed: {e}")
+        finally:
+            with self.compaction_lock:
+                self.num_compacting -= 1
+
+    def get_lemma_cache_stats(self) -> Dict:
+        """Get size and hit/miss statistics of the per-language lemma caches
+
+        Returns:
+            Dict: Statistics per language
+        """
+        return lemma_cache_stats()
+
+    def get_database_pool_stats(self) -> Dict:
+        """Get size and wait time statistics of the database connection pool
+
+        Returns:
+            Dict: Pool statistics
+        """
+        return self.pool.stats()
+
+    def get_plot_cache_stats(self) -> Dict:
+        """Get size and hit/miss statistics of the rendered explanation plots
+
+        Returns:
+            Dict: Plot cache statistics
+        """
+        return self.plot_cache.stats()
+
+    def get_model_cache_stats(self) -> Dict:
+        """Get the loaded countries and memory usage of the country model cache
+
+        Returns:
+            Dict: Cache statistics
+        """
+        return self.country_model_data.stats()
+
+    def country_version(self, country: str) -> int:
+        """Version of a country's model, bumped by retraining and annotations"""
+        return self.country_model_data[country].version
+
+    def country_generation(self, country: str) -> str:
+        """Generation of a country's saved model, which changes when it is retrained or new tenders are scored into
+        it, but not with annotations. Used to key data that does not depend on the labels."""
+        return self.country_model_data[country].generation
+
     def get_countries_data(self) -> Dict:
         """Get descriptives for all countries (number of examples, number of (non)innovative tenders, etc.)
 
@@ -335,23 +1163,8 @@ class PostgresCountryModel:
             Dict: Descriptives for a country used for frontend
         """
         retval = []
-        print(self.country_model_data.keys())
         for key in self.country_model_data.keys():
-            language = country2language[key]
-            country_model_data = self.country_model_data[key]
-            tender_data = country_model_data.language_to_model_data[
-                language
-            ].tender_data
-            metadata_dict = {
-                "NumExamples": tender_data.predictions.shape[0],
-                "NumInnovative": tender_data.labels[tender_data.labels < 2]
-                .sum()
-                .item(),
-                "NumNonInnovative": (
-                    tender_data.predictions.shape[0]
-                    - tender_data.labels[tender_data.labels < 2].sum()
-                ).item(),
-            }
+            metadata_dict = self.country_model_data.summary(key)
             retval.append(
                 {
                     "CountryName": alpha2name[key],
@@ -361,68 +1174,28 @@ class PostgresCountryModel:
             )
         return retval
 
-    def calculate_details_for_country(self, country: str) -> Dict:
-        """Calculate the confusion matrix for a country, alongside unlabeled and labeled statistics (used for frontend)
+    def calculate_details_for_country(self, country: str) -> ConfusionIndex:
+        """Calculate the confusion matrix for a country, alongside unlabeled and labeled statistics (used for frontend).
+        The result is cached per model version.
 
         Args:
             country (str): Country to calculate stats for.
 
         Returns:
-            Dict: Calculated statistics
+            ConfusionIndex: Calculated statistics
         """
         language = country2language[country]
         country_model_data = self.country_model_data[country]
         tender_data = country_model_data.language_to_model_data[language].tender_data
-        metadata_dict = {
-            "NumExamples": tender_data.predictions.shape[0],
-            "NumInnovative": tender_data.labels[tender_data.labels < 2].sum().item(),
-            "NumNonInnovative": (
-                tender_data.predictions.shape[0]
-                - tender_data.labels[tender_data.labels < 2].sum()
-            ).item(),
-        }
-        selected_prediction_type_dict = {
-            "TruePositive": [],
-            "TrueNegative": [],
-            "FalsePositive": [],
-            "FalseNegative": [],
-            "UnlabeledPositive": [],
-            "UnlabeledNegative": [],
-        }
-        for i, (all_label, all_pred, all_tender_id) in enumerate(
-            zip(tender_data.labels, tender_data.predictions, tender_data.tender_ids)
+        confusion_index = self.detailed_country_data.get(country)
+        if (
+            confusion_index is None
+            or not confusion_index.is_for(tender_data)
+            or confusion_index.version != country_model_data.version
         ):
-            if all_label == 1:
-                if all_label == all_pred:
-                    selected_prediction_type_dict["TruePositive"].append(
-                        str(all_tender_id)
-                    )
-                else:
-                    selected_prediction_type_dict["FalseNegative"].append(
-                        str(all_tender_id)
-                    )
-            elif all_label == 0:
-                if all_label == all_pred:
-                    selected_prediction_type_dict["TrueNegative"].append(
-                        str(all_tender_id)
-                    )
-                else:
-                    selected_prediction_type_dict["FalsePositive"].append(
-                        str(all_tender_id)
-                    )
-            else:
-                if all_pred == 0:
-                    selected_prediction_type_dict["UnlabeledNegative"].append(
-                        str(all_tender_id)
-                    )
-                else:
-                    selected_prediction_type_dict["UnlabeledPositive"].append(
-                        str(all_tender_id)
-                    )
-        self.detailed_country_data[country] = {
-            "Metadata": metadata_dict,
-            "Details": selected_prediction_type_dict,
-        }
+            confusion_index = ConfusionIndex(tender_data, country_model_data.version)
+            self.detailed_country_data[country] = confusion_index
+        return confusion_index
 
     def get_country_data(self, country: str) -> Dict:
         """Fetch stats for a single country
@@ -433,107 +1206,120 @@ class PostgresCountryModel:
         Returns:
             Dict: Fetched stats
         """
-        self.calculate_details_for_country(country=country)
-        return self.detailed_country_data[country]
+        language = country2language[country]
+        while True:
+            tender_data = self.country_model_data[country].language_to_model_data[
+                language
+            ].tender_data
+            confusion_index = self.calculate_details_for_country(country=country)
+            if confusion_index.is_for(tender_data):
+                return confusion_index.details(tender_data.tender_ids)
+            # replaced by a retrain in the meantime
 
-    def calculate_global_data(self, country: str, n_words: int = 200):
-        """Calculate global importance data for a country
+    def calculate_global_data(self, country: str) -> GlobalImportance:
+        """Calculate global importance data for a country, reusing the cached data while the model is not retrained
 
         Args:
             country (str): Country to calculate global importances for
-            n_words (int, optional): Number of words to calculate importances for. Defaults to 200.
         """
-        # fetch the model
-        score_key = []
         language = country2language[country]
         country_model_data = self.country_model_data[country]
         language_model_data = country_model_data.language_to_model_data[language]
-        tender_data = language_model_data.tender_data
-        clf, vectorizer = language_model_data.classifier, language_model_data.vectorizer
-        all_features, all_tender_ids = tender_data.features, tender_data.tender_ids
-
-        # store the scores for each token
-        score_key = []
-        for key, index in vectorizer.vocabulary_.items():
-            score_key.append((key, clf.coef_[0][index], index))
-        score_key = sorted(score_key, reverse=True, key=lambda k: k[1])
-
-        # get tenders with top scores for a particular token
-        top_score_key_tenders = []
-        for token, score, word_index in score_key[:n_words]:
-            if score < 0:
-                break
-            tender_appears = all_features[:, word_index].nonzero()[0]
-            tender_id_appears = [
-                all_tender_ids[tender_appear] for tender_appear in tender_appears
-            ]
-            top_score_key_tenders.append((token, score, tender_id_appears))
-
-        # get tenders with bottom scores for a particular token
-        bottom_score_key_tenders = []
-        for token, score, word_index in score_key[-n_words:]:
-            if score > 0:
-                break
-            tender_appears = all_features[:, word_index].nonzero()[0]
-            tender_id_appears = [
-                all_tender_ids[tender_appear] for tender_appear in tender_appears
-            ]
-            bottom_score_key_tenders.append((token, score, tender_id_appears))
-        bottom_score_key_tenders = bottom_score_key_tenders[::-1]
-
-        self.global_data[country] = {
-            "TopWords": top_score_key_tenders,
-            "BottomWords": bottom_score_key_tenders,
-            "DeletedWords": language_model_data.deleted_words,
-        }
+        global_importance = self.global_data.get(country)
+        if global_importance is None or not global_importance.is_for(language_model_data):
+            global_importance = GlobalImportance(
+                language_model_data, country_model_data.version
+            )
+            self.global_data.put(country, global_importance)
+        return global_importance
 
-    def get_global_data(self, country: str) -> Dict:
+    def get_global_data(
+        self, country: str, n_words: int = 200, page: int = None, page_size: int = None
+    ) -> Dict:
         """Get global importance scores for a country
 
         Args:
             country (str): Country to fetch the global data for
+            n_words (int, optional): Number of top and of bottom words. Defaults to 200.
+            page (int, optional): 1-based page of tender IDs per word. Defaults to None.
+            page_size (int, optional): Number of tender IDs per word and page. Defaults to None (all tender IDs).
 
         Returns:
             Dict: Global data
         """
-        return self.global_data[country]
+        return self.calculate_global_data(country).global_data(
+            n_words, page, page_size
+        )
 
-    def get_tender_data(self, country: str, tender_id: str) -> Dict:
-        """Get data used for single tender visualization. Includes per-token importances,
-        prediction information and an image of the importance plot for that tender.
+    def explanation_input(
+        self, country: str, tender_id: str, language_model_data: LanguageModelData
+    ) -> Tuple:
+        """Tokens, features and model outputs of a tender. Tenders the model was trained on are served from the
+        stored token sequences and feature rows; others (added after the last training, or models saved without
+        token sequences) are fetched from the database and inferred.
+
+        Returns:
+            Tuple: Space-joined tokens and lemmatized tokens, features, prediction index, prediction probability
+            and label (2 if unlabeled)
+        """
+        tender_data = language_model_data.tender_data
+        if tender_data.token_store is not None:
+            try:
+                row = tender_data.row(tender_id)
+            except KeyError:
+                row = None
+            if row is not None:
+                original_text, lemma_text = tender_data.token_store.texts(row)
+                prediction = int(tender_data.predictions[row])
+                probability = float(tender_data.predict_probas[row])
+                return (
+                    original_text,
+                    lemma_text,
+                    tender_data.features[row],
+                    prediction,
+                    probability if prediction == 1 else 1.0 - probability,
+                    int(tender_data.labels[row]),
+                )
+
+        return self.inferred_explanation_input(
+            country, self.fetch_tender(country, tender_id)
+        )
+
+    def inferred_explanation_input(self, country: str, example: List) -> Tuple:
+        """explanation_input of a tender fetched from the database, inferred with the country's model"""
+        tokens, lemmatized_tokens, features, prediction, probability = self.infer_model(
+            country, example
+        )
+        return (
+            " ".join(tokens),
+            " ".join(lemmatized_tokens),
+            features,
+            prediction.tolist(),
+            probability,
+            int(example[5]) if example[5] is not None else 2,
+        )
+
+    def score_tokens(
+        self,
+        vectorizer,
+        original_text: str,
+        lemma_text: str,
+        word_scores: Dict[int, float],
+    ) -> Tuple[List, Dict, Dict]:
+        """Map the scores of the vocabulary words of a tender onto its tokens
 
         Args:
-            country (str): Country of the tender.
-            tender_id (str): Tender ID
+            vectorizer: Vectorizer of the model
+            original_text (str): Space-joined tokens of the tender
+            lemma_text (str): Space-joined lemmatized tokens of the tender
+            word_scores (Dict[int, float]): Score (feature value times coefficient) per vocabulary index
 
         Returns:
-            Dict: Data used for single tender visualization.
+            Tuple[List, Dict, Dict]: [token, score] pairs, score per lemma and original tokens per lemma
         """
-        # load the trained model
-        language = country2language[country]
-        country_model_data = self.country_model_data[country]
-        language_model_data = country_model_data.language_to_model_data[language]
-        clf, vectorizer = language_model_data.classifier, language_model_data.vectorizer
-        # fetch the requested tender
-        example = self.fetch_tender(country, tender_id)
-        (
-            original_words,
-            lemma_words,
-            features,
-            tender_prediction,
-            tender_prediction_probability,
-        ) = self.infer_model(country, example)
         # preprocess original tender into tokens
-        original_words = vectorizer.build_preprocessor()(
-            " ".join(original_words)
-        ).split(" ")
-        lemma_words = vectorizer.build_preprocessor()(" ".join(lemma_words)).split(" ")
-        tender_prediction = tender_prediction.tolist()
-        tender_label = 2
-        if example[5] is not None:
-            tender_label = int(example[5])
-        # get scores for each token from the model, then sum them and map them to original words
-        word_scores = features.multiply(clf.coef_[0]).tocsr()
+        original_words = vectorizer.build_preprocessor()(original_text).split(" ")
+        lemma_words = vectorizer.build_preprocessor()(lemma_text).split(" ")
         scored_words = []
         word_score = {}
         lemma_original = {}
@@ -543,7 +1329,7 @@ class PostgresCountryModel:
             score = 0.0
             if lemma_word in vectorizer.vocabulary_:
                 word_index = vectorizer.vocabulary_[lemma_word]
-                score = word_scores[0, word_index].item()
+                score = word_scores.get(word_index, 0.0)
 
             if lemma_word not in word_score:
                 word_score[lemma_word] = 0
@@ -555,146 +1341,56 @@ class PostgresCountryModel:
             if original_word == "of" and score != 0:
                 print(original_word, score, lemma_word)
             scored_words.append([original_word, score])
-        # create a plot of the summed token importances
-        fig, ax = plt.subplots()
-        word_score = dict(sorted(word_score.items(), key=lambda k: k[1]))
-        vis_words = []
-        current_sum = 0
-        bias = np.array(clf.intercept_)
-        ax.axvline(x=-bias[0], color="red", label="decision boundary")
-        ax.text(
-            -bias[0] + 0.05, 5, "decision boundary", rotation=90, color="r", va="center"
-        )
-        ax.axvline(x=0, color="black", label="zero", linestyle="dashed")
-
-        # plot positive words first
-        current_word_index = 0
-        top_keys = list(word_score.keys())
-        top_keys.reverse()
-        positive_other_sum = 0.0
-        for i, lemma_word in enumerate(top_keys):
-            if i < NUM_WORDS and word_score[lemma_word] > 0:
-                ax.barh(
-                    current_word_index,
-                    current_sum + word_score[lemma_word],
-                    align="center",
-                    color="r",
-                )
-                ax.barh(current_word_index, current_sum, align="center", color="white")
-                current_sum += word_score[lemma_word]
-                vis_words.append(lemma_original[lemma_word][0].lower())
-                ax.text(
-                    current_sum + 0.1,
-                    current_word_index,
-                    str(round(word_score[lemma_word], 2)),
-                    color="r",
-                    va="center",
-                )
-                current_word_index += 1
-            elif word_score[lemma_word] > 0:
-                positive_other_sum += word_score[lemma_word]
-            else:
-                break
-        ax.barh(NUM_WORDS, current_sum + positive_other_sum, align="center", color="r")
-        ax.barh(NUM_WORDS, current_sum, align="center", color="white")
-        current_sum += positive_other_sum
-        vis_words.append("remaining POSITIVE")
-        ax.text(
-            current_sum + 0.1,
-            current_word_index,
-            str(round(positive_other_sum, 2)),
-            color="r",
-            va="center",
-        )
-        current_word_index += 1
-        # plot negative words
-        bot_keys = list(word_score.keys())
-        negative_other_sum = 0.0
-        for i, lemma_word in enumerate(bot_keys):
-            if i < NUM_WORDS and word_score[lemma_word] < 0:
-                if current_sum > 0:
-                    zero_to_pos = current_sum + word_score[lemma_word]
-                    ax.barh(current_word_index, current_sum, align="center", color="b")
-                    if zero_to_pos > 0:
-                        ax.barh(
-                            current_word_index,
-                            zero_to_pos,
-                            align="center",
-                            color="white",
-                        )
-                    else:
-                        ax.barh(
-                            current_word_index, current_sum, align="center", color="b"
-                        )
-                        ax.barh(
-                            current_word_index, zero_to_pos, align="center", color="b"
-                        )
-                else:
-                    ax.barh(
-                        current_word_index,
-                        current_sum + word_score[lemma_word],
-                        align="center",
-                        color="b",
-                    )
-                    ax.barh(
-                        current_word_index, current_sum, align="center", color="white"
-                    )
-                ax.text(
-                    current_sum + 0.1,
-                    current_word_index,
-                    str(round(word_score[lemma_word], 2)),
-                    color="blue",
-                    va="center",
-                )
-                current_word_index += 1
-                current_sum += word_score[lemma_word]
-                vis_words.append(lemma_original[lemma_word][0].lower())
-            elif word_score[lemma_word] < 0:
-                negative_other_sum += word_score[lemma_word]
-            else:
-                break
-        # draw remainder of negative
-        if current_sum > 0:
-            zero_to_pos = current_sum + negative_other_sum
-            ax.barh(current_word_index, current_sum, align="center", color="b")
-            if zero_to_pos > 0:
-                ax.barh(current_word_index, zero_to_pos, align="center", color="white")
-            else:
-                ax.barh(current_word_index, current_sum, align="center", color="b")
-                ax.barh(current_word_index, zero_to_pos, align="center", color="b")
-        else:
-            ax.barh(
-                current_word_index,
-                current_sum + negative_other_sum,
-                align="center",
-                color="b",
+        return scored_words, word_score, lemma_original
+
+    @staticmethod
+    def row_scores(word_scores, row: int) -> Dict[int, float]:
+        """Nonzero scores of a row of a CSR matrix of word scores, by vocabulary index"""
+        start, end = word_scores.indptr[row], word_scores.indptr[row + 1]
+        return dict(
+            zip(
+                word_scores.indices[start:end].tolist(),
+                word_scores.data[start:end].tolist(),
             )
-            ax.barh(current_word_index, current_sum, align="center", color="white")
-        ax.text(
-            current_sum + 0.1,
-            current_word_index,
-            str(round(negative_other_sum, 2)),
-            color="blue",
-            va="center",
         )
-        current_word_index += 1
-        current_sum += negative_other_sum
-        vis_words.append("remaining NEGATIVE")
 
-        ax.set_yticks(
-            np.linspace(0, current_word_index + 1, current_word_index + 1),
-            labels=vis_words + [""],
+    def get_tender_data(self, country: str, tender_id: str) -> Dict:
+        """Get data used for single tender visualization. Includes per-token importances,
+        prediction information and an image of the importance plot for that tender.
+
+        Args:
+            country (str): Country of the tender.
+            tender_id (str): Tender ID
+
+        Returns:
+            Dict: Data used for single tender visualization.
+        """
+        # load the trained model
+        language = country2language[country]
+        country_model_data = self.country_model_data[country]
+        language_model_data = country_model_data.language_to_model_data[language]
+        clf, vectorizer = language_model_data.classifier, language_model_data.vectorizer
+        (
+            original_text,
+            lemma_text,
+            features,
+            tender_prediction,
+            tender_prediction_probability,
+            tender_label,
+        ) = self.explanation_input(country, tender_id, language_model_data)
+        # get scores for each token from the model, then sum them and map them to original words
+        word_scores = features.multiply(clf.coef_[0]).tocsr()
+        scored_words, word_score, lemma_original = self.score_tokens(
+            vectorizer, original_text, lemma_text, self.row_scores(word_scores, 0)
+        )
+        # create a plot of the summed token importances
+        b64_image = self.plot_cache.get(
+            (country, str(tender_id), country_model_data.generation),
+            render_explanation_plot,
+            word_score,
+            lemma_original,
+            clf.intercept_,
         )
-        ax.invert_yaxis()
-        fig.tight_layout()
-        # encode the image to png
-        filename = uuid.uuid4()
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        buf.seek(0)
-        byte_image = buf.read().hex()
-        b64_image = codecs.encode(codecs.decode(byte_image, "hex"), "base64").decode()
-        plt.close()
         # return the object
         return {
             "WordScores": scored_words,
@@ -703,3 +1399,146 @@ class PostgresCountryModel:
             "PredictionProbability": tender_prediction_probability,
             "Label": tender_label,
         }
+
+    def get_tender_data_batch(
+        self, country: str, tender_ids: List[str], plots: bool = False
+    ) -> Dict:
+        """Get the data used for single tender visualization for many tenders of a country at once. The word scores
+        of all tenders the model was trained on are computed with one sparse multiply; other tenders are fetched
+        from the database with one query and inferred. Tender IDs that are not numeric, unknown, or fail to be
+        explained are reported per ID instead of failing the batch.
+
+        Args:
+            country (str): Country of the tenders
+            tender_ids (List[str]): Tender IDs
+            plots (bool, optional): Whether to include the importance plots. Defaults to False.
+
+        Raises:
+            ValueError: More tender IDs than TENDER_BATCH_MAX_SIZE
+
+        Returns:
+            Dict: Data per tender, in request order, the tender IDs that were not found, and errors (status and
+            message) of the tender IDs that are invalid or could not be explained
+        """
+        if len(tender_ids) > TENDER_BATCH_MAX_SIZE:
+            raise ValueError(
+                f"At most {TENDER_BATCH_MAX_SIZE} tenders can be requested at once, got {len(tender_ids)}"
+            )
+        language = country2language[country]
+        country_model_data = self.country_model_data[country]
+        language_model_data = country_model_data.language_to_model_data[language]
+        clf, vectorizer = language_model_data.classifier, language_model_data.vectorizer
+        tender_data = language_model_data.tender_data
+
+        tenders = []
+        not_found = []
+        errors = []
+        # tender IDs are bigints in the database, invalid ones are rejected before querying it
+        valid_tender_ids = []
+        for tender_id in tender_ids:
+            try:
+                tender_id = str(int(str(tender_id)))
+                if not -(2**63) <= int(tender_id) < 2**63:
+                    raise ValueError(tender_id)
+            except ValueError:
+                errors.append(
+                    {
+                        "TenderID": str(tender_id),
+                        "Status": 400,
+                        "Error": f"Invalid tender ID: {tender_id}",
+                    }
+                )
+                continue
+            valid_tender_ids.append(tender_id)
+
+        # rows of the tenders that can be served from the model, the others are fetched from the database
+        rows = {}
+        if tender_data.token_store is not None:
+            tender_index = tender_data.index()
+            for tender_id in valid_tender_ids:
+                row = tender_index.get(tender_id)
+                if row is not None:
+                    rows[tender_id] = row
+        examples = self.fetch_tenders(
+            country,
+            list(
+                dict.fromkeys(
+                    int(tender_id)
+                    for tender_id in valid_tender_ids
+                    if tender_id not in rows
+                )
+            ),
+        )
+        selected_rows = list(dict.fromkeys(rows.values()))
+        selected_index = {row: i for i, row in enumerate(selected_rows)}
+        word_scores = (
+            tender_data.features[selected_rows].multiply(clf.coef_[0]).tocsr()
+            if selected_rows
+            else None
+        )
+
+        plot_futures = []
+        for tender_id in valid_tender_ids:
+            row = rows.get(tender_id)
+            if row is None and tender_id not in examples:
+                not_found.append(tender_id)
+                continue
+            try:
+                if row is not None:
+                    original_text, lemma_text = tender_data.token_store.texts(row)
+                    prediction = int(tender_data.predictions[row])
+                    probability = float(tender_data.predict_probas[row])
+                    if prediction != 1:
+                        probability = 1.0 - probability
+                    label = int(tender_data.labels[row])
+                    scores = self.row_scores(word_scores, selected_index[row])
+                else:
+                    (
+                        original_text,
+                        lemma_text,
+                        features,
+                        prediction,
+                        probability,
+                        label,
+                    ) = self.inferred_explanation_input(
+                        country, examples[tender_id]
+                    )
+                    scores = self.row_scores(
+                        features.multiply(clf.coef_[0]).tocsr(), 0
+                    )
+                scored_words, word_score, lemma_original = self.score_tokens(
+                    vectorizer, original_text, lemma_text, scores
+                )
+            except Exception as e:
+                errors.append({"TenderID": tender_id, "Status": 500, "Error": str(e)})
+                continue
+            tender = {
+                "TenderID": tender_id,
+                "WordScores": scored_words,
+                "Prediction": prediction,
+                "PredictionProbability": probability,
+                "Label": label,
+            }
+            if plots:
+                plot_futures.append(
+                    (
+                        tender,
+                        self.plot_cache.future(
+                            (country, tender_id, country_model_data.generation),
+                            render_explanation_plot,
+                            word_score,
+                            lemma_original,
+                            clf.intercept_,
+                        ),
+                    )
+                )
+            tenders.append(tender)
+        for tender, plot_future in plot_futures:
+            try:
+                tender["Plot"] = plot_future.result()
+            except Exception as e:
+                tender["Plot"] = None
+                errors.append(
+                    {"TenderID": tender["TenderID"], "Status": 500, "Error": str(e)}
+                )
+        return {"Tenders": tenders, "NotFound": not_found, "Errors": errors}
@@ -1,5 +1,27 @@
 import os
+import copy
+import json
 import pickle
+import threading
+import time
+import uuid
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from typing import Dict, Iterable, List, Tuple
+from cache import LRUCache
+from annotation_journal import AnnotationJournal
+from token_store import TokenStore
+from term_counts import TermCounts
+from file_lock import file_lock
+import metrics
+from config import MODEL_CACHE_MAX_MB, DELTA_FOLD_FRACTION, DELTA_FOLD_MAX_AGE_SECONDS
+
+# version of the on-disk model layout written by CountryModelData.save
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+# rough size of a vocabulary or stop word entry (string plus dictionary/list slot)
+VOCABULARY_ENTRY_BYTES = 120
 
 
 class LanguageModelData:
@@ -12,35 +34,740 @@ class LanguageModelData:
         self.deleted_words = deleted_words
         self.tender_data = tender_data
 
+    def nbytes(self) -> int:
+        """Estimated memory used by the model and its tender data"""
+        return (
+            self.tender_data.nbytes()
+            + self.classifier.coef_.nbytes
+            + len(self.vectorizer.vocabulary_) * VOCABULARY_ENTRY_BYTES
+            + len(getattr(self.vectorizer, "stop_words_", ())) * VOCABULARY_ENTRY_BYTES
+            + (len(self.stop_words) + len(self.deleted_words)) * VOCABULARY_ENTRY_BYTES
+        )
+
 
 class TenderData:
     """Class that stores data connected to individual tenders. Used for frontend visualization."""
 
-    def __init__(self, features, predictions, predict_probas, labels, tender_ids):
+    def __init__(
+        self,
+        features,
+        predictions,
+        predict_probas,
+        labels,
+        tender_ids,
+        row_index=None,
+        token_store=None,
+        term_counts=None,
+    ):
         self.features = features
         self.predictions = predictions
         self.predict_probas = predict_probas
         self.labels = labels
         self.tender_ids = tender_ids
+        # tender ID -> row, built on first lookup and saved with the model
+        self.row_index = row_index
+        # token sequences of the tenders, None for models trained before they were stored
+        self.token_store = token_store
+        # raw term counts of the tenders, used for fast retraining (None for models trained before they were stored)
+        self.term_counts = term_counts
+
+    def row(self, tender_id) -> int:
+        """Row of a tender in the tender data
+
+        Raises:
+            KeyError: Unknown tender ID
+        """
+        return self.index()[str(tender_id)]
+
+    def index(self) -> Dict[str, int]:
+        """Mapping of tender IDs to rows"""
+        if self.row_index is None:
+            self.row_index = {
+                str(tender_id): row
+                for row, tender_id in enumerate(np.asarray(self.tender_ids).tolist())
+            }
+        return self.row_index
+
+    def append(
+        self,
+        features,
+        predictions: np.ndarray,
+        predict_probas: np.ndarray,
+        labels: np.ndarray,
+        tender_ids: List[str],
+        originals: List[str],
+        input_texts: List[str],
+    ) -> "TenderData":
+        """New tender data with further tenders appended as rows
+
+        Args:
+            features: Features of the tenders from the model's vectorizer
+            predictions (np.ndarray): Predictions of the tenders
+            predict_probas (np.ndarray): Probabilities of the innovative class
+            labels (np.ndarray): Labels of the tenders (2 for unlabeled tenders)
+            tender_ids (List[str]): Tender IDs
+            originals (List[str]): Space-joined original tokens of the tenders
+            input_texts (List[str]): Space-joined lemmatized tokens of the tenders
+        """
+        row_index = None
+        if self.row_index is not None:
+            num_rows = self.predictions.shape[0]
+            row_index = dict(self.row_index)
+            row_index.update(
+                (str(tender_id), num_rows + row) for row, tender_id in enumerate(tender_ids)
+            )
+        return TenderData(
+            vstack([self.features, features], format="csr"),
+            np.concatenate([self.predictions, predictions]),
+            np.concatenate([self.predict_probas, predict_probas]),
+            np.concatenate([self.labels, labels]),
+            np.concatenate(
+                [np.asarray(self.tender_ids, dtype=str), np.asarray(tender_ids, dtype=str)]
+            ),
+            row_index,
+            self.token_store.append(originals, input_texts)
+            if self.token_store is not None
+            else None,
+            self.term_counts.append(input_texts)
+            if self.term_counts is not None
+            else None,
+        )
+
+    def summary(self) -> Dict:
+        """Descriptives of the tenders (number of examples, number of (non)innovative tenders)"""
+        return {
+            "NumExamples": self.predictions.shape[0],
+            "NumInnovative": self.labels[self.labels < 2].sum().item(),
+            "NumNonInnovative": (
+                self.predictions.shape[0] - self.labels[self.labels < 2].sum()
+            ).item(),
+        }
+
+    def nbytes(self) -> int:
+        """Estimated memory used by the tender data"""
+        return (
+            self.features.data.nbytes
+            + self.features.indices.nbytes
+            + self.features.indptr.nbytes
+            + self.predictions.nbytes
+            + self.predict_probas.nbytes
+            + self.labels.nbytes
+            + np.asarray(self.tender_ids).nbytes
+            + (self.token_store.nbytes() if self.token_store is not None else 0)
+            + (self.term_counts.nbytes() if self.term_counts is not None else 0)
+        )
 
 
 class CountryModelData:
-    """Helper class for mapping countries to their respective model trained on individual language"""
+    """Helper class for mapping countries to their respective model trained on individual language.
+
+    Models are saved as a directory per country. The numeric data (features CSR arrays, classifier coefficients,
+    predictions, probabilities, labels and tender IDs) is stored as raw .npy arrays that are memory-mapped on load,
+    so loading is near-instant and processes on one host share the pages. The remaining objects (vectorizer,
+    classifier without its coefficients, stop words) are pickled, and a JSON manifest ties a generation of files
+    together. Models saved as a single pickle by older versions are converted on load."""
 
     @classmethod
     def load(cls, country, save_start_path="./data"):
-        with open(os.path.join(save_start_path, country + ".pickle"), "rb") as f:
-            load_country_model_data = pickle.load(f)
-        return load_country_model_data
+        directory = CountryModelData.directory(country, save_start_path)
+        manifest = CountryModelData.load_manifest(country, save_start_path)
+        if manifest is None:
+            return cls.convert_pickle(country, save_start_path)
+        if manifest["format_version"] != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported model format version {manifest['format_version']} for country: {country}"
+            )
+
+        language_to_model_data = {}
+        for language, files in manifest["languages"].items():
+            arrays = {
+                name: np.load(os.path.join(directory, file), mmap_mode="r")
+                for name, file in files["arrays"].items()
+            }
+            with open(os.path.join(directory, files["objects"]), "rb") as f:
+                objects = pickle.load(f)
+            classifier = objects["classifier"]
+            classifier.coef_ = arrays["coef"]
+            classifier.intercept_ = np.array(arrays["intercept"])
+            features = csr_matrix(
+                (
+                    arrays["features_data"],
+                    arrays["features_indices"],
+                    arrays["features_indptr"],
+                ),
+                shape=tuple(files["features_shape"]),
+                copy=False,
+            )
+            tender_data = TenderData(
+                features,
+                arrays["predictions"],
+                arrays["predict_probas"],
+                # labels change with annotations, so they are the only array held in memory
+                np.array(arrays["labels"]),
+                arrays["tender_ids"],
+                objects.get("tender_index"),
+                TokenStore.from_arrays(arrays),
+                TermCounts.from_arrays(arrays, files.get("counts_shape")),
+            )
+            language_to_model_data[language] = LanguageModelData(
+                classifier,
+                objects["vectorizer"],
+                objects["stop_words"],
+                objects["deleted_words"],
+                tender_data,
+            )
+        country_model_data = cls(
+            country, language_to_model_data, save_start_path, manifest.get("version", 0)
+        )
+        country_model_data.generation = manifest["generation"]
+        country_model_data.restore_delta_state(manifest.get("delta", {}))
+        country_model_data.replay_journal()
+        return country_model_data
 
-    def __init__(self, country, language_to_model_data, save_start_path="./data"):
+    @classmethod
+    def convert_pickle(cls, country, save_start_path="./data"):
+        """Load a model saved as a single pickle, save it in the current format and remove the pickle"""
+        path = os.path.join(save_start_path, country + ".pickle")
+        print(f"Converting {path} to model format version {ARTIFACT_FORMAT_VERSION}")
+        with open(path, "rb") as f:
+            country_model_data = pickle.load(f)
+        country_model_data.save_start_path = save_start_path
+        country_model_data.version = 0
+        country_model_data.restore_delta_state({})
+        for language_model_data in country_model_data.language_to_model_data.values():
+            language_model_data.tender_data.row_index = None
+            language_model_data.tender_data.token_store = None
+            language_model_data.tender_data.term_counts = None
+        country_model_data.save()
+        os.remove(path)
+        return cls.load(country, save_start_path)
+
+    def __init__(
+        self, country, language_to_model_data, save_start_path="./data", version=0
+    ):
         self.country = country
         self.language_to_model_data = language_to_model_data
         self.save_start_path = save_start_path
+        # bumped whenever the model is retrained or a tender is annotated, used to key derived caches
+        self.version = version
+        self.journal = AnnotationJournal(
+            CountryModelData.directory(country, save_start_path)
+        )
+        # serializes annotations with compacting and replacing the model
+        self.lock = threading.Lock()
+        # generation of the saved files this object was loaded from or saved as
+        self.generation = None
+        # highest tender ID seen by delta scoring (None if it has not run on this model yet)
+        self.watermark = None
+        # files of tenders delta scoring scored but did not append to the model yet, see save_pending
+        self.pending = []
+        # bytes of the journal whose annotations are applied to the labels
+        self.journal_offset = 0
+
+    @staticmethod
+    def directory(country, save_start_path="./data"):
+        return os.path.join(save_start_path, country)
+
+    @staticmethod
+    def lock_path(country, save_start_path="./data"):
+        """Lock file serializing writes to a country's journal and artifact between processes"""
+        return os.path.join(save_start_path, country + ".lock")
+
+    @staticmethod
+    def save_lock_path(country, save_start_path="./data"):
+        """Lock file serializing the writes of a country's artifact files and manifest between threads and
+        processes. It is taken inside lock_path where both are held, never the other way round."""
+        return os.path.join(save_start_path, country + ".save.lock")
+
+    @staticmethod
+    def exists(country, save_start_path="./data"):
+        return os.path.exists(
+            os.path.join(CountryModelData.directory(country, save_start_path), MANIFEST)
+        ) or os.path.exists(os.path.join(save_start_path, country + ".pickle"))
+
+    @staticmethod
+    def load_manifest(country, save_start_path="./data"):
+        """Load the manifest of a saved model, None if the model has not been saved in the current layout"""
+        path = os.path.join(CountryModelData.directory(country, save_start_path), MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_summary(country, save_start_path="./data"):
+        """Load the descriptives saved with a model without loading the model, None if there are none"""
+        manifest = CountryModelData.load_manifest(country, save_start_path)
+        return manifest["summary"] if manifest is not None else None
 
     def save(self):
-        """Save this object to a file."""
+        """Save this object as a new generation of files. The manifest is replaced atomically, and the files of
+        the generation before the replaced one are removed (see write_manifest). Saves of a country are
+        serialized, so concurrent saves cannot remove each other's files."""
+        with file_lock(CountryModelData.save_lock_path(self.country, self.save_start_path)):
+            self._save()
+
+    def _save(self):
+        directory = CountryModelData.directory(self.country, self.save_start_path)
+        os.makedirs(directory, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        manifest = {
+            "format_version": ARTIFACT_FORMAT_VERSION,
+            "country": self.country,
+            "generation": generation,
+            "version": self.version,
+            "summary": self.summary(),
+            "delta": self.delta_state(),
+            "languages": {},
+        }
+        for language, language_model_data in self.language_to_model_data.items():
+            tender_data = language_model_data.tender_data
+            classifier = language_model_data.classifier
+            features = tender_data.features.tocsr()
+            arrays = {
+                "features_data": features.data,
+                "features_indices": features.indices,
+                "features_indptr": features.indptr,
+                "predictions": tender_data.predictions,
+                "predict_probas": tender_data.predict_probas,
+                "labels": tender_data.labels,
+                "tender_ids": np.asarray(tender_data.tender_ids, dtype=str),
+                "coef": classifier.coef_,
+                "intercept": classifier.intercept_,
+            }
+            if tender_data.token_store is not None:
+                arrays.update(tender_data.token_store.arrays())
+            if tender_data.term_counts is not None:
+                arrays.update(tender_data.term_counts.arrays())
+            files = {
+                "arrays": {},
+                "objects": f"{language}.objects.{generation}.pickle",
+                "features_shape": list(features.shape),
+            }
+            if tender_data.term_counts is not None:
+                files["counts_shape"] = list(tender_data.term_counts.counts.shape)
+            for name, array in arrays.items():
+                files["arrays"][name] = f"{language}.{name}.{generation}.npy"
+                np.save(os.path.join(directory, files["arrays"][name]), np.asarray(array))
+
+            # the coefficients are stored as arrays, and the stop words the vectorizer learned are not used after fitting
+            classifier = copy.copy(classifier)
+            del classifier.coef_
+            del classifier.intercept_
+            vectorizer = copy.copy(language_model_data.vectorizer)
+            if hasattr(vectorizer, "stop_words_"):
+                del vectorizer.stop_words_
+            with open(os.path.join(directory, files["objects"]), "wb") as f:
+                pickle.dump(
+                    {
+                        "classifier": classifier,
+                        "vectorizer": vectorizer,
+                        "stop_words": language_model_data.stop_words,
+                        "deleted_words": language_model_data.deleted_words,
+                        "tender_index": tender_data.index(),
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            manifest["languages"][language] = files
+
+        self.write_manifest(manifest)
+        self.generation = generation
+
+    def delta_state(self) -> Dict:
+        return {
+            "watermark": self.watermark,
+            "pending": self.pending,
+        }
+
+    def restore_delta_state(self, delta: Dict):
+        self.watermark = delta.get("watermark")
+        self.pending = delta.get("pending", [])
+
+    def save_delta_state(self):
+        """Write the delta scoring watermark and pending files into the manifest without saving the
+        model again (call with the lock file held)"""
+        with file_lock(CountryModelData.save_lock_path(self.country, self.save_start_path)):
+            manifest = CountryModelData.load_manifest(self.country, self.save_start_path)
+            manifest["delta"] = self.delta_state()
+            self.write_manifest(manifest)
+
+    def save_pending(
+        self,
+        language: str,
+        tender_data: TenderData,
+        originals: List[str],
+        input_texts: List[str],
+    ):
+        """Save tenders scored by delta scoring in a pending file next to the model and record it in the manifest,
+        without saving the model again (call with the lock file held). Its cost only depends on the scored tenders;
+        the pending files are appended to the model by a later save, see fold_due.
+
+        Args:
+            language (str): Language of the model that scored the tenders
+            tender_data (TenderData): Features, predictions, probabilities, labels and IDs of the tenders
+            originals (List[str]): Space-joined original tokens of the tenders
+            input_texts (List[str]): Space-joined lemmatized tokens of the tenders
+        """
+        file = f"{language}.pending.{uuid.uuid4().hex[:12]}.pickle"
         with open(
-            os.path.join(self.save_start_path, self.country + ".pickle"), "wb"
+            os.path.join(
+                CountryModelData.directory(self.country, self.save_start_path), file
+            ),
+            "wb",
         ) as f:
-            pickle.dump(self, f)
+            pickle.dump(
+                {
+                    "features": tender_data.features,
+                    "predictions": tender_data.predictions,
+                    "predict_probas": tender_data.predict_probas,
+                    "labels": tender_data.labels,
+                    "tender_ids": list(tender_data.tender_ids),
+                    "originals": originals,
+                    "input_texts": input_texts,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        self.pending = self.pending + [
+            {
+                "language": language,
+                "file": file,
+                "tender_ids": list(tender_data.tender_ids),
+                "scored_at": time.time(),
+            }
+        ]
+        self.save_delta_state()
+
+    def load_pending(self, language: str) -> Dict:
+        """Pending tenders of a language, combined into the arguments of TenderData.append (None if there are none)"""
+        directory = CountryModelData.directory(self.country, self.save_start_path)
+        segments = []
+        for pending in self.pending:
+            if pending["language"] != language:
+                continue
+            with open(os.path.join(directory, pending["file"]), "rb") as f:
+                segments.append(pickle.load(f))
+        if not segments:
+            return None
+        return {
+            "features": vstack([segment["features"] for segment in segments], format="csr"),
+            **{
+                name: np.concatenate([segment[name] for segment in segments])
+                for name in ("predictions", "predict_probas", "labels")
+            },
+            **{
+                name: [value for segment in segments for value in segment[name]]
+                for name in ("tender_ids", "originals", "input_texts")
+            },
+        }
+
+    def pending_tender_ids(self) -> set:
+        return {
+            tender_id for pending in self.pending for tender_id in pending["tender_ids"]
+        }
+
+    @staticmethod
+    def fold_due(pending: List[Dict], num_tenders: int) -> bool:
+        """Whether pending tenders (the pending entries of a delta state) should be appended to a model of
+        num_tenders tenders: once they reach DELTA_FOLD_FRACTION of its tenders, or the oldest pending file is
+        DELTA_FOLD_MAX_AGE_SECONDS old. Appending rewrites all files of the model, so batching it keeps the
+        amortized cost of delta scoring proportional to the new tenders."""
+        if not pending:
+            return False
+        num_pending = sum(len(entry["tender_ids"]) for entry in pending)
+        return (
+            num_pending >= DELTA_FOLD_FRACTION * num_tenders
+            or time.time() - min(entry["scored_at"] for entry in pending)
+            >= DELTA_FOLD_MAX_AGE_SECONDS
+        )
+
+    @staticmethod
+    def manifest_files(manifest: Dict) -> set:
+        """Files a manifest references"""
+        referenced_files = set()
+        for files in manifest["languages"].values():
+            referenced_files.add(files["objects"])
+            referenced_files.update(files["arrays"].values())
+        referenced_files.update(
+            pending["file"] for pending in manifest.get("delta", {}).get("pending", [])
+        )
+        return referenced_files
+
+    def write_manifest(self, manifest: Dict):
+        """Atomically replace the manifest (call with the save lock held). The files of the replaced manifest are
+        kept for one more generation, so processes that read it just before can still load them, and the files
+        kept from the generation before it are removed."""
+        directory = CountryModelData.directory(self.country, self.save_start_path)
+        manifest_path = os.path.join(directory, MANIFEST)
+        previous_manifest = CountryModelData.load_manifest(
+            self.country, self.save_start_path
+        )
+        removed_files = set()
+        if previous_manifest is not None:
+            files = CountryModelData.manifest_files(manifest)
+            previous_files = CountryModelData.manifest_files(previous_manifest)
+            grace_files = set(previous_manifest.get("grace_files", []))
+            if files >= previous_files:
+                # nothing was replaced (e.g. only pending files were added)
+                manifest["grace_files"] = sorted(grace_files - files)
+            else:
+                manifest["grace_files"] = sorted(previous_files - files)
+                removed_files = grace_files - files - previous_files
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        for file in removed_files:
+            try:
+                os.remove(os.path.join(directory, file))
+            except FileNotFoundError:
+                pass
+
+    def annotate(self, language: str, tender_id: str, label: int) -> Tuple[int, int]:
+        """Set the label of a tender and record it in the annotation journal (call with self.lock held)
+
+        Returns:
+            Tuple[int, int]: Row of the tender and its previous label
+        """
+        tender_data = self.language_to_model_data[language].tender_data
+        tender_index = tender_data.row(tender_id)
+        with file_lock(CountryModelData.lock_path(self.country, self.save_start_path)):
+            # apply the annotations other processes made first, so versions stay consistent between processes
+            self.replay_journal()
+            previous_label = tender_data.labels[tender_index]
+            tender_data.labels[tender_index] = label
+            self.version += 1
+            self.journal_offset = self.journal.append(
+                language, str(tender_id), int(label), self.version
+            )
+        return tender_index, previous_label
+
+    def replay_journal(self, journal: AnnotationJournal = None):
+        """Apply the annotations recorded in a journal (by default this model's own) to the labels"""
+        if journal is None:
+            entries, self.journal_offset = self.journal.read()
+        else:
+            entries = journal.entries()
+        self.apply_annotations(entries)
+
+    def catch_up(self) -> bool:
+        """Apply the annotations other processes appended to the journal since this object last read it. Skipped
+        while the model is locked (its holder replays the journal itself), and when the journal was cleared by a
+        compaction or retrain in another process, which reloads the serving processes.
+
+        Returns:
+            bool: Whether any annotations were applied
+        """
+        if self.journal.size() <= self.journal_offset:
+            return False
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            entries, self.journal_offset = self.journal.read(self.journal_offset)
+            self.apply_annotations(entries)
+            return len(entries) > 0
+        finally:
+            self.lock.release()
+
+    def apply_annotations(self, entries: List[Dict]):
+        for entry in entries:
+            language_model_data = self.language_to_model_data.get(entry["language"])
+            if language_model_data is None:
+                continue
+            tender_data = language_model_data.tender_data
+            try:
+                tender_data.labels[tender_data.row(entry["tender_id"])] = entry["label"]
+            except KeyError:
+                # the tender is no longer part of the model
+                continue
+            self.version = max(self.version, entry["version"])
+
+    def compact(self) -> bool:
+        """Write the labels changed by annotations into the artifact and clear the journal. The journal may hold
+        annotations made by other processes, so it is replayed first.
+
+        Returns:
+            bool: Whether the artifact was written
+        """
+        with self.lock, file_lock(
+            CountryModelData.lock_path(self.country, self.save_start_path)
+        ):
+            manifest = CountryModelData.load_manifest(self.country, self.save_start_path)
+            if manifest is None or manifest["generation"] != self.generation:
+                # replaced by a retrain, the journal is replayed onto the new model instead
+                return False
+            self.replay_journal()
+            if len(self.journal.entries()) == 0:
+                # compacted by another process, reset the count of this one
+                self.journal.clear()
+                self.journal_offset = 0
+                return False
+            directory = CountryModelData.directory(self.country, self.save_start_path)
+            suffix = uuid.uuid4().hex[:12]
+            with file_lock(
+                CountryModelData.save_lock_path(self.country, self.save_start_path)
+            ):
+                for language, files in manifest["languages"].items():
+                    files["arrays"]["labels"] = f"{language}.labels.{suffix}.npy"
+                    np.save(
+                        os.path.join(directory, files["arrays"]["labels"]),
+                        self.language_to_model_data[language].tender_data.labels,
+                    )
+                manifest["version"] = self.version
+                manifest["summary"] = self.summary()
+                self.write_manifest(manifest)
+            self.journal.clear()
+            self.journal_offset = 0
+            return True
+
+    def summary(self) -> Dict:
+        """Descriptives of the tenders of all languages"""
+        summaries = [
+            language_model_data.tender_data.summary()
+            for language_model_data in self.language_to_model_data.values()
+        ]
+        return {key: sum(summary[key] for summary in summaries) for key in summaries[0]}
+
+    def nbytes(self) -> int:
+        """Estimated memory used by this object"""
+        return sum(
+            language_model_data.nbytes()
+            for language_model_data in self.language_to_model_data.values()
+        )
+
+
+class CountryModelCache:
+    """Mapping of countries to their CountryModelData, loaded from disk on first access and kept in an LRU cache
+    bounded by their estimated size. The most recently used country always stays loaded."""
+
+    def __init__(
+        self,
+        countries: Iterable[str],
+        max_bytes: int = MODEL_CACHE_MAX_MB * 1024 * 1024,
+        save_start_path: str = "./data",
+    ):
+        self.countries = list(countries)
+        self.save_start_path = save_start_path
+        self.cache = LRUCache(
+            max_bytes,
+            sizeof=lambda country, country_model_data: country_model_data.nbytes(),
+            min_entries=1,
+        )
+        self._load_locks = {country: threading.Lock() for country in self.countries}
+        self._summaries = {}
+
+    def _load(self, country: str) -> CountryModelData:
+        with metrics.MODEL_LOAD_SECONDS.labels(country=country).time():
+            return CountryModelData.load(country, self.save_start_path)
+
+    def _put(self, country: str, country_model_data: CountryModelData):
+        self.cache.put(country, country_model_data)
+        self.update_metrics()
+
+    def __getitem__(self, country: str) -> CountryModelData:
+        """Model of a country, loading it on a miss. Annotations other processes made since it was loaded are
+        applied first."""
+        if country not in self._load_locks:
+            raise KeyError(country)
+        country_model_data = self.cache.get(country)
+        if country_model_data is None:
+            with self._load_locks[country]:
+                country_model_data = self.cache.get(country)
+                if country_model_data is None:
+                    country_model_data = self._load(country)
+                    self._put(country, country_model_data)
+        elif country_model_data.catch_up():
+            self._summaries.pop(country, None)
+        return country_model_data
+
+    def preload(self):
+        """Load countries in order as long as they fit into the cache budget next to the loaded ones, e.g. before
+        forking serving processes. Countries that are already loaded are never evicted by this."""
+        for country in self.countries:
+            with self._load_locks[country]:
+                if country in self.cache:
+                    continue
+                country_model_data = self._load(country)
+                if (
+                    len(self.cache) > 0
+                    and self.cache.num_bytes + country_model_data.nbytes()
+                    > self.cache.max_bytes
+                ):
+                    continue
+                self._put(country, country_model_data)
+
+    def __setitem__(self, country: str, country_model_data: CountryModelData):
+        if country not in self._load_locks:
+            self.countries.append(country)
+            self._load_locks[country] = threading.Lock()
+        self._summaries.pop(country, None)
+        self._put(country, country_model_data)
+
+    def __contains__(self, country: str) -> bool:
+        return country in self._load_locks
+
+    def __iter__(self):
+        return iter(list(self.countries))
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    def keys(self):
+        return list(self.countries)
+
+    def journal_size(self, country: str) -> int:
+        """Size of a country's annotation journal, which grows with every annotation made by any process"""
+        return AnnotationJournal(
+            CountryModelData.directory(country, self.save_start_path)
+        ).size()
+
+    def journal_sizes(self) -> Tuple[int, ...]:
+        return tuple(self.journal_size(country) for country in self.countries)
+
+    def summary(self, country: str) -> Dict:
+        """Descriptives of a country, read from its summary file so the model does not have to be loaded. Cached
+        until the country's journal changes."""
+        journal_size = self.journal_size(country)
+        cached = self._summaries.get(country)
+        if cached is not None and cached[1] == journal_size:
+            return cached[0]
+        if country in self.cache:
+            summary = self[country].summary()
+        elif journal_size > 0:
+            # the saved summary does not include annotations that have not been compacted yet (the model is
+            # loaded outside the cache, so it does not evict others)
+            summary = self._load(country).summary()
+        else:
+            summary = CountryModelData.load_summary(country, self.save_start_path)
+            if summary is None:
+                # models saved as a single pickle are converted (and their summary saved) on load
+                summary = self._load(country).summary()
+        self._summaries[country] = (summary, journal_size)
+        return summary
+
+    def invalidate_summary(self, country: str):
+        self._summaries.pop(country, None)
+
+    def reload(self):
+        """Reload the loaded countries from disk, e.g. after another process retrained or annotated them"""
+        self._summaries = {}
+        for country, _ in self.cache.items():
+            with self._load_locks[country]:
+                self._put(country, self._load(country))
+
+    def update_metrics(self):
+        """Set the resident size gauges of all countries (0 for those that are not loaded), after the loaded
+        countries changed"""
+        loaded = dict(self.cache.items())
+        for country in self.countries:
+            metrics.MODEL_RESIDENT_BYTES.labels(country=country).set(
+                loaded[country].nbytes() if country in loaded else 0
+            )
+
+    def stats(self) -> Dict:
+        """Loaded countries and cache statistics"""
+        return {
+            **self.cache.stats(),
+            "Loaded": [country for country, _ in self.cache.items()],
+        }
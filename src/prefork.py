@@ -0,0 +1,226 @@
+import os
+import signal
+import socket
+import time
+import traceback
+from typing import Callable
+from waitress import create_server, wasyncore
+from config import SERVER_BACKLOG, SERVER_GRACEFUL_TIMEOUT_SECONDS
+
+# set in a worker once it has been asked to stop
+_draining = False
+# exit status of the periodic process when it changed the models
+PERIODIC_CHANGED = 3
+
+
+def is_draining() -> bool:
+    """Whether this worker is finishing its requests before exiting (and should not receive new ones)"""
+    return _draining
+
+
+def bind(host: str, port: int) -> socket.socket:
+    """Bind the socket shared by all workers. It is only listened on once the models are loaded."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def listen(sock: socket.socket):
+    sock.listen(SERVER_BACKLOG)
+    sock.setblocking(False)
+
+
+def serve_worker(
+    app,
+    sock: socket.socket,
+    threads: int,
+    busy: Callable[[], bool] = lambda: False,
+    graceful_timeout: float = SERVER_GRACEFUL_TIMEOUT_SECONDS,
+):
+    """Serve app with waitress on the shared socket until SIGTERM (or SIGINT). Then stop accepting connections,
+    finish the requests in progress (for at most graceful_timeout seconds) and the background work reported by
+    busy (e.g. retraining jobs), and return."""
+
+    def drain(signum, frame):
+        global _draining
+        _draining = True
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    server = create_server(app, sockets=[sock], threads=threads)
+    drain_deadline = None
+    while True:
+        wasyncore.loop(
+            timeout=server.adj.asyncore_loop_timeout,
+            map=server._map,
+            use_poll=server.adj.asyncore_use_poll,
+            count=1,
+        )
+        if not _draining:
+            continue
+        if drain_deadline is None:
+            # closes this worker's copy of the socket only, the other workers keep accepting
+            wasyncore.dispatcher.close(server)
+            drain_deadline = time.monotonic() + graceful_timeout
+            print(f"Worker {os.getpid()} draining")
+        requests_pending = any(
+            channel.requests or channel.request is not None or channel.total_outbufs_len
+            for channel in list(server.active_channels.values())
+        )
+        if busy():
+            time.sleep(0.1)
+        elif not requests_pending or time.monotonic() > drain_deadline:
+            break
+    server.task_dispatcher.shutdown()
+
+
+class PreforkServer:
+    """Master process of the production server. The models are loaded before the workers are forked, so the
+    workers share their memory copy-on-write. SIGHUP reloads the models in the master and replaces the workers one
+    by one (new worker first, then the old one drains), SIGTERM/SIGINT stops all workers gracefully, and workers
+    that die unexpectedly are restarted. Periodic work that changes the models runs in a process forked by the
+    master rather than in a thread of it, so no lock is held by another thread when workers are forked, and
+    supervising the workers does not wait for it. When it reports changed models, the master reloads them like on
+    SIGHUP."""
+
+    def __init__(
+        self,
+        num_workers: int,
+        serve: Callable[[], None],
+        reload: Callable[[], None] = lambda: None,
+        periodic: Callable[[], bool] = None,
+        interval: float = 0,
+        exited: Callable[[int], None] = lambda pid: None,
+    ):
+        self.num_workers = num_workers
+        # run in every forked worker
+        self.serve = serve
+        # run in the master on SIGHUP, before the workers are replaced
+        self.reload = reload
+        # run in a forked process every interval seconds (counted from the end of the previous run), the models
+        # are reloaded and the workers replaced if it returns True
+        self.periodic = periodic
+        self.interval = interval
+        self.periodic_pid = None
+        self._next_periodic = 0.0
+        # run in the master with the pid of every worker or periodic process that exited
+        self.exited = exited
+        self.workers = set()
+        self.retiring = set()
+        self._reload_requested = False
+        self._stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, signal.SIG_DFL)
+                self.serve()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                # skip the master's exit handlers
+                os._exit(exit_code)
+        self.workers.add(pid)
+
+    def spawn_periodic(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, signal.SIG_DFL)
+                if self.periodic():
+                    exit_code = PERIODIC_CHANGED
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.periodic_pid = pid
+
+    def retire(self, pid: int):
+        self.workers.discard(pid)
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            self.retiring.discard(pid)
+
+    def reap(self, block: bool = False):
+        while self.workers or self.retiring or self.periodic_pid is not None:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.exited(pid)
+            if pid == self.periodic_pid:
+                self.periodic_pid = None
+                self._next_periodic = time.monotonic() + self.interval
+                if os.WIFEXITED(status) and os.WEXITSTATUS(status) == PERIODIC_CHANGED:
+                    self._reload_requested = True
+            elif pid in self.retiring:
+                self.retiring.discard(pid)
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                if not self._stopping:
+                    print(f"Worker {pid} exited unexpectedly ({status}), restarting")
+                    self.spawn()
+
+    def replace_workers(self):
+        for pid in list(self.workers):
+            self.spawn()
+            self.retire(pid)
+
+    def request_reload(self, signum=None, frame=None):
+        self._reload_requested = True
+
+    def stop(self, signum=None, frame=None):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.num_workers):
+            self.spawn()
+        print(f"Serving with {self.num_workers} workers, master {os.getpid()}")
+
+        self._next_periodic = time.monotonic() + self.interval
+        while not self._stopping:
+            if self._reload_requested:
+                # requests arriving during the reload are handled by the next one
+                self._reload_requested = False
+                try:
+                    self.reload()
+                except Exception:
+                    traceback.print_exc()
+                else:
+                    self.replace_workers()
+            if (
+                self.periodic is not None
+                and self.periodic_pid is None
+                and time.monotonic() >= self._next_periodic
+            ):
+                self.spawn_periodic()
+            self.reap()
+            time.sleep(0.5)
+
+        for pid in list(self.workers):
+            self.retire(pid)
+        if self.periodic_pid is not None:
+            try:
+                os.kill(self.periodic_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.reap(block=True)
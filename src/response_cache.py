@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Callable, Dict, Hashable
+from flask import Response, request
+from cache import LRUCache
+from config import RESPONSE_CACHE_MAX_MB
+
+
+class CachedResponse:
+    """Serialized JSON body of a response, its gzip compressed form and its entity tag"""
+
+    def __init__(self, data: Any):
+        self.body = (json.dumps(data) + "\n").encode("utf-8")
+        # fixed mtime so every process compresses to the same bytes
+        self.gzip_body = gzip.compress(self.body, compresslevel=6, mtime=0)
+        self.etag = hashlib.md5(self.body).hexdigest()
+
+    def nbytes(self) -> int:
+        return len(self.body) + len(self.gzip_body)
+
+
+class ResponseCache:
+    """Serialized responses keyed by the model versions they were computed from, bounded by their size in bytes.
+    Responses carry an entity tag derived from their content, so clients (and workers) agree on it and polling
+    with If-None-Match is answered with 304 Not Modified."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.cache = LRUCache(
+            max_bytes, sizeof=lambda key, cached_response: cached_response.nbytes()
+        )
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> CachedResponse:
+        """Cached response for key, calling build() for the data to serialize on a miss"""
+        cached_response = self.cache.get(key)
+        if cached_response is None:
+            cached_response = CachedResponse(build())
+            self.cache.put(key, cached_response)
+        return cached_response
+
+    def respond(self, key: Hashable, build: Callable[[], Any]) -> Response:
+        """Response for the current request: 304 if the client has the current version, otherwise the (gzip
+        compressed if accepted) body"""
+        cached_response = self.get(key, build)
+        if request.if_none_match.contains_weak(cached_response.etag):
+            response = Response(status=304)
+        elif request.accept_encodings.quality("gzip") > 0:
+            response = Response(
+                cached_response.gzip_body, mimetype="application/json"
+            )
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(cached_response.body, mimetype="application/json")
+        response.set_etag(cached_response.etag, weak=True)
+        response.headers["Vary"] = "Accept-Encoding"
+        # clients may keep the response but have to revalidate it
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def stats(self) -> Dict:
+        """Size and hit/miss statistics of the response cache"""
+        return self.cache.stats()
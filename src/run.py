@@ -1,9 +1,22 @@
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, g
 from flask_restx import Resource, Api, fields
 from model import PostgresCountryModel
 from waitress import serve
 from flask_cors import CORS
+import argparse
+import os
+import signal
 import time
+import prefork
+import metrics
+from response_cache import ResponseCache
+from config import (
+    SERVER_WORKERS,
+    SERVER_THREADS,
+    RETRAIN_MODE,
+    RETRAIN_MODES,
+    DELTA_SCORING_INTERVAL_SECONDS,
+)
 
 
 app = Flask(__name__)
@@ -16,7 +29,12 @@ api = Api(
     description="API for visualizing model outputs",
 )
 
+# record metrics across processes and drop those of an earlier run, before the bootstrap processes write theirs
+metrics.init()
+metrics.reset()
 model = PostgresCountryModel()
+# serialized responses of the endpoints that only change with the models
+response_cache = ResponseCache()
 
 dgcnect_ns = api.namespace(
     "dgcnect", description="Used to visualize specific outputs of the TF-IDF model"
@@ -30,8 +48,20 @@ country_details_model = api.model(
     "CountryDetails", {"Country": countries_model, "Details": fields.Arbitrary}
 )
 
-stop_words = api.model("StopWords", {"StopWords": fields.List(fields.String)})
+stop_words = api.model(
+    "StopWords",
+    {
+        "StopWords": fields.List(fields.String),
+        "Mode": fields.String(enum=list(RETRAIN_MODES), default=RETRAIN_MODE),
+    },
+)
 annotation = api.model("Annotation", {"Annotation": fields.Integer})
+tender_text = api.model(
+    "TenderText", {"Title": fields.String, "Description": fields.String}
+)
+tender_batch = api.model(
+    "TenderBatch", {"TenderIDs": fields.List(fields.String), "Plots": fields.Boolean}
+)
 
 question_model = api.model("Question", {"QuestionText": fields.String})
 predicted_intent = api.model(
@@ -46,6 +76,38 @@ resource_fields = api.model(
 )
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        metrics.REQUEST_SECONDS.labels(
+            endpoint=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - start)
+    return response
+
+
+@dgcnect_ns.route("/ready")
+class Ready(Resource):
+    @api.response(200, "Ready")
+    @api.response(503, "Not ready")
+    def get(self):
+        """Readiness probe. The server only listens once all models are loaded, and a worker that is being replaced
+        reports not ready while it finishes its requests.
+
+        Returns:
+            Dict: Readiness and process ID of the worker"""
+        if prefork.is_draining():
+            return {"Ready": False, "Pid": os.getpid()}, 503
+        return {"Ready": True, "Pid": os.getpid()}
+
+
 @dgcnect_ns.route("/countries_data")
 class CountryData(Resource):
     @api.response(200, "Success", [countries_model])
@@ -57,7 +119,9 @@ class CountryData(Resource):
             Dict: Descriptives for a country used for frontend
         """
         try:
-            return model.get_countries_data()
+            return response_cache.respond(
+                ("countries_data", model.models_version), model.get_countries_data
+            )
         except Exception as e:
             abort(400, str(e))
 
@@ -74,13 +138,27 @@ class CountryDetails(Resource):
             Dict: Fetched stats
         """
         try:
-            return model.get_country_data(country=country2alpha)
+            return response_cache.respond(
+                (
+                    "country_details",
+                    country2alpha,
+                    model.country_version(country2alpha),
+                ),
+                lambda: model.get_country_data(country=country2alpha),
+            )
         except Exception as e:
             abort(400, str(e))
 
 
 @dgcnect_ns.route("/global_explanation/<string:country2alpha>")
 class GlobalExplanation(Resource):
+    @api.doc(
+        params={
+            "n_words": "Number of top and of bottom words (default 200)",
+            "page": "1-based page of tender IDs per word",
+            "page_size": "Number of tender IDs per word and page (default: all)",
+        }
+    )
     def get(self, country2alpha: str):
         """Get global importance scores for a country
 
@@ -90,7 +168,25 @@ class GlobalExplanation(Resource):
         Returns:
             Dict: Global data"""
         try:
-            return model.get_global_data(country=country2alpha)
+            n_words = request.args.get("n_words", 200, type=int)
+            page = request.args.get("page", type=int)
+            page_size = request.args.get("page_size", type=int)
+            return response_cache.respond(
+                (
+                    "global_explanation",
+                    country2alpha,
+                    model.country_generation(country2alpha),
+                    n_words,
+                    page,
+                    page_size,
+                ),
+                lambda: model.get_global_data(
+                    country=country2alpha,
+                    n_words=n_words,
+                    page=page,
+                    page_size=page_size,
+                ),
+            )
         except Exception as e:
             abort(400, str(e))
 
@@ -113,32 +209,181 @@ class CountryDetails(Resource):
             abort(400, str(e))
 
 
+@dgcnect_ns.route("/tender_details_batch/<string:country2alpha>")
+class TenderDetailsBatch(Resource):
+    @api.expect(tender_batch)
+    def post(self, country2alpha: str):
+        """Get data used for single tender visualization for a list of tenders of a country. Plots are only
+        included when Plots is true.
+
+        Args:
+            country2alpha (str): Country of the tenders
+            tender_batch (TenderBatch): Tender IDs and whether to include the importance plots
+
+        Returns:
+            Dict: Data per tender (in request order), the tender IDs that were not found, and the tender IDs that
+            are invalid or could not be explained, with a status and message each"""
+        data = request.get_json()
+        try:
+            return model.get_tender_data_batch(
+                country=country2alpha,
+                tender_ids=data["TenderIDs"],
+                plots=data.get("Plots", False),
+            )
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/score/<string:country2alpha>")
+class ScoreText(Resource):
+    @api.expect(tender_text)
+    def post(self, country2alpha: str):
+        """Score the raw title and description of a tender with a country's model, without it being in the database
+
+        Args:
+            country2alpha (str): Country model to score with
+            tender_text (TenderText): Title and description of the tender
+
+        Returns:
+            Dict: Prediction index (innovative or not) and prediction probability"""
+        data = request.get_json()
+        try:
+            return model.score_text(
+                country=country2alpha,
+                title=data.get("Title", ""),
+                description=data.get("Description", ""),
+            )
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/lemma_cache_stats")
+class LemmaCacheStats(Resource):
+    def get(self):
+        """Get size and hit/miss statistics of the per-language lemma caches
+
+        Returns:
+            Dict: Statistics per language"""
+        try:
+            return model.get_lemma_cache_stats()
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/database_pool_stats")
+class DatabasePoolStats(Resource):
+    def get(self):
+        """Get size and wait time statistics of the database connection pool
+
+        Returns:
+            Dict: Pool statistics"""
+        try:
+            return model.get_database_pool_stats()
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/model_cache_stats")
+class ModelCacheStats(Resource):
+    def get(self):
+        """Get the loaded countries and memory usage of the country model cache
+
+        Returns:
+            Dict: Cache statistics"""
+        try:
+            return model.get_model_cache_stats()
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/plot_cache_stats")
+class PlotCacheStats(Resource):
+    def get(self):
+        """Get size and hit/miss statistics of the rendered explanation plots
+
+        Returns:
+            Dict: Cache statistics"""
+        try:
+            return model.get_plot_cache_stats()
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/response_cache_stats")
+class ResponseCacheStats(Resource):
+    def get(self):
+        """Get size and hit/miss statistics of the serialized responses
+
+        Returns:
+            Dict: Cache statistics"""
+        try:
+            return response_cache.stats()
+        except Exception as e:
+            abort(400, str(e))
+
+
+@dgcnect_ns.route("/metrics")
+class Metrics(Resource):
+    def get(self):
+        """Get request latencies per endpoint, database query times and row counts, training phase durations and
+        model load times and sizes of all serving processes, in the Prometheus text format
+
+        Returns:
+            str: Metrics"""
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @dgcnect_ns.route("/retrain_country/<string:country2alpha>")
 class RetrainCountry(Resource):
     @api.expect(stop_words)
     def post(self, country2alpha: str):
-        """Retrain the model for a particular country. Optionally disable tokens given by deleted_words,
-        and reenable disabled tokens via reenabled_words (these two parameters are connected to the global token importances)
+        """Retrain the model for a particular country in the background. Optionally disable tokens given by deleted_words,
+        and reenable disabled tokens via reenabled_words (these two parameters are connected to the global token importances).
+        Returns immediately with the ID of the job, whose progress can be followed via /retrain_status.
 
         Args:
             country2alpha (str): Country to retrain
-            stop_words (StopWords): Words to remove and/or to reenable in the vocab"""
+            stop_words (StopWords): Words to remove and/or to reenable in the vocab, and the retraining mode
+                ("full" preprocesses the tenders again and is the default, "fast" retrains from the stored term
+                counts)
+
+        Returns:
+            Dict: Status of the retraining job"""
         data = request.get_json()
         try:
             if "ReEnabledWords" not in data:
                 reenabled_words = []
             else:
                 reenabled_words = data["ReEnabledWords"]
-            model.retrain_country(
-                country=country2alpha,
-                deleted_words=data["StopWords"],
-                reenabled_words=reenabled_words,
+            return (
+                model.submit_retrain(
+                    country=country2alpha,
+                    deleted_words=data["StopWords"],
+                    reenabled_words=reenabled_words,
+                    mode=data.get("Mode", RETRAIN_MODE),
+                ),
+                202,
             )
-            return 200, "Success"
         except Exception as e:
             abort(400, str(e))
 
 
+@dgcnect_ns.route("/retrain_status/<string:job_id>")
+class RetrainStatus(Resource):
+    def get(self, job_id: str):
+        """Get the status, phase and progress of a retraining job
+
+        Args:
+            job_id (str): Job ID returned by /retrain_country
+
+        Returns:
+            Dict: Job status"""
+        try:
+            return model.get_retrain_job(job_id)
+        except KeyError as e:
+            abort(404, str(e))
+
+
 @dgcnect_ns.route("/annotate_tender/<string:country2alpha>/<string:tender_id>")
 class AnnotateTender(Resource):
     @api.expect(annotation)
@@ -159,6 +404,60 @@ class AnnotateTender(Resource):
             abort(400, str(e))
 
 
+def serve_production(host: str, port: int, num_workers: int, num_threads: int):
+    """Serve with num_workers forked processes of num_threads threads each, sharing the loaded models. A retrain
+    or compaction in any worker makes the master reload the models from disk and replace the workers; annotations
+    are read from the journal by the other workers instead. The master periodically forks a process that scores
+    newly added tenders, and reloads the models and replaces the workers when it appended them to a model."""
+    sock = prefork.bind(host, port)
+    model.preload_models()
+    # connections must not be shared with the workers
+    model.pool.close_all()
+    prefork.listen(sock)
+    master_pid = os.getpid()
+
+    def serve_worker():
+        model.on_model_change.append(
+            lambda country: os.kill(master_pid, signal.SIGHUP)
+        )
+        prefork.serve_worker(app, sock, num_threads, busy=model.busy)
+
+    def reload():
+        print("Reloading models")
+        model.reload_models()
+        model.pool.close_all()
+
+    def score_new_tenders():
+        changed = model.score_new_tenders_all()
+        model.pool.close_all()
+        return changed
+
+    prefork.PreforkServer(
+        num_workers,
+        serve_worker,
+        reload,
+        score_new_tenders,
+        DELTA_SCORING_INTERVAL_SECONDS,
+        exited=metrics.mark_process_dead,
+    ).run()
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=7000, debug=True)
-    # serve(app=app, host="0.0.0.0", port=7000)
+    parser = argparse.ArgumentParser(description="DGCNECT Tender Visualization API")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="serve with forked waitress workers instead of the Flask development server",
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS)
+    args = parser.parse_args()
+
+    if args.production:
+        serve_production(args.host, args.port, args.workers, args.threads)
+    else:
+        model.start_delta_scoring()
+        # the reloader would load (and possibly train) all models a second time
+        app.run(host=args.host, port=args.port, debug=True, use_reloader=False)
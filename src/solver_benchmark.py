@@ -0,0 +1,140 @@
+"""Compare the solvers of the classifier on the saved models and pick the fastest one whose predictions match a
+cold start with lbfgs. Run from src/ after the models have been trained, e.g.
+
+    python solver_benchmark.py DE FR IT
+
+The choice is written to SOLVER_PATH, which Trainer reads for every retraining."""
+import argparse
+import json
+import os
+import time
+import warnings
+from typing import Dict, List
+import numpy as np
+from sklearn.exceptions import ConvergenceWarning
+from model_data import CountryModelData, LanguageModelData
+from trainer import Trainer, WARM_START_SOLVERS
+from config import (
+    CLASSIFIER_SOLVER,
+    SOLVER_PATH,
+    SOLVER_PREDICTION_TOLERANCE,
+    SOLVER_PROBABILITY_TOLERANCE,
+)
+
+SOLVERS = ("lbfgs", "newton-cg", "liblinear", "sag", "saga")
+# number of top words deleted to simulate the retraining a warm start begins from
+NUM_DELETED_WORDS = 10
+
+
+def retraining_problem(language_model_data: LanguageModelData):
+    """Vectorizer, features and labels of retraining a model after deleting its highest scoring words. Models
+    saved without term counts are retrained on their own features instead."""
+    tender_data = language_model_data.tender_data
+    labels = np.array(tender_data.labels)
+    train_mask = labels < 2
+    if tender_data.term_counts is None:
+        return language_model_data.vectorizer, tender_data.features, labels, train_mask
+    coef = language_model_data.classifier.coef_[0]
+    feature_names = language_model_data.vectorizer.get_feature_names_out()
+    deleted_words = [
+        str(word) for word in feature_names[np.argsort(-coef)[:NUM_DELETED_WORDS]]
+    ]
+    vectorizer, features = tender_data.term_counts.vectorize(
+        train_mask,
+        language_model_data.stop_words + language_model_data.deleted_words + deleted_words,
+    )
+    return vectorizer, features, labels, train_mask
+
+
+def timed_fit(features, labels, vectorizer, previous, solver):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ConvergenceWarning)
+        start = time.perf_counter()
+        clf = Trainer.fit_classifier(features, labels, vectorizer, previous, solver)
+        seconds = time.perf_counter() - start
+    converged = not any(issubclass(w.category, ConvergenceWarning) for w in caught)
+    return clf, seconds, converged
+
+
+def benchmark_language(language_model_data: LanguageModelData) -> Dict:
+    """Cold and warm-started fit times of every solver, and how far their predictions are from the reference
+    (a cold start with lbfgs)"""
+    vectorizer, features, labels, train_mask = retraining_problem(language_model_data)
+    train_features, train_labels = features[train_mask], labels[train_mask]
+    reference, _, _ = timed_fit(train_features, train_labels, vectorizer, None, "lbfgs")
+    reference_predictions = reference.predict(features)
+    reference_probas = reference.predict_proba(features)[:, 1]
+
+    results = {}
+    for solver in SOLVERS:
+        starts = {"Cold": None}
+        if solver in WARM_START_SOLVERS:
+            starts["Warm"] = language_model_data
+        for start, previous in starts.items():
+            clf, seconds, converged = timed_fit(
+                train_features, train_labels, vectorizer, previous, solver
+            )
+            results[f"{solver} {start}"] = {
+                "Solver": solver,
+                "WarmStart": previous is not None,
+                "Seconds": seconds,
+                "Converged": converged,
+                "ChangedPredictions": float(
+                    np.mean(clf.predict(features) != reference_predictions)
+                ),
+                "MaxProbabilityDifference": float(
+                    np.max(np.abs(clf.predict_proba(features)[:, 1] - reference_probas))
+                ),
+            }
+            print(solver, start, results[f"{solver} {start}"])
+    return results
+
+
+def select_solver(results: List[Dict]) -> str:
+    """Solver with the lowest total retraining time (warm-started where the solver supports it) among the
+    solvers that converged within the tolerances on every model, CLASSIFIER_SOLVER if there is none"""
+    totals = {}
+    for language_results in results:
+        for result in language_results.values():
+            solver = result["Solver"]
+            if result["WarmStart"] != (solver in WARM_START_SOLVERS):
+                continue
+            if (
+                not result["Converged"]
+                or result["ChangedPredictions"] > SOLVER_PREDICTION_TOLERANCE
+                or result["MaxProbabilityDifference"] > SOLVER_PROBABILITY_TOLERANCE
+            ):
+                totals[solver] = float("inf")
+            else:
+                totals[solver] = totals.get(solver, 0.0) + result["Seconds"]
+    solver = min(totals, key=totals.get, default=CLASSIFIER_SOLVER)
+    return solver if totals.get(solver, 0.0) < float("inf") else CLASSIFIER_SOLVER
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "countries", nargs="+", help="countries whose saved models are benchmarked"
+    )
+    parser.add_argument("--save-start-path", default="./data")
+    parser.add_argument("--output", default=SOLVER_PATH)
+    args = parser.parse_args()
+
+    results = {}
+    for country in args.countries:
+        country_model_data = CountryModelData.load(country, args.save_start_path)
+        language_to_model_data = country_model_data.language_to_model_data
+        for language, language_model_data in language_to_model_data.items():
+            print(f"Benchmarking {country} ({language})")
+            results[f"{country} {language}"] = benchmark_language(language_model_data)
+
+    solver = select_solver(list(results.values()))
+    print(f"Selected solver: {solver}")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output + ".tmp", "w") as f:
+        json.dump({"Solver": solver, "Results": results}, f, indent=2)
+    os.replace(args.output + ".tmp", args.output)
+
+
+if __name__ == "__main__":
+    main()
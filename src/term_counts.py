@@ -0,0 +1,183 @@
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from token_store import TokenStore
+
+
+class TermCounts:
+    """Raw term counts of a model's tenders (rows in TenderData order) over the vocabulary of all their texts,
+    without stop words. TF-IDF features for any training set and stop word list can be derived from them without
+    touching the text: dropping columns and recomputing the idf weights is what refitting the vectorizer does.
+    The terms are stored like the token sequences, as UTF-8 text with offsets."""
+
+    ARRAYS = ("counts_data", "counts_indices", "counts_indptr", "terms", "term_offsets")
+
+    def __init__(
+        self, counts: csr_matrix, terms: np.ndarray, term_offsets: np.ndarray
+    ):
+        self.counts = counts
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self._term_list = None
+
+    @classmethod
+    def from_texts(cls, input_texts: Iterable[str]):
+        """Count the terms of the lemmatized texts the same way TfidfVectorizer tokenizes them"""
+        count_vectorizer = CountVectorizer(dtype=np.int32)
+        counts = count_vectorizer.fit_transform(input_texts)
+        return cls(counts, *TokenStore.encode(count_vectorizer.get_feature_names_out()))
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], shape: Tuple[int, int]):
+        """Build the counts from the arrays of a saved model, None if the model was saved without them"""
+        if not all(name in arrays for name in cls.ARRAYS):
+            return None
+        counts = csr_matrix(
+            (arrays["counts_data"], arrays["counts_indices"], arrays["counts_indptr"]),
+            shape=shape,
+            copy=False,
+        )
+        return cls(counts, arrays["terms"], arrays["term_offsets"])
+
+    def append(self, input_texts: Iterable[str]) -> "TermCounts":
+        """New counts with the counts of further lemmatized texts appended as rows. Terms that are not in the
+        vocabulary yet are added as new columns after the existing ones."""
+        count_vectorizer = CountVectorizer(dtype=np.int32)
+        counts = count_vectorizer.fit_transform(input_texts)
+        columns = {term: column for column, term in enumerate(self.term_list())}
+        new_terms = []
+        column_map = np.empty(counts.shape[1], dtype=np.int64)
+        for index, term in enumerate(count_vectorizer.get_feature_names_out().tolist()):
+            if term not in columns:
+                columns[term] = len(columns)
+                new_terms.append(term)
+            column_map[index] = columns[term]
+        counts = csr_matrix(
+            (counts.data, column_map[counts.indices], counts.indptr),
+            shape=(counts.shape[0], len(columns)),
+        )
+        counts.sort_indices()
+        previous_counts = self.counts
+        previous_counts = csr_matrix(
+            (previous_counts.data, previous_counts.indices, previous_counts.indptr),
+            shape=(previous_counts.shape[0], len(columns)),
+        )
+        terms, term_offsets = TokenStore.encode(new_terms)
+        return TermCounts(
+            vstack([previous_counts, counts], format="csr", dtype=np.int32),
+            np.concatenate([self.terms, terms]),
+            np.concatenate([self.term_offsets, term_offsets[1:] + self.term_offsets[-1]]),
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "counts_data": self.counts.data,
+            "counts_indices": self.counts.indices,
+            "counts_indptr": self.counts.indptr,
+            "terms": self.terms,
+            "term_offsets": self.term_offsets,
+        }
+
+    def term_list(self) -> List[str]:
+        """Terms in column order (sorted, apart from terms added by append)"""
+        if self._term_list is None:
+            offsets = self.term_offsets.tolist()
+            encoded = bytes(self.terms)
+            self._term_list = [
+                encoded[start:end].decode("utf-8")
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+        return self._term_list
+
+    def document_frequencies(self, train_mask: np.ndarray) -> np.ndarray:
+        """Number of training documents every term appears in"""
+        train_counts = self.counts[np.flatnonzero(train_mask)]
+        return np.bincount(train_counts.indices, minlength=self.counts.shape[1])
+
+    def stop_words(
+        self,
+        train_mask: np.ndarray,
+        max_df: float,
+        min_df: int,
+        document_frequencies: np.ndarray = None,
+    ) -> List[str]:
+        """Terms of the training documents that appear in more than max_df (a fraction) or fewer than min_df
+        (a number) of them, equal to the stop_words_ of TfidfVectorizer(max_df=max_df, min_df=min_df) fitted
+        on the training documents
+
+        Raises:
+            ValueError: max_df corresponds to fewer documents than min_df
+        """
+        if document_frequencies is None:
+            document_frequencies = self.document_frequencies(train_mask)
+        max_document_count = max_df * int(np.count_nonzero(train_mask))
+        if max_document_count < min_df:
+            raise ValueError("max_df corresponds to < documents than min_df")
+        kept = (document_frequencies <= max_document_count) & (
+            document_frequencies >= min_df
+        )
+        if not kept.any():
+            raise ValueError(
+                "After pruning, no terms remain. Try a lower min_df or a higher max_df."
+            )
+        terms = self.term_list()
+        return [
+            terms[column]
+            for column in np.flatnonzero((document_frequencies > 0) & ~kept).tolist()
+        ]
+
+    def vectorize(
+        self,
+        train_mask: np.ndarray,
+        stop_words: Iterable[str],
+        document_frequencies: np.ndarray = None,
+    ) -> Tuple[TfidfVectorizer, csr_matrix]:
+        """TF-IDF vectorizer fitted on the training documents and the features of all documents, equal to
+        TfidfVectorizer(stop_words=stop_words).fit(training texts) followed by transform(all texts)
+
+        Args:
+            train_mask (np.ndarray): Boolean mask of the training rows
+            stop_words (Iterable[str]): Words to exclude from the vocabulary
+            document_frequencies (np.ndarray, optional): document_frequencies(train_mask), if already computed
+
+        Raises:
+            ValueError: No terms are left
+        """
+        stop_words = list(stop_words)
+        excluded = set(stop_words)
+        if document_frequencies is None:
+            document_frequencies = self.document_frequencies(train_mask)
+        terms = self.term_list()
+        # the vocabulary of a fitted vectorizer is sorted
+        columns = np.array(
+            sorted(
+                (
+                    column
+                    for column in np.flatnonzero(document_frequencies).tolist()
+                    if terms[column] not in excluded
+                ),
+                key=terms.__getitem__,
+            ),
+            dtype=np.int64,
+        )
+        if columns.shape[0] == 0:
+            raise ValueError(
+                "empty vocabulary; perhaps the documents only contain stop words"
+            )
+        # smooth_idf=True: idf = ln((1 + n) / (1 + df)) + 1
+        num_documents = int(np.count_nonzero(train_mask))
+        idf = np.log((1 + num_documents) / (1 + document_frequencies[columns])) + 1
+        features = self.counts[:, columns].astype(np.float64)
+        features = normalize(features.multiply(idf).tocsr(), norm="l2", copy=False)
+
+        vectorizer = TfidfVectorizer(stop_words=stop_words)
+        vectorizer.vocabulary_ = {
+            terms[column]: index for index, column in enumerate(columns.tolist())
+        }
+        vectorizer.idf_ = idf
+        return vectorizer, features
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, Tuple
+import numpy as np
+
+
+class TokenStore:
+    """Original and lemmatized token sequences of a model's tenders, captured at training time so explanations
+    can be served without fetching and re-lemmatizing the tender. Each sequence is stored as space-separated
+    UTF-8 text in one byte array per kind, with the start offsets of the rows in a second array."""
+
+    # names of the arrays saved with the model
+    ARRAYS = ("original_tokens", "original_offsets", "lemma_tokens", "lemma_offsets")
+
+    def __init__(self, original_tokens, original_offsets, lemma_tokens, lemma_offsets):
+        self.original_tokens = original_tokens
+        self.original_offsets = original_offsets
+        self.lemma_tokens = lemma_tokens
+        self.lemma_offsets = lemma_offsets
+
+    @staticmethod
+    def encode(texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Concatenate texts into a byte array and the offsets of each text (one more offset than texts)"""
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    @classmethod
+    def from_texts(cls, originals: Iterable[str], input_texts: Iterable[str]):
+        """Build a store from the space-joined original and lemmatized tokens of each tender, in row order"""
+        return cls(*cls.encode(originals), *cls.encode(input_texts))
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]):
+        """Build a store from the arrays of a saved model, None if the model was saved without one"""
+        if not all(name in arrays for name in cls.ARRAYS):
+            return None
+        return cls(*(arrays[name] for name in cls.ARRAYS))
+
+    def append(self, originals: Iterable[str], input_texts: Iterable[str]) -> "TokenStore":
+        """New store with the token sequences of further tenders appended as rows"""
+        arrays = {}
+        for kind, texts in (("original", originals), ("lemma", input_texts)):
+            tokens, offsets = TokenStore.encode(texts)
+            previous_tokens = getattr(self, kind + "_tokens")
+            previous_offsets = getattr(self, kind + "_offsets")
+            arrays[kind + "_tokens"] = np.concatenate([previous_tokens, tokens])
+            arrays[kind + "_offsets"] = np.concatenate(
+                [previous_offsets, offsets[1:] + previous_offsets[-1]]
+            )
+        return TokenStore(**arrays)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @staticmethod
+    def decode(tokens: np.ndarray, offsets: np.ndarray, row: int) -> str:
+        return bytes(tokens[offsets[row] : offsets[row + 1]]).decode("utf-8")
+
+    def texts(self, row: int) -> Tuple[str, str]:
+        """Space-joined original and lemmatized tokens of a row"""
+        return (
+            TokenStore.decode(self.original_tokens, self.original_offsets, row),
+            TokenStore.decode(self.lemma_tokens, self.lemma_offsets, row),
+        )
+
+    def __len__(self) -> int:
+        return self.original_offsets.shape[0] - 1
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
@@ -1,20 +1,36 @@
+import json
 import random
 from cleantext import clean
-from simplemma import simple_tokenizer, lemmatize
+from simplemma import simple_tokenizer
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from tqdm import tqdm
 import re
 from multiprocessing import Pool
+from collections import deque
+from itertools import islice
 from model_data import TenderData, CountryModelData, LanguageModelData
+from token_store import TokenStore
+from term_counts import TermCounts
 from sklearn.dummy import DummyClassifier
 import os
 from database_login import TABLE_NAME
+from config import (
+    PREPROCESS_WORKERS,
+    PREPROCESS_CHUNK_SIZE,
+    CLASSIFIER_SOLVER,
+    SOLVER_PATH,
+)
+from lemma_cache import get_lemma_cache
+import metrics
 
 
 RANDOM_SEED = 69
 MAX_NUM_CHARACTERS = 50000
+# solvers of LogisticRegression that can start from the coefficients of a previous fit
+WARM_START_SOLVERS = ("lbfgs", "newton-cg", "sag", "saga")
+# positions of the columns check_example and return_input read the tender text from
+TEXT_COLUMNS = (2, 3, 4) if TABLE_NAME == "dataset" else (2, 3)
 
 
 def clean_text(t):
@@ -26,6 +42,82 @@ def clean_text(t):
     return t
 
 
+def load_solver(path=SOLVER_PATH):
+    """Classifier solver picked by solver_benchmark.py, CLASSIFIER_SOLVER if it has not been run"""
+    try:
+        with open(path) as f:
+            return json.load(f)["Solver"]
+    except (OSError, ValueError, KeyError):
+        return CLASSIFIER_SOLVER
+
+
+def chunks(iterable, chunk_size):
+    """Split an iterable into lists of at most chunk_size elements"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_map(function, chunks, args=(), num_workers=1):
+    """Apply function to every chunk over a pool of worker processes, yielding results in input order.
+    At most two chunks per worker are in flight, so the input can be consumed lazily.
+
+    Args:
+        function: Top-level (picklable) function called as function(chunk, *args)
+        chunks: Iterable of chunks
+        args (tuple, optional): Extra arguments passed to function. Defaults to ().
+        num_workers (int, optional): Number of processes, 1 runs in this process. Defaults to 1.
+    """
+    if num_workers <= 1:
+        for chunk in chunks:
+            yield function(chunk, *args)
+        return
+
+    with Pool(num_workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(function, (chunk, *args)))
+            if len(in_flight) >= 2 * num_workers:
+                yield in_flight.popleft().get()
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
+def preprocess_chunk(chunk, language):
+    """Clean, tokenize and lemmatize a chunk of dataset rows (runs in the preprocessing workers)
+
+    Returns:
+        Tuple: (original, input_text, label, tender_id) per valid row in input order (the label is None
+        for unlabeled rows), followed by the newly computed lemmas and the lemma cache hits and misses
+    """
+    lemma_cache = get_lemma_cache(language)
+    hits, misses = lemma_cache.cache.hits, lemma_cache.cache.misses
+    lemma_cache.start_recording()
+    preprocessed = []
+    for example in chunk:
+        if not Trainer.check_example(example):
+            continue
+        tokens, lemmatized_tokens = Trainer.return_input(example, language)
+        preprocessed.append(
+            (
+                " ".join(tokens),
+                " ".join(lemmatized_tokens),
+                int(example[5]) if example[5] is not None else None,
+                str(example[7]),
+            )
+        )
+    new_lemmas = lemma_cache.stop_recording()
+    return (
+        preprocessed,
+        new_lemmas,
+        lemma_cache.cache.hits - hits,
+        lemma_cache.cache.misses - misses,
+    )
+
+
 class Trainer:
     def return_input(example, language):
         text = (
@@ -33,10 +125,19 @@ class Trainer:
             if TABLE_NAME == "dataset"
             else example[2] + example[3]
         )
+        return Trainer.text_input(text, language)
+
+    def text_input(text, language):
+        """Clean, tokenize and lemmatize a raw tender text (title followed by description)
+
+        Returns:
+            Tuple[List[str], List[str]]: Tokens and lemmatized tokens
+        """
         text = clean_text(text)
 
         tokens = simple_tokenizer(text)
-        lemmatized_tokens = [lemmatize(token, lang=language) for token in tokens]
+        lemma_cache = get_lemma_cache(language)
+        lemmatized_tokens = [lemma_cache.lemmatize(token) for token in tokens]
         return tokens, lemmatized_tokens
 
     def check_example(example):
@@ -52,34 +153,189 @@ class Trainer:
                 return False
         return True
 
-    def train(dataset, language, stop_words=[], deleted_words=[]):
-        print(deleted_words)
+    def preprocess_rows(dataset, language, num_workers=PREPROCESS_WORKERS, total=None):
+        """Preprocess the dataset (any iterable of rows, consumed lazily) in chunks over num_workers processes.
+        The output order matches the dataset order regardless of the number of workers.
+
+        Yields:
+            Tuple: (original, input_text, label, tender_id) for each valid row, label is None for unlabeled rows
+        """
+        lemma_cache = get_lemma_cache(language)
+        chunk_sizes = deque()
+
+        def dataset_chunks():
+            for chunk in chunks(dataset, PREPROCESS_CHUNK_SIZE):
+                chunk_sizes.append(len(chunk))
+                yield chunk
+
+        if total is None and hasattr(dataset, "__len__"):
+            total = len(dataset)
+        with tqdm(total=total) as progress_bar:
+            for preprocessed_chunk, new_lemmas, hits, misses in ordered_map(
+                preprocess_chunk,
+                dataset_chunks(),
+                args=(language,),
+                num_workers=num_workers,
+            ):
+                if num_workers > 1:
+                    # lemmas computed by the workers warm up this process' cache
+                    lemma_cache.merge(new_lemmas, hits, misses)
+                yield from preprocessed_chunk
+                progress_bar.update(chunk_sizes.popleft())
+        print(f"Lemma cache ({language}): {lemma_cache.stats()}")
+
+    def split_examples(preprocessed):
+        """Split preprocessed rows into labeled examples and unlabeled (inference) examples
+
+        Returns:
+            Tuple[List, List]: Labeled examples and inference examples
+        """
         examples = []
         inference_examples = []
-        print("Cleaning data...")
-        for example in tqdm(dataset):
-            if not Trainer.check_example(example):
-                continue
-            tokens, lemmatized_tokens = Trainer.return_input(example, language)
-            if example[5] is not None:
+        for original, input_text, label, tender_id in preprocessed:
+            if label is not None:
                 examples.append(
                     {
-                        "original": " ".join(tokens),
-                        "input_text": " ".join(lemmatized_tokens),
-                        "label": int(example[5]),
-                        "tender_id": str(example[7]),
+                        "original": original,
+                        "input_text": input_text,
+                        "label": label,
+                        "tender_id": tender_id,
                     }
                 )
             else:
                 inference_examples.append(
                     {
-                        "original": " ".join(tokens),
-                        "input_text": " ".join(lemmatized_tokens),
+                        "original": original,
+                        "input_text": input_text,
                         "label": 2,
-                        "tender_id": str(example[7]),
+                        "tender_id": tender_id,
                     }
                 )
+        return examples, inference_examples
+
+    def train(
+        dataset,
+        language,
+        stop_words=[],
+        deleted_words=[],
+        num_workers=PREPROCESS_WORKERS,
+    ):
+        print("Cleaning data...")
+        examples, inference_examples = Trainer.split_examples(
+            Trainer.preprocess_rows(dataset, language, num_workers=num_workers)
+        )
+        return Trainer.fit(
+            examples, inference_examples, stop_words=stop_words, deleted_words=deleted_words
+        )
+
+    def classifier(solver=None):
+        return LogisticRegression(
+            random_state=RANDOM_SEED,
+            class_weight="balanced",
+            C=0.3,
+            solver=solver or load_solver(),
+        )
+
+    def remap_coefficients(previous, vectorizer):
+        """Coefficients of a previous model's classifier for the vocabulary of a new vectorizer, 0 for new terms
+
+        Args:
+            previous (LanguageModelData): Previous model
+            vectorizer (TfidfVectorizer): Fitted vectorizer of the new model
+
+        Returns:
+            np.ndarray: Coefficients of shape (1, size of the new vocabulary)
+        """
+        previous_coef = previous.classifier.coef_[0]
+        previous_vocabulary = previous.vectorizer.vocabulary_
+        coef = np.zeros((1, len(vectorizer.vocabulary_)), dtype=np.float64)
+        for term, index in vectorizer.vocabulary_.items():
+            previous_index = previous_vocabulary.get(term)
+            if previous_index is not None:
+                coef[0, index] = previous_coef[previous_index]
+        return coef
 
+    def fit_classifier(features, labels, vectorizer, previous=None, solver=None):
+        """Fit the classifier, warm-started from the previous model's coefficients when there is one and the
+        solver supports it. The objective has a single optimum, so the result only differs from a cold start
+        within the solver's tolerance.
+
+        Args:
+            features (csr_matrix): Training features
+            labels (np.ndarray): Training labels
+            vectorizer (TfidfVectorizer): Fitted vectorizer the features come from
+            previous (LanguageModelData, optional): Model to start from. Defaults to None (cold start).
+            solver (str, optional): Solver. Defaults to the one picked by solver_benchmark.py.
+
+        Returns:
+            LogisticRegression: Fitted classifier
+        """
+        clf = Trainer.classifier(solver)
+        if (
+            previous is not None
+            and clf.solver in WARM_START_SOLVERS
+            and isinstance(previous.classifier, LogisticRegression)
+            and np.array_equal(previous.classifier.classes_, np.unique(labels))
+        ):
+            clf.warm_start = True
+            clf.coef_ = Trainer.remap_coefficients(previous, vectorizer)
+            clf.intercept_ = np.array(previous.classifier.intercept_, dtype=np.float64)
+        clf.fit(features, labels)
+        clf.warm_start = False
+        return clf
+
+    def fit_counts(tender_data, stop_words=[], deleted_words=[], previous=None):
+        """Retrain on the stored term counts of a model instead of the text. Gives the same vectorizer and features
+        as fit on the same tenders and labels, so deleting or re-enabling words does not need the corpus.
+
+        Args:
+            tender_data (TenderData): Tender data of the previous model, with term counts
+            stop_words (list, optional): Stop words. Defaults to [].
+            deleted_words (list, optional): Words deleted by the analysts. Defaults to [].
+            previous (LanguageModelData, optional): Model to warm-start the classifier from. Defaults to None.
+
+        Returns:
+            LanguageModelData: Retrained model, with the tenders in the same order
+        """
+        print(deleted_words)
+        labels = np.array(tender_data.labels)
+        train_mask = labels < 2
+        print(int(train_mask.sum()), int((~train_mask).sum()))
+
+        print("Training model...")
+        with metrics.phase("vectorize"):
+            vectorizer, all_features = tender_data.term_counts.vectorize(
+                train_mask, stop_words + deleted_words
+            )
+        with metrics.phase("fit"):
+            clf = Trainer.fit_classifier(
+                all_features[train_mask], labels[train_mask], vectorizer, previous
+            )
+        with metrics.phase("predict"):
+            all_preds = clf.predict(all_features)
+            all_predict_probas = clf.predict_proba(all_features)[:, 1]
+
+        new_tender_data = TenderData(
+            all_features,
+            all_preds,
+            all_predict_probas,
+            labels,
+            tender_data.tender_ids,
+            row_index=tender_data.row_index,
+            token_store=tender_data.token_store,
+            term_counts=tender_data.term_counts,
+        )
+        language_model_data = LanguageModelData(
+            clf, vectorizer, stop_words, deleted_words, new_tender_data
+        )
+        print("Success")
+
+        return language_model_data
+
+    def fit(
+        examples, inference_examples, stop_words=[], deleted_words=[], previous=None
+    ):
+        print(deleted_words)
         train_ratio = 0.8
         random.seed(RANDOM_SEED)
         random.shuffle(examples)
@@ -88,25 +344,8 @@ class Trainer:
 
         num_train = int(len(examples) * train_ratio)
         train_examples = examples  # [:num_train] taking everything for train
-        test_examples = inference_examples
 
-        train_texts = [example["input_text"] for example in train_examples]
         train_labels = np.array([example["label"] for example in train_examples])
-        test_texts = [example["input_text"] for example in test_examples]
-
-        if len(stop_words + deleted_words) == 0:
-            print("Obtaining stop words...")
-            vectorizer = TfidfVectorizer(max_df=0.05, min_df=2)
-            _ = vectorizer.fit_transform(train_texts)
-            stop_words = list(vectorizer.stop_words_)
-
-        print("Training model...")
-        vectorizer = TfidfVectorizer(stop_words=stop_words + deleted_words)
-        train_features = vectorizer.fit_transform(train_texts)
-
-        clf = LogisticRegression(
-            random_state=RANDOM_SEED, class_weight="balanced", C=0.3
-        ).fit(train_features, train_labels)
 
         all_texts = [example["input_text"] for example in examples + inference_examples]
         all_tender_ids = [
@@ -115,12 +354,53 @@ class Trainer:
         all_labels = np.array(
             [example["label"] for example in examples + inference_examples]
         )
-        all_features = vectorizer.transform(all_texts)
-        all_preds = clf.predict(all_features)
-        all_predict_probas = clf.predict_proba(all_features)[:, 1]
 
+        # the texts are tokenized and counted once, the stop words, the vocabulary and the features of all
+        # tenders are derived from the counts (see TermCounts.vectorize)
+        print("Counting terms...")
+        with metrics.phase("count"):
+            term_counts = TermCounts.from_texts(all_texts)
+            train_mask = np.arange(len(all_texts)) < len(train_examples)
+            document_frequencies = term_counts.document_frequencies(train_mask)
+
+        if len(stop_words + deleted_words) == 0:
+            print("Obtaining stop words...")
+            stop_words = term_counts.stop_words(
+                train_mask,
+                max_df=0.05,
+                min_df=2,
+                document_frequencies=document_frequencies,
+            )
+
+        print("Training model...")
+        with metrics.phase("vectorize"):
+            vectorizer, all_features = term_counts.vectorize(
+                train_mask, stop_words + deleted_words, document_frequencies
+            )
+        train_features = all_features[: len(train_examples)]
+
+        with metrics.phase("fit"):
+            clf = Trainer.fit_classifier(
+                train_features, train_labels, vectorizer, previous
+            )
+
+        with metrics.phase("predict"):
+            all_preds = clf.predict(all_features)
+            all_predict_probas = clf.predict_proba(all_features)[:, 1]
+
+        with metrics.phase("token_store"):
+            token_store = TokenStore.from_texts(
+                [example["original"] for example in examples + inference_examples],
+                all_texts,
+            )
         tender_data = TenderData(
-            all_features, all_preds, all_predict_probas, all_labels, all_tender_ids
+            all_features,
+            all_preds,
+            all_predict_probas,
+            all_labels,
+            all_tender_ids,
+            token_store=token_store,
+            term_counts=term_counts,
         )
         language_model_data = LanguageModelData(
             clf, vectorizer, stop_words, deleted_words, tender_data
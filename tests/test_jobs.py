@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from jobs import RetrainJob, RetrainJobManager
+
+
+def test_merge_keeps_the_later_request():
+    job = RetrainJob("DE", ["cloud", "data"], ["quantum"])
+    job.merge(["quantum"], ["cloud"], "fast")
+
+    assert job.deleted_words == ["data", "quantum"]
+    assert job.reenabled_words == ["cloud"]
+
+
+def test_merge_runs_in_full_mode_if_any_request_asked():
+    job = RetrainJob("DE", ["cloud"], [], "fast")
+    job.merge([], [], "full")
+    job.merge([], [], "fast")
+
+    assert job.mode == "full"
+
+
+def test_queued_requests_are_applied_in_order(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def retrain(country, deleted_words, reenabled_words, progress, mode):
+        calls.append((list(deleted_words), list(reenabled_words)))
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+
+    manager = RetrainJobManager(retrain, status_directory=str(tmp_path))
+    manager.submit("DE", ["first"], [])
+    assert started.wait(5)
+    manager.submit("DE", ["cloud"], [])
+    queued_job = manager.submit("DE", [], ["cloud"])
+    release.set()
+    deadline = time.monotonic() + 5
+    while manager.busy() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert queued_job.status == "done"
+    assert calls[1] == ([], ["cloud"])
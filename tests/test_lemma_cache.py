@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lemma_cache import LemmaCache
+
+
+def test_concurrent_saves_do_not_fail(tmp_path):
+    caches = []
+    for i in range(8):
+        cache = LemmaCache("german")
+        cache.merge({f"token{i}": f"lemma{i}"})
+        caches.append(cache)
+    errors = []
+
+    def save(cache):
+        try:
+            for _ in range(20):
+                cache.save(str(tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(cache,)) for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path) == [os.path.basename(LemmaCache.path("german"))]
+    loaded = LemmaCache("german")
+    loaded.load(str(tmp_path))
+    assert len(loaded.cache.items()) == 1
+
+
+def test_unreadable_snapshot_loads_empty(tmp_path):
+    with open(LemmaCache.path("german", str(tmp_path)), "wb") as f:
+        f.write(b"not a pickle")
+    cache = LemmaCache("german")
+    cache.load(str(tmp_path))
+    assert cache.cache.items() == []
+
+
+def test_failed_save_is_not_raised(tmp_path):
+    cache = LemmaCache("german")
+    cache.merge({"token": "lemma"})
+    cache.save(str(tmp_path / "missing"))
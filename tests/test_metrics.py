@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "src")
+
+# multiprocess mode is switched on per process, so the scenario runs in its own interpreter
+ARCHIVE_SCENARIO = textwrap.dedent(
+    """
+    import os
+    import sys
+    import metrics
+
+    metrics.init(sys.argv[1])
+    metrics.reset()
+
+    def run_child(num_rows):
+        pid = os.fork()
+        if pid == 0:
+            metrics.DB_QUERY_ROWS.labels(statement="SELECT").inc(num_rows)
+            with metrics.phase("fit"):
+                pass
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    for num_rows in (3, 4, 5):
+        metrics.mark_process_dead(run_child(num_rows))
+    print(metrics.render().decode())
+    """
+)
+
+
+def test_exited_processes_are_archived(tmp_path):
+    directory = tmp_path / "metrics"
+    env = dict(os.environ, PYTHONPATH=SRC_DIRECTORY)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    output = subprocess.run(
+        [sys.executable, "-c", ARCHIVE_SCENARIO, str(directory)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    assert 'dgcnect_db_query_rows_total{statement="SELECT"} 12.0' in output
+    assert 'dgcnect_training_phase_duration_seconds_count{phase="fit"} 3.0' in output
+    assert sorted(name for name in os.listdir(directory) if name.endswith(".db")) == [
+        "counter_archive.db",
+        "histogram_archive.db",
+    ]
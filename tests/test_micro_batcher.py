@@ -0,0 +1,57 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import pytest
+from micro_batcher import MicroBatcher
+
+
+def test_consecutive_batches_are_processed():
+    batches = []
+
+    def process_batch(key, items):
+        batches.append((key, items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(process_batch, max_wait_seconds=0.001, timeout_seconds=5)
+    assert batcher.submit("DE", 1) == 2
+    assert batcher.submit("DE", 2) == 4
+    assert batches == [("DE", [1]), ("DE", [2])]
+
+
+def test_failing_batch_does_not_stop_later_batches():
+    def process_batch(key, items):
+        if key == "bad":
+            raise ValueError("bad batch")
+        return items
+
+    batcher = MicroBatcher(process_batch, max_wait_seconds=0.001, timeout_seconds=5)
+    with pytest.raises(ValueError):
+        batcher.submit("bad", 1)
+    assert batcher.submit("DE", 3) == 3
+
+
+def test_concurrent_items_share_a_batch():
+    ready = threading.Barrier(4)
+    batches = []
+
+    def process_batch(key, items):
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(process_batch, max_wait_seconds=0.2, timeout_seconds=5)
+    results = {}
+
+    def submit(item):
+        ready.wait()
+        results[item] = batcher.submit("DE", item)
+
+    threads = [threading.Thread(target=submit, args=(item,)) for item in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {item: item for item in range(4)}
+    assert sum(len(batch) for batch in batches) == 4